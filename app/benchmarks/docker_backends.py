@@ -0,0 +1,62 @@
+"""
+Compare per-call latency and CPU of the Docker backends on the same host.
+
+Usage (from the app directory):
+    python -m benchmarks.docker_backends --container <server_id> --iterations 200
+"""
+import argparse
+import resource
+import statistics
+import time
+
+from scripts.server.services.docker_backend import set_backend
+
+
+def _cpu_seconds() -> float:
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def measure(backend_name: str, container_id: str, iterations: int):
+    backend = set_backend(backend_name)
+    operations = {
+        "exists": lambda: backend.exists(container_id),
+        "inspect": lambda: backend.inspect(container_id),
+    }
+
+    results = {}
+    for op, call in operations.items():
+        call()  # warm up connections and caches
+        samples = []
+        cpu_start = _cpu_seconds()
+        for _ in range(iterations):
+            start = time.perf_counter()
+            call()
+            samples.append((time.perf_counter() - start) * 1000)
+        cpu = _cpu_seconds() - cpu_start
+
+        samples.sort()
+        results[op] = {
+            "p50_ms": statistics.median(samples),
+            "p95_ms": samples[int(len(samples) * 0.95) - 1],
+            "cpu_ms_per_call": cpu * 1000 / iterations,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--container", required=True, help="name of an existing container")
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--backends", nargs="+", default=["cli", "api"])
+    args = parser.parse_args()
+
+    print(f"{'backend':<8} {'op':<8} {'p50 ms':>9} {'p95 ms':>9} {'cpu ms/call':>12}")
+    for name in args.backends:
+        for op, stats in measure(name, args.container, args.iterations).items():
+            print(f"{name:<8} {op:<8} {stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['cpu_ms_per_call']:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
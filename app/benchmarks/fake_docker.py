@@ -0,0 +1,373 @@
+"""
+In-memory Docker Engine API stub served on a unix socket, enough of it for the calls this backend makes.
+
+Containers boot instantly and report healthy after --boot-ms, running containers print a log line
+every --log-interval-ms. Point DOCKER_SOCKET (API backend) or DOCKER_HOST (CLI backend) at it:
+    python -m benchmarks.fake_docker --socket /tmp/fake-docker.sock --containers 200 --latency-ms 2
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import re
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, List, Optional, Set
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+MINECRAFT_PORT = 25565
+VERSION_PREFIX = re.compile(r"^/v[0-9.]+(?=/)")
+CONTAINER_REF = re.compile(r"/containers/(?!json$|create$)[^/]+")
+
+
+def _now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+class PortAllocated(Exception):
+    pass
+
+
+class FakeDocker:
+    """Container and image state shared by the API routes."""
+
+    def __init__(self, boot_ms: float, log_interval_ms: float):
+        self.boot_ms = boot_ms
+        self.log_interval_ms = log_interval_ms
+        self.containers: Dict[str, Dict[str, Any]] = {}
+        self.images: Set[str] = set()
+        self.calls: Counter = Counter()
+        self._listeners: Set[asyncio.Queue] = set()
+        self._next_port = 30000
+
+    def add(self, name: str, image: str, env: List[str], running: bool = False,
+            host_config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        container = {
+            "Id": uuid.uuid4().hex + uuid.uuid4().hex,
+            "Name": f"/{name}",
+            "Image": image,
+            "Created": _now(),
+            "Config": {"Image": image, "Env": env, "Tty": True, "Labels": {}},
+            "State": {"Status": "created", "Running": False, "ExitCode": 0, "StartedAt": "", "FinishedAt": ""},
+            "NetworkSettings": {"Ports": {}},
+            "HostConfig": host_config or {},
+            "Logs": 0,
+        }
+        self.containers[name] = container
+        if running:
+            self.start(name, boot_ms=0)
+        return container
+
+    def find(self, ref: str) -> Optional[Dict[str, Any]]:
+        ref = ref.lstrip("/")
+        container = self.containers.get(ref)
+        if container is not None:
+            return container
+        return next((c for c in self.containers.values() if c["Id"].startswith(ref)), None)
+
+    def published(self) -> Set[str]:
+        return {bindings[0]["HostPort"] for c in self.containers.values() if c["State"]["Running"]
+                for bindings in c["NetworkSettings"]["Ports"].values()}
+
+    def start(self, name: str, boot_ms: Optional[float] = None) -> None:
+        container = self.containers[name]
+        if container["State"]["Running"]:
+            return
+        # Honour a requested host port like dockerd does, "0" or none picks a free one
+        requested = (container["HostConfig"].get("PortBindings") or {}).get(f"{MINECRAFT_PORT}/tcp") or [{}]
+        host_port = str(requested[0].get("HostPort") or "0")
+        if host_port == "0":
+            self._next_port += 1
+            host_port = str(self._next_port)
+        elif host_port in self.published():
+            raise PortAllocated(f"Bind for 0.0.0.0:{host_port} failed: port is already allocated")
+        container["NetworkSettings"]["Ports"] = {f"{MINECRAFT_PORT}/tcp": [{"HostIp": "0.0.0.0", "HostPort": host_port}]}
+        # Every container's RCON port is the one fake RCON server on the loopback
+        container["NetworkSettings"]["IPAddress"] = "127.0.0.1"
+        container["State"].update({"Status": "running", "Running": True, "StartedAt": _now(), "Health": {"Status": "starting"}})
+        self.emit(name, "start")
+
+        boot_ms = self.boot_ms if boot_ms is None else boot_ms
+        if boot_ms:
+            asyncio.get_event_loop().call_later(boot_ms / 1000, self._healthy, name, container["Id"])
+        else:
+            container["State"]["Health"]["Status"] = "healthy"
+
+    def _healthy(self, name: str, container_id: str) -> None:
+        container = self.containers.get(name)
+        if container is None or container["Id"] != container_id or not container["State"]["Running"]:
+            return
+        container["State"]["Health"]["Status"] = "healthy"
+        self.emit(name, "health_status: healthy")
+
+    def stop(self, name: str) -> None:
+        container = self.containers[name]
+        if not container["State"]["Running"]:
+            return
+        container["State"].update({"Status": "exited", "Running": False, "FinishedAt": _now()})
+        container["State"].pop("Health", None)
+        self.emit(name, "die")
+        self.emit(name, "stop")
+
+    def remove(self, name: str) -> None:
+        del self.containers[name]
+        self.emit(name, "destroy")
+
+    def emit(self, name: str, action: str) -> None:
+        event = {"Type": "container", "Action": action, "status": action,
+                 "Actor": {"Attributes": {"name": name}}, "time": int(time.time()), "timeNano": time.time_ns()}
+        for queue in self._listeners:
+            queue.put_nowait(event)
+
+    def summary(self, container: Dict[str, Any]) -> Dict[str, Any]:
+        state = container["State"]
+        if state["Running"]:
+            health = (state.get("Health") or {}).get("Status")
+            status_text = "Up 5 minutes" + {"healthy": " (healthy)", "starting": " (health: starting)"}.get(health, "")
+        else:
+            status_text = "Exited (0) 5 minutes ago"
+        ports = [{"IP": "0.0.0.0", "PrivatePort": MINECRAFT_PORT, "PublicPort": int(bindings[0]["HostPort"]), "Type": "tcp"}
+                 for bindings in container["NetworkSettings"]["Ports"].values()]
+        return {"Id": container["Id"], "Names": [container["Name"]], "Image": container["Image"],
+                "State": state["Status"], "Status": status_text, "Ports": ports, "Labels": {}}
+
+    def log_line(self, container: Dict[str, Any]) -> str:
+        container["Logs"] += 1
+        return f"[{time.strftime('%H:%M:%S')} INFO]: {container['Name'][1:]} tick {container['Logs']}\n"
+
+    def has_image(self, name: str) -> bool:
+        return name in self.images or f"{name}:latest" in self.images
+
+    def listen(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        self._listeners.add(queue)
+        return queue
+
+    def unlisten(self, queue: asyncio.Queue) -> None:
+        self._listeners.discard(queue)
+
+    def drop_streams(self) -> None:
+        """End every events stream, as a daemon restart would."""
+        for queue in self._listeners:
+            queue.put_nowait(None)
+
+
+def _not_found(what: str) -> JSONResponse:
+    return JSONResponse({"message": f"No such {what}"}, status_code=404)
+
+
+def _name_matches(container: Dict[str, Any], filters: Optional[str]) -> bool:
+    if not filters:
+        return True
+    patterns = json.loads(filters).get("name") or []
+    return not patterns or any(re.search(pattern, container["Name"]) for pattern in patterns)
+
+
+def create_app(latency_ms: float = 0.0, containers: int = 0, running_ratio: float = 0.5,
+               boot_ms: float = 1000.0, log_interval_ms: float = 200.0,
+               image: str = "itzg/minecraft-server:latest") -> FastAPI:
+    app = FastAPI()
+    docker = FakeDocker(boot_ms, log_interval_ms)
+    docker.images.add(image)
+    for i in range(containers):
+        docker.add(f"bench-{i}", image, ["EULA=TRUE"], running=i < containers * running_ratio)
+    app.state.docker = docker
+
+    @app.middleware("http")
+    async def strip_version(request: Request, call_next):
+        # Clients address /v1.41/containers/..., the routes below are unversioned
+        path = VERSION_PREFIX.sub("", request.scope["path"])
+        request.scope["path"] = path
+        docker.calls[f"{request.method} {CONTAINER_REF.sub('/containers/{id}', path)}"] += 1
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+        return await call_next(request)
+
+    @app.get("/_ping")
+    async def ping():
+        return Response("OK", media_type="text/plain")
+
+    @app.get("/version")
+    async def version():
+        return {"Version": "24.0.0-fake", "ApiVersion": "1.43", "MinAPIVersion": "1.12", "Os": "linux", "Arch": "amd64"}
+
+    @app.get("/info")
+    async def info():
+        running = sum(1 for c in docker.containers.values() if c["State"]["Running"])
+        return {"ID": "fake", "Containers": len(docker.containers), "ContainersRunning": running,
+                "Images": len(docker.images), "ServerVersion": "24.0.0-fake", "OperatingSystem": "fake",
+                "NCPU": 16, "MemTotal": 64 << 30}
+
+    @app.get("/containers/json")
+    async def list_containers(all: str = "0", filters: Optional[str] = None):
+        return [docker.summary(c) for c in docker.containers.values()
+                if (all in ("1", "true") or c["State"]["Running"]) and _name_matches(c, filters)]
+
+    @app.get("/containers/{ref}/json")
+    async def inspect_container(ref: str):
+        container = docker.find(ref)
+        if container is None:
+            return _not_found(f"container: {ref}")
+        return {key: value for key, value in container.items() if key != "Logs"}
+
+    @app.post("/containers/create")
+    async def create_container(name: str, request: Request):
+        body = await request.json()
+        if not docker.has_image(body["Image"]):
+            return _not_found(f"image: {body['Image']}")
+        if name in docker.containers:
+            return JSONResponse({"message": f"Conflict. The container name \"/{name}\" is already in use"},
+                                status_code=409)
+        container = docker.add(name, body["Image"], body.get("Env") or [], host_config=body.get("HostConfig"))
+        docker.emit(name, "create")
+        return JSONResponse({"Id": container["Id"], "Warnings": []}, status_code=201)
+
+    @app.post("/containers/{ref}/start")
+    async def start_container(ref: str):
+        container = docker.find(ref)
+        if container is None:
+            return _not_found(f"container: {ref}")
+        try:
+            docker.start(container["Name"][1:])
+        except PortAllocated as e:
+            return JSONResponse({"message": str(e)}, status_code=500)
+        return Response(status_code=204)
+
+    @app.post("/containers/{ref}/stop")
+    async def stop_container(ref: str):
+        container = docker.find(ref)
+        if container is None:
+            return _not_found(f"container: {ref}")
+        docker.stop(container["Name"][1:])
+        return Response(status_code=204)
+
+    @app.delete("/containers/{ref}")
+    async def remove_container(ref: str, force: str = "0"):
+        container = docker.find(ref)
+        if container is None:
+            return _not_found(f"container: {ref}")
+        if container["State"]["Running"] and force not in ("1", "true"):
+            return JSONResponse({"message": "You cannot remove a running container"}, status_code=409)
+        docker.remove(container["Name"][1:])
+        return Response(status_code=204)
+
+    @app.get("/containers/{ref}/logs")
+    async def container_logs(ref: str, follow: str = "0", tail: str = "all", timestamps: str = "0",
+                             since: float = 0):
+        container = docker.find(ref)
+        if container is None:
+            return _not_found(f"container: {ref}")
+
+        def stamped(line: str, at: float) -> str:
+            if timestamps not in ("1", "true"):
+                return line
+            moment = datetime.datetime.fromtimestamp(at, datetime.timezone.utc)
+            return f"{moment.strftime('%Y-%m-%dT%H:%M:%S.%f')}000Z {line}"
+
+        # Earlier lines are dated back one log interval each
+        now = time.time()
+        count = container["Logs"] if tail == "all" else min(int(tail), container["Logs"])
+        written = [(n, now - (container["Logs"] - n) * docker.log_interval_ms / 1000)
+                   for n in range(container["Logs"] - count + 1, container["Logs"] + 1)]
+        backlog = "".join(stamped(f"[00:00:00 INFO]: {container['Name'][1:]} tick {n}\n", at)
+                          for n, at in written if at >= since)
+        if follow not in ("1", "true"):
+            return Response(backlog, media_type="application/vnd.docker.raw-stream")
+
+        async def stream():
+            yield backlog.encode()
+            while container["State"]["Running"] and docker.find(ref) is container:
+                await asyncio.sleep(docker.log_interval_ms / 1000)
+                yield stamped(docker.log_line(container), time.time()).encode()
+
+        return StreamingResponse(stream(), media_type="application/vnd.docker.raw-stream")
+
+    @app.get("/containers/{ref}/stats")
+    async def container_stats(ref: str, stream: str = "1"):
+        container = docker.find(ref)
+        if container is None:
+            return _not_found(f"container: {ref}")
+
+        def sample(tick: int) -> Dict[str, Any]:
+            # Counters grow steadily: 25% of one of 4 CPUs and 10 KB/s in, 50 KB/s out
+            return {
+                "read": _now(),
+                "cpu_stats": {"cpu_usage": {"total_usage": tick * 250_000_000}, "system_cpu_usage": tick * 4_000_000_000,
+                              "online_cpus": 4},
+                "precpu_stats": ({"cpu_usage": {"total_usage": (tick - 1) * 250_000_000},
+                                  "system_cpu_usage": (tick - 1) * 4_000_000_000, "online_cpus": 4} if tick else {}),
+                "memory_stats": {"usage": (900 << 20) + tick % 64 * (1 << 20), "limit": 2 << 30,
+                                 "stats": {"inactive_file": 100 << 20}},
+                "networks": {"eth0": {"rx_bytes": tick * 10_000, "tx_bytes": tick * 50_000}},
+            }
+
+        if stream not in ("1", "true"):
+            return JSONResponse(sample(1))
+
+        async def samples():
+            tick = 0
+            while docker.find(ref) is container:
+                yield json.dumps(sample(tick) if container["State"]["Running"] else {"read": _now()}) + "\n"
+                tick += 1
+                await asyncio.sleep(1)
+
+        return StreamingResponse(samples(), media_type="application/json")
+
+    @app.get("/images/{name:path}/json")
+    async def inspect_image(name: str):
+        if not docker.has_image(name):
+            return _not_found(f"image: {name}")
+        return {"Id": f"sha256:{uuid.uuid5(uuid.NAMESPACE_URL, name).hex}", "RepoTags": [name]}
+
+    @app.post("/images/create")
+    async def pull_image(fromImage: str, tag: str = "latest"):
+        async def stream():
+            for layer in ("a1", "b2", "c3"):
+                yield json.dumps({"status": "Downloading", "id": layer,
+                                  "progressDetail": {"current": 50, "total": 100}}) + "\n"
+                await asyncio.sleep(0.01)
+                yield json.dumps({"status": "Pull complete", "id": layer}) + "\n"
+            docker.images.add(f"{fromImage}:{tag}")
+            yield json.dumps({"status": f"Status: Downloaded newer image for {fromImage}:{tag}"}) + "\n"
+
+        return StreamingResponse(stream(), media_type="application/json")
+
+    @app.get("/events")
+    async def events():
+        queue = docker.listen()
+
+        async def stream():
+            try:
+                while True:
+                    event = await queue.get()
+                    if event is None:
+                        return
+                    yield json.dumps(event) + "\n"
+            finally:
+                docker.unlisten(queue)
+
+        return StreamingResponse(stream(), media_type="application/json")
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default="/tmp/fake-docker.sock")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay added to every API call")
+    parser.add_argument("--containers", type=int, default=0, help="pre-created containers named bench-<n>")
+    parser.add_argument("--running-ratio", type=float, default=0.5, help="share of pre-created containers running")
+    parser.add_argument("--boot-ms", type=float, default=1000.0, help="time from start to healthy")
+    parser.add_argument("--log-interval-ms", type=float, default=200.0)
+    args = parser.parse_args()
+    app = create_app(args.latency_ms, args.containers, args.running_ratio, args.boot_ms, args.log_interval_ms)
+    uvicorn.run(app, uds=args.socket, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+In-memory PostgREST-compatible stub, enough of it for the `servers` table queries this backend makes.
+
+Point SUPABASE_URL at it to run the API without a Supabase project:
+    python -m benchmarks.fake_postgrest --port 54321 --latency-ms 20
+"""
+import argparse
+import asyncio
+import datetime
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+
+# Unique constraints per table, mirrors the production schema
+UNIQUE = {"servers": [("user_id", "name")]}
+RESERVED_PARAMS = {"select", "on_conflict", "order", "limit", "offset", "columns"}
+
+
+def _parse_filters(request: Request) -> List[Tuple[str, str, Optional[str]]]:
+    filters = []
+    for column, expression in request.query_params.items():
+        if column in RESERVED_PARAMS:
+            continue
+        operator, _, value = expression.partition(".")
+        filters.append((column, operator, value))
+    return filters
+
+
+def _matches(row: Dict[str, Any], filters) -> bool:
+    for column, operator, value in filters:
+        if operator == "eq" and str(row.get(column)) != value:
+            return False
+        if operator == "is" and value == "null" and row.get(column) is not None:
+            return False
+        if operator == "in" and str(row.get(column)) not in value.strip("()").split(","):
+            return False
+    return True
+
+
+def create_app(latency_ms: float = 0.0, rows: Optional[Dict[str, List[Dict[str, Any]]]] = None) -> FastAPI:
+    app = FastAPI()
+    tables: Dict[str, List[Dict[str, Any]]] = rows if rows is not None else {}
+    app.state.tables = tables
+    app.state.queries = 0
+
+    async def delay():
+        app.state.queries += 1
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+
+    def wants_object(request: Request) -> bool:
+        return "vnd.pgrst.object" in request.headers.get("accept", "")
+
+    def result(request: Request, data: List[Dict[str, Any]], status_code: int = 200) -> Response:
+        if "return=minimal" in request.headers.get("prefer", ""):
+            return Response(status_code=204 if status_code == 200 else status_code)
+        if wants_object(request):
+            if len(data) != 1:
+                return JSONResponse({"code": "PGRST116", "message": "JSON object requested, multiple (or no) rows returned"},
+                                    status_code=406)
+            return JSONResponse(data[0], status_code=status_code)
+        return JSONResponse(data, status_code=status_code)
+
+    @app.get("/rest/v1/{table}")
+    async def select(table: str, request: Request):
+        await delay()
+        filters = _parse_filters(request)
+        return result(request, [row for row in tables.get(table, []) if _matches(row, filters)])
+
+    @app.post("/rest/v1/{table}")
+    async def insert(table: str, request: Request):
+        await delay()
+        body = await request.json()
+        prefer = request.headers.get("prefer", "")
+        on_conflict = request.query_params.get("on_conflict")
+        if on_conflict and tuple(on_conflict.split(",")) not in UNIQUE.get(table, []):
+            return JSONResponse({"code": "42P10", "message": "there is no unique or exclusion constraint matching "
+                                                              "the ON CONFLICT specification"}, status_code=400)
+        existing = tables.setdefault(table, [])
+        inserted = []
+        for values in body if isinstance(body, list) else [body]:
+            row = {"id": str(uuid.uuid4()), "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                   "deleted_at": None, **values}
+            conflict = next((other for other in existing for columns in UNIQUE.get(table, [])
+                             if all(other.get(c) == row.get(c) for c in columns)), None)
+            if conflict is not None:
+                if "ignore-duplicates" in prefer:
+                    continue
+                if "merge-duplicates" in prefer:
+                    conflict.update(values)
+                    inserted.append(conflict)
+                    continue
+                return JSONResponse({"code": "23505", "message": "duplicate key value violates unique constraint"},
+                                    status_code=409)
+            existing.append(row)
+            inserted.append(row)
+        if "return=representation" not in prefer:
+            return Response(status_code=201)
+        return result(request, inserted, status_code=201)
+
+    @app.patch("/rest/v1/{table}")
+    async def update(table: str, request: Request):
+        await delay()
+        values = await request.json()
+        filters = _parse_filters(request)
+        updated = [row for row in tables.get(table, []) if _matches(row, filters)]
+        for row in updated:
+            row.update(values)
+        return result(request, updated)
+
+    @app.delete("/rest/v1/{table}")
+    async def delete(table: str, request: Request):
+        await delay()
+        filters = _parse_filters(request)
+        removed = [row for row in tables.get(table, []) if _matches(row, filters)]
+        tables[table] = [row for row in tables.get(table, []) if not _matches(row, filters)]
+        return result(request, removed)
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay added to every query")
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.latency_ms), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Minecraft RCON stub: accepts any password and answers every command right away.
+
+`help` answers with more than one packet's worth of text, like a real server with many commands.
+"""
+import asyncio
+import struct
+
+MAX_CHUNK = 4096
+HELP_TEXT = "".join(f"/command{n} <arguments>\n" for n in range(500))
+
+
+def _packet(request_id: int, packet_type: int, payload: str) -> bytes:
+    body = struct.pack("<ii", request_id, packet_type) + payload.encode("utf-8") + b"\x00\x00"
+    return struct.pack("<i", len(body)) + body
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    logged_in = False
+    try:
+        while True:
+            length = struct.unpack("<i", await reader.readexactly(4))[0]
+            data = await reader.readexactly(length)
+            request_id, packet_type = struct.unpack("<ii", data[:8])
+            payload = data[8:-2].decode("utf-8")
+            if packet_type == 3:
+                logged_in = bool(payload)
+                writer.write(_packet(request_id if logged_in else -1, 2, ""))
+            elif not logged_in:
+                writer.write(_packet(-1, 2, ""))
+            elif packet_type == 2:
+                output = HELP_TEXT if payload == "help" else f"Ran {payload}"
+                # Long output is split over packets of the same ID, as the server does
+                for start in range(0, max(len(output), 1), MAX_CHUNK):
+                    writer.write(_packet(request_id, 0, output[start:start + MAX_CHUNK]))
+            else:
+                writer.write(_packet(request_id, 0, f"Unknown request {packet_type:x}"))
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host: str, port: int) -> None:
+    server = await asyncio.start_server(_handle, host, port)
+    async with server:
+        await server.serve_forever()
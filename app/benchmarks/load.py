@@ -0,0 +1,63 @@
+"""
+Fire concurrent requests at a running backend and report throughput and latency.
+
+Run it against the same deployment before and after a change to compare, e.g.:
+    python -m benchmarks.load --url http://localhost --token $JWT --path /servers --concurrency 32 --requests 2000
+    python -m benchmarks.load --url http://localhost --token $JWT --method POST --path /servers/<id>/start --concurrency 4 --requests 8
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def worker(client: httpx.AsyncClient, method: str, paths, remaining, samples, errors):
+    while remaining:
+        remaining.pop()
+        path = paths[len(remaining) % len(paths)]
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, path)
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+        samples.append((time.perf_counter() - start) * 1000)
+
+
+async def run(args):
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, headers=headers, limits=limits, timeout=args.timeout) as client:
+        remaining = list(range(args.requests))
+        samples, errors = [], []
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client, args.method, args.path, remaining, samples, errors)
+                               for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+
+    samples.sort()
+    print(f"requests:   {len(samples)} ({len(errors)} errors) in {elapsed:.2f}s")
+    print(f"throughput: {len(samples) / elapsed:.1f} req/s at concurrency {args.concurrency}")
+    print(f"latency:    p50 {statistics.median(samples):.1f} ms, "
+          f"p95 {samples[int(len(samples) * 0.95) - 1]:.1f} ms, max {samples[-1]:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost")
+    parser.add_argument("--token", help="Supabase access token sent as bearer token")
+    parser.add_argument("--method", default="GET")
+    parser.add_argument("--path", action="append", help="request path, repeat to rotate through several")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+    args.path = args.path or ["/servers"]
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,474 @@
+"""
+Offline benchmark of the whole API: runs `main:app` against a fake Docker socket and a fake PostgREST,
+drives scripted load at the hot endpoints and reports latency, throughput and subprocess counts.
+
+Usage (from the app directory):
+    python -m benchmarks.suite --output benchmarks/results/before.json
+    python -m benchmarks.suite --backend cli --docker-latency-ms 5 --compare benchmarks/results/before.json
+
+Needs uvicorn and websockets (both in the server image). The CLI backend also needs the docker CLI,
+which is pointed at the fake socket through DOCKER_HOST.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+import jwt
+
+from benchmarks import fake_docker, fake_postgrest, fake_rcon
+
+JWT_SECRET = "benchmark-secret-not-for-production-use"
+JWT_ISSUER = "http://127.0.0.1/auth/v1"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _percentile(ordered: List[float], pct: float) -> Optional[float]:
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, int(round(len(ordered) * pct / 100)) - 1))]
+
+
+def _token(user_id: str) -> str:
+    claims = {"sub": user_id, "aud": "authenticated", "iss": JWT_ISSUER, "exp": int(time.time()) + 3600}
+    return jwt.encode(claims, JWT_SECRET, algorithm="HS256")
+
+
+class StandIns:
+    """Fake Docker daemons (one per host), PostgREST and RCON running on an event loop in a background thread."""
+
+    def __init__(self, args, workdir: str):
+        import uvicorn
+
+        self.socket_paths = [os.path.join(workdir, "docker.sock" if i == 0 else f"docker-{i}.sock")
+                             for i in range(args.hosts)]
+        self.db_port = _free_port()
+        self.rcon_port = _free_port()
+        self.docker_apps = [fake_docker.create_app(args.docker_latency_ms, args.containers, args.running_ratio,
+                                                   args.boot_ms, args.log_interval_ms) for _ in self.socket_paths]
+        self.db_app = fake_postgrest.create_app(args.db_latency_ms)
+        self._servers = [
+            uvicorn.Server(uvicorn.Config(docker_app, uds=socket_path, log_level="warning"))
+            for docker_app, socket_path in zip(self.docker_apps, self.socket_paths)
+        ]
+        self._servers.append(
+            uvicorn.Server(uvicorn.Config(self.db_app, host="127.0.0.1", port=self.db_port, log_level="warning")))
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def socket_path(self) -> str:
+        return self.socket_paths[0]
+
+    @property
+    def dockers(self) -> List[fake_docker.FakeDocker]:
+        return [docker_app.state.docker for docker_app in self.docker_apps]
+
+    def hosts(self) -> List[Dict[str, str]]:
+        """DOCKER_HOSTS entries for the fake daemons, named host-0, host-1, ..."""
+        return [{"name": f"host-{i}", "endpoint": f"unix://{socket_path}", "public_ip": "127.0.0.1"}
+                for i, socket_path in enumerate(self.socket_paths)]
+
+    def _run(self) -> None:
+        async def serve():
+            rcon = asyncio.ensure_future(fake_rcon.serve("127.0.0.1", self.rcon_port))
+            await asyncio.gather(*(server.serve() for server in self._servers))
+            rcon.cancel()
+
+        asyncio.run(serve())
+
+    def start(self) -> None:
+        self._thread.start()
+        while not all(server.started for server in self._servers):
+            if not self._thread.is_alive():
+                raise RuntimeError("Fake Docker or PostgREST failed to start")
+            time.sleep(0.05)
+
+    def stop(self) -> None:
+        for server in self._servers:
+            server.should_exit = True
+        self._thread.join(10)
+
+    def counters(self) -> Dict[str, int]:
+        return {"docker_calls": sum(sum(docker.calls.values()) for docker in self.dockers),
+                "db_queries": self.db_app.state.queries}
+
+
+def seed(args, stand_ins: StandIns, workdir: str) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Create server rows and their containers, half of them running, spread over the fake hosts.
+    Returns the rows per user.
+    """
+    rows = stand_ins.db_app.state.tables.setdefault("servers", [])
+    by_user: Dict[str, List[Dict[str, Any]]] = {}
+    placements: Dict[str, str] = {}
+    hosts = stand_ins.hosts()
+    for u in range(args.users):
+        user_id = str(uuid.uuid4())
+        for s in range(args.servers_per_user):
+            row = {"id": str(uuid.uuid4()), "user_id": user_id, "name": f"server-{s}", "type": "PAPER",
+                   "version": "1.21.1", "created_at": "2025-01-01T00:00:00+00:00", "deleted_at": None}
+            rows.append(row)
+            by_user.setdefault(user_id, []).append(row)
+            index = len(rows) % len(hosts)
+            placements[row["id"]] = hosts[index]["name"]
+            stand_ins.dockers[index].add(row["id"], "itzg/minecraft-server:latest", ["EULA=TRUE"], running=s % 2 == 0)
+
+    if len(hosts) > 1:
+        os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+        with open(os.path.join(workdir, "data", "placements.json"), "w") as f:
+            json.dump({"servers": placements}, f)
+    return by_user
+
+
+def serve_app(port: int) -> None:
+    """Child process entry point: run main:app, counting every subprocess it spawns."""
+    import uvicorn
+
+    spawned = {"count": 0}
+    original_init = subprocess.Popen.__init__
+
+    def counting_init(self, *args, **kwargs):
+        spawned["count"] += 1
+        original_init(self, *args, **kwargs)
+
+    subprocess.Popen.__init__ = counting_init
+
+    from main import app
+
+    @app.get("/_bench/stats")
+    def bench_stats():
+        return {"subprocesses": spawned["count"]}
+
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def launch_app(args, stand_ins: StandIns, workdir: str) -> Tuple[subprocess.Popen, str, float]:
+    """Start the app and wait for it to serve. Also returns the milliseconds from spawn to first response."""
+    port = _free_port()
+    env = dict(
+        os.environ,
+        DOCKER_BACKEND=args.backend,
+        DOCKER_SOCKET=stand_ins.socket_path,
+        DOCKER_HOST=f"unix://{stand_ins.socket_path}",
+        SUPABASE_URL=f"http://127.0.0.1:{stand_ins.db_port}",
+        SUPABASE_SERVICE_ROLE_KEY="benchmark",
+        SUPABASE_JWT_SECRET=JWT_SECRET,
+        SUPABASE_URL_v1=JWT_ISSUER,
+        HOST_PWD=workdir,
+        WARM_POOL_ENABLED="false",
+        PING_HOST="127.0.0.1",
+        RCON_PORT=str(stand_ins.rcon_port),
+        RCON_RATE="1000",
+        RCON_BURST="1000",
+        # Seeded containers would fill this machine's RAM, scenarios measure starts that are not queued
+        ADMISSION_MEMORY="1T",
+        DOCKER_HOSTS=json.dumps(stand_ins.hosts()) if args.hosts > 1 else "",
+    )
+    process = subprocess.Popen([sys.executable, "-m", "benchmarks.suite", "--serve-app", str(port)],
+                               cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), env=env)
+    url = f"http://127.0.0.1:{port}"
+    spawned = time.monotonic()
+    while time.monotonic() < spawned + 60:
+        if process.poll() is not None:
+            raise RuntimeError(f"App exited during startup with code {process.returncode}")
+        try:
+            httpx.get(url + "/healthz", timeout=1)
+            return process, url, (time.monotonic() - spawned) * 1000
+        except httpx.HTTPError:
+            time.sleep(0.02)
+    process.kill()
+    raise RuntimeError("App did not come up within 60s")
+
+
+async def drive(concurrency: int, calls: List[Callable[[], Awaitable[Any]]]) -> Dict[str, Any]:
+    """Run the calls with bounded concurrency, timing each. A call fails by raising."""
+    samples: List[float] = []
+    errors: Dict[str, int] = {}
+    pending = list(reversed(calls))
+
+    async def worker():
+        while pending:
+            call = pending.pop()
+            start = time.perf_counter()
+            try:
+                await call()
+                samples.append((time.perf_counter() - start) * 1000)
+            except Exception as e:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    samples.sort()
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "seconds": elapsed,
+        "throughput": len(samples) / elapsed if elapsed else 0.0,
+        "p50_ms": _percentile(samples, 50),
+        "p95_ms": _percentile(samples, 95),
+        "p99_ms": _percentile(samples, 99),
+        "max_ms": samples[-1] if samples else None,
+    }
+
+
+async def _checked(response_future: Awaitable[httpx.Response]) -> httpx.Response:
+    response = await response_future
+    if response.status_code >= 400 or not response.json().get("success", True):
+        raise RuntimeError(f"HTTP {response.status_code}")
+    return response
+
+
+async def run_scenarios(args, url: str, stand_ins: StandIns,
+                        by_user: Dict[str, List[Dict[str, Any]]]) -> Dict[str, Dict[str, Any]]:
+    """Run every scenario back to back, attributing subprocess, Docker and database counts to each."""
+    tokens = {user_id: {"Authorization": f"Bearer {_token(user_id)}"} for user_id in by_user}
+    servers = [(row, tokens[user_id]) for user_id, rows in by_user.items() for row in rows]
+    running = [entry for i, entry in enumerate(servers) if i % args.servers_per_user % 2 == 0]
+    stopped = [entry for i, entry in enumerate(servers) if i % args.servers_per_user % 2 == 1]
+    users = list(tokens.values())
+    results: Dict[str, Dict[str, Any]] = {}
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=args.timeout) as client:
+        async def counters() -> Dict[str, int]:
+            stats = (await client.get("/_bench/stats")).json()
+            return dict(stand_ins.counters(), subprocesses=stats["subprocesses"])
+
+        async def measure(name: str, scenario: Awaitable[Dict[str, Any]]) -> None:
+            before = await counters()
+            results[name] = await scenario
+            after = await counters()
+            results[name].update({key: after[key] - before[key] for key in after})
+
+        await measure("list", drive(args.concurrency, [
+            (lambda h=users[i % len(users)]: _checked(client.get("/servers", headers=h)))
+            for i in range(args.requests)
+        ]))
+        await measure("get", drive(args.concurrency, [
+            (lambda e=servers[i % len(servers)]: _checked(client.post(f"/servers/{e[0]['id']}", headers=e[1])))
+            for i in range(args.requests)
+        ]))
+        await measure("stats", drive(args.concurrency, [
+            (lambda e=running[i % len(running)]: _checked(client.get(f"/servers/{e[0]['id']}/stats", headers=e[1])))
+            for i in range(args.requests)
+        ]))
+
+        # Starts are measured twice: the submit call, and from submit until the job reports healthy
+        jobs: List[Tuple[Dict[str, Any], Dict[str, str], str, float]] = []
+
+        async def submit(row, headers):
+            submitted = time.perf_counter()
+            response = await _checked(client.post(f"/servers/{row['id']}/start", headers=headers))
+            jobs.append((row, headers, response.json()["data"]["id"], submitted))
+
+        await measure("start", drive(args.concurrency, [
+            (lambda e=entry: submit(*e)) for entry in stopped[:args.starts]
+        ]))
+
+        ready_ms: List[float] = []
+
+        async def wait_ready(row, headers, job_id, submitted):
+            while True:
+                job = (await _checked(client.get(f"/servers/{row['id']}/start/{job_id}", headers=headers))).json()["data"]
+                if job["stage"] == "healthy":
+                    ready_ms.append((time.perf_counter() - submitted) * 1000)
+                    return
+                if job["stage"] == "failed":
+                    raise RuntimeError(job["error"])
+                await asyncio.sleep(0.05)
+
+        await measure("start_to_healthy", drive(len(jobs) or 1, [(lambda j=job: wait_ready(*j)) for job in jobs]))
+        ready_ms.sort()
+        results["start_to_healthy"].update(p50_ms=_percentile(ready_ms, 50), p95_ms=_percentile(ready_ms, 95),
+                                           p99_ms=_percentile(ready_ms, 99), max_ms=ready_ms[-1] if ready_ms else None)
+
+        await measure("stop", drive(args.concurrency, [
+            (lambda e=entry: _checked(client.post(f"/servers/{e[0]['id']}/stop", headers=e[1])))
+            for entry in running[:args.stops]
+        ]))
+
+        if args.viewers:
+            await measure("console", run_console(args, url, [row["id"] for row, _ in stopped[:args.starts]]))
+        if args.commands:
+            await measure("command", run_commands(args, url, [(row["id"], headers) for row, headers in stopped[:args.starts]]))
+    return results
+
+
+async def run_console(args, url: str, server_ids: List[str]) -> Dict[str, Any]:
+    """Open `viewers` console websockets spread over the started servers, time to first line and lines/s."""
+    import websockets
+
+    ws_url = url.replace("http://", "ws://")
+    first_line_ms: List[float] = []
+    lines = [0]
+
+    async def view(server_id: str):
+        connecting = time.perf_counter()
+        async with websockets.connect(f"{ws_url}/ws/console/{server_id}") as ws:
+            message = await ws.recv()
+            if message.startswith("[ERROR]"):
+                raise RuntimeError(message)
+            first_line = time.perf_counter()
+            first_line_ms.append((first_line - connecting) * 1000)
+            try:
+                while time.perf_counter() - first_line < args.console_seconds:
+                    await asyncio.wait_for(ws.recv(), args.console_seconds)
+                    lines[0] += 1
+            except asyncio.TimeoutError:
+                pass
+
+    targets = server_ids or [f"bench-{i}" for i in range(max(1, int(args.containers * args.running_ratio)))]
+    started = time.perf_counter()
+    result = await drive(args.viewers, [(lambda s=targets[i % len(targets)]: view(s)) for i in range(args.viewers)])
+    # Latency is connect to first log line, the viewing window itself is not counted
+    first_line_ms.sort()
+    result.update(p50_ms=_percentile(first_line_ms, 50), p95_ms=_percentile(first_line_ms, 95),
+                  p99_ms=_percentile(first_line_ms, 99), max_ms=first_line_ms[-1] if first_line_ms else None,
+                  lines_per_s=lines[0] / (time.perf_counter() - started))
+    del result["throughput"]
+    return result
+
+
+async def run_commands(args, url: str, servers: List[Tuple[str, Dict[str, str]]]) -> Dict[str, Any]:
+    """Send `commands` console commands one after another on a console websocket per started server."""
+    import websockets
+
+    ws_url = url.replace("http://", "ws://")
+    round_trips: List[float] = []
+
+    async def console(server_id: str, headers: Dict[str, str]):
+        async with websockets.connect(f"{ws_url}/ws/console/{server_id}") as ws:
+            await ws.send(json.dumps({"type": "auth", "token": headers["Authorization"].split(" ", 1)[1]}))
+            for n in range(args.commands):
+                sent = time.perf_counter()
+                await ws.send(json.dumps({"type": "command", "id": n, "command": "help" if n % 10 == 0 else "list"}))
+                # Log lines keep arriving in between
+                while True:
+                    message = await asyncio.wait_for(ws.recv(), args.timeout)
+                    if message.startswith("[ERROR]"):
+                        raise RuntimeError(message)
+                    if message.startswith("[COMMAND_RESULT] "):
+                        result = json.loads(message[len("[COMMAND_RESULT] "):])
+                        if "error" in result:
+                            raise RuntimeError(result["error"])
+                        break
+                round_trips.append((time.perf_counter() - sent) * 1000)
+
+    result = await drive(len(servers) or 1, [(lambda s=server: console(*s)) for server in servers])
+    # Latency is per command, not per console
+    round_trips.sort()
+    result.update(requests=len(round_trips), p50_ms=_percentile(round_trips, 50), p95_ms=_percentile(round_trips, 95),
+                  p99_ms=_percentile(round_trips, 99), max_ms=round_trips[-1] if round_trips else None)
+    del result["throughput"]
+    return result
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    print(f"\n{'vs ' + baseline['meta']['started_at']:<28} {'p50':>9} {'p95':>9} {'p99':>9} {'req/s':>9}")
+    for name, stats in current["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if before is None:
+            continue
+        cells = []
+        for key in ("p50_ms", "p95_ms", "p99_ms", "throughput"):
+            if stats.get(key) and before.get(key):
+                cells.append(f"{(stats[key] - before[key]) * 100 / before[key]:>+8.1f}%")
+            else:
+                cells.append(f"{'-':>9}")
+        print(f"{name:<28} {' '.join(cells)}")
+
+
+def report(result: Dict[str, Any]) -> None:
+    def ms(value: Optional[float]) -> str:
+        return f"{value:>9.1f}" if value is not None else f"{'-':>9}"
+
+    print(f"{'scenario':<18} {'ok':>6} {'err':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} "
+          f"{'subproc':>8} {'docker':>7} {'db':>6}")
+    for name, stats in result["scenarios"].items():
+        print(f"{name:<18} {stats['requests']:>6} {sum(stats['errors'].values()):>5} {ms(stats['p50_ms'])} "
+              f"{ms(stats['p95_ms'])} {ms(stats['p99_ms'])} {ms(stats.get('throughput'))} "
+              f"{stats['subprocesses']:>8} {stats['docker_calls']:>7} {stats['db_queries']:>6}")
+    if "console" in result["scenarios"]:
+        print(f"console lines/s: {result['scenarios']['console']['lines_per_s']:.1f}")
+
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "--serve-app":
+        serve_app(int(sys.argv[2]))
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["api", "cli"], default="api")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--servers-per-user", type=int, default=10)
+    parser.add_argument("--containers", type=int, default=200, help="unrelated containers on the fake host")
+    parser.add_argument("--hosts", type=int, default=1, help="fake Docker daemons to place servers on")
+    parser.add_argument("--running-ratio", type=float, default=0.5)
+    parser.add_argument("--docker-latency-ms", type=float, default=1.0)
+    parser.add_argument("--db-latency-ms", type=float, default=20.0)
+    parser.add_argument("--boot-ms", type=float, default=500.0, help="fake container time from start to healthy")
+    parser.add_argument("--log-interval-ms", type=float, default=100.0)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=1000, help="requests per read scenario")
+    parser.add_argument("--starts", type=int, default=20)
+    parser.add_argument("--stops", type=int, default=20)
+    parser.add_argument("--viewers", type=int, default=50, help="console websockets, 0 to skip")
+    parser.add_argument("--console-seconds", type=float, default=3.0)
+    parser.add_argument("--commands", type=int, default=50, help="console commands per started server, 0 to skip")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="craft4free-bench-") as workdir:
+        stand_ins = StandIns(args, workdir)
+        stand_ins.start()
+        by_user = seed(args, stand_ins, workdir)
+        process, url, startup_ms = launch_app(args, stand_ins, workdir)
+        try:
+            started_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+            scenarios = asyncio.run(run_scenarios(args, url, stand_ins, by_user))
+        finally:
+            process.send_signal(signal.SIGINT)
+            try:
+                process.wait(15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            stand_ins.stop()
+
+    result = {
+        "meta": {"started_at": started_at, "python": platform.python_version(), "args": vars(args),
+                 "startup_ms": startup_ms},
+        "scenarios": scenarios,
+    }
+    print(f"startup: {startup_ms:.0f} ms from spawn to first response")
+    report(result)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,4 @@
 import os
-from supabase import create_client, Client
 import dotenv
 
 dotenv.load_dotenv()
@@ -7,4 +6,14 @@ dotenv.load_dotenv()
 url: str = os.getenv("SUPABASE_URL", "")
 key: str = os.environ.get("SUPABASE_SERVICE_ROLE_KEY", "")
 
-supabase: Client = create_client(url, key)
+_client = None
+
+
+def get_supabase():
+    """Return the shared supabase-py client, importing and building it on first use."""
+    global _client
+    if _client is None:
+        from supabase import create_client
+
+        _client = create_client(url, key)
+    return _client
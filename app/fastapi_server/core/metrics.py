@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+from scripts.server.services.admission import admission
+from scripts.server.services.backups import backup_manager
+from scripts.server.services.container_cache import container_cache
+from scripts.server.services.disk_usage import disk_usage
+from scripts.server.services.hibernation import hibernator
+from scripts.server.services.lifecycle import lifecycle
+from scripts.server.services.log_broker import log_broker
+from scripts.server.services.log_store import log_archiver
+from scripts.server.services.rcon import rcon_pool
+from scripts.server.services.server_repository import server_repository
+from scripts.server.services.stats_collector import stats_collector
+from scripts.server.services.warm_pool import warm_pool
+from scripts.server.services.world_transfer import world_transfers
+from scripts.utils.metrics import registry
+from fastapi_server.core.security import token_cache
+
+logger = logging.getLogger(__name__)
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")  # bearer token required on /metrics when set
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))  # seconds between event loop lag probes
+
+http_request_seconds = registry.histogram(
+    "http_request_seconds", "HTTP request latency by route template", ["method", "route", "status"])
+websocket_connections = registry.gauge(
+    "websocket_connections", "Open websocket connections by route", ["route"])
+event_loop_lag_seconds = registry.histogram(
+    "event_loop_lag_seconds", "How late the event loop woke a sleeping probe",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+event_loop_lag_last = registry.gauge(
+    "event_loop_lag_last_seconds", "Most recent event loop lag probe")
+app_startup_seconds = registry.gauge(
+    "app_startup_seconds", "Seconds from the start of importing main to each startup phase", ["phase"])
+
+_startup_origin: Optional[float] = None
+
+
+def record_startup(phase: str, origin: Optional[float] = None) -> None:
+    """Record how long after `origin` (the first call's, by default) a startup phase completed."""
+    global _startup_origin
+    if origin is not None:
+        _startup_origin = origin
+    if _startup_origin is None:
+        return
+    seconds = time.perf_counter() - _startup_origin
+    app_startup_seconds.set(seconds, phase=phase)
+    logger.info(f"Startup phase {phase} reached after {seconds * 1000:.0f} ms")
+
+
+def _flatten(prefix: str, stats: Dict[str, Any]):
+    for key, value in stats.items():
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, (int, float)):
+            yield (f"{prefix}_{key}",), value
+
+
+registry.gauge("component_stat", "Internal counters of caches and shared streams", ["name"], callback=lambda: dict(
+    item
+    for prefix, stats in (
+        ("admission", admission.stats()),
+        ("backups", backup_manager.stats()),
+        ("container_cache", container_cache.stats()),
+        ("disk_usage", disk_usage.stats()),
+        ("hibernation", hibernator.stats()),
+        ("lifecycle", lifecycle.stats()),
+        ("log_archiver", log_archiver.stats()),
+        ("log_broker", log_broker.stats()),
+        ("rcon", rcon_pool.stats()),
+        ("repository", {"coalesced": server_repository.coalesced}),
+        ("repository_row_cache", server_repository.stats()["row_cache"]),
+        ("repository_user_cache", server_repository.stats()["user_cache"]),
+        ("stats_collector", stats_collector.stats()),
+        ("token_cache", token_cache.stats()),
+        ("warm_pool", {"claims": warm_pool.claims, "misses": warm_pool.misses}),
+        ("world_transfers", world_transfers.stats()),
+    )
+    for item in _flatten(prefix, stats)
+))
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing HTTP requests per route template and counting open websockets."""
+
+    def __init__(self, app):
+        self.app = app
+        self._served = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "websocket":
+            await self._websocket(scope, receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+    @staticmethod
+    def _route(scope) -> str:
+        # Set by the router once it matched, keeps the label set bounded (no raw IDs)
+        route = scope.get("route")
+        return getattr(route, "path", None) or "unmatched"
+
+    async def _http(self, scope, receive, send):
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_request_seconds.observe(time.perf_counter() - start, method=scope["method"],
+                                         route=self._route(scope), status=str(status[0]))
+            if not self._served:
+                self._served = True
+                record_startup("first_request")
+
+    async def _websocket(self, scope, receive, send):
+        route = None
+        accepted = False
+
+        async def send_tracking(message):
+            nonlocal route, accepted
+            if message["type"] == "websocket.accept" and not accepted:
+                accepted = True
+                route = self._route(scope)
+                websocket_connections.inc(route=route)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_tracking)
+        finally:
+            if accepted:
+                websocket_connections.dec(route=route)
+
+
+class LoopLagMonitor:
+    """Sleeps LOOP_LAG_INTERVAL in a loop and records how late each wake-up was."""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL):
+        self._interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None and self._interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self._interval
+            await asyncio.sleep(self._interval)
+            lag = max(0.0, loop.time() - expected)
+            event_loop_lag_seconds.observe(lag)
+            event_loop_lag_last.set(lag)
+
+
+loop_lag_monitor = LoopLagMonitor()
@@ -1,20 +1,33 @@
 import os
+import hashlib
 from fastapi import HTTPException, Security
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import jwt
 from jwt.exceptions import PyJWTError
 import dotenv
 
+from scripts.utils.lru_cache import ExpiringLRUCache
+
 dotenv.load_dotenv()
 
 JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
 JWT_ISSUER = os.getenv("SUPABASE_URL_v1")
 JWT_AUDIENCE = "authenticated"
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "1024"))  # 0 disables the cache
 
 security = HTTPBearer()
 
+# Already verified tokens, keyed by their SHA-256 digest and dropped at the token's own exp
+token_cache = ExpiringLRUCache(TOKEN_CACHE_SIZE)
+
 async def verify_token(credentials: HTTPAuthorizationCredentials = Security(security)):
     token = credentials.credentials
+    key = hashlib.sha256(token.encode()).digest()
+
+    payload = token_cache.get(key)
+    if payload is not None:
+        return payload
+
     try:
         # Properly verify the token with signature validation
         payload = jwt.decode(
@@ -33,6 +46,10 @@ async def verify_token(credentials: HTTPAuthorizationCredentials = Security(secu
         if not payload.get("sub"):
             raise HTTPException(status_code=401, detail="Invalid user in token")
 
+        # Tokens without an expiry cannot be bounded in time, so they are never cached
+        if isinstance(payload.get("exp"), (int, float)):
+            token_cache.set(key, payload, payload["exp"])
+
         return payload
     except PyJWTError as e:
         print(f"Error verifying token: {e}")
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, Any
+from typing import Optional, Any, List
 
 class StandardResponse(BaseModel):
     success: bool
@@ -10,3 +10,6 @@ class ServerCreateRequest(BaseModel):
     name: str
     version: str
     type: str
+
+class BackupRestoreRequest(BaseModel):
+    paths: Optional[List[str]] = None
@@ -0,0 +1,58 @@
+import asyncio
+import os
+import time
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, status
+from fastapi.responses import JSONResponse
+
+from scripts.server.services.container_cache import container_cache
+from scripts.server.services.docker_service import DockerService
+from scripts.server.services.server_repository import server_repository
+
+READY_TIMEOUT = float(os.getenv("READY_TIMEOUT", "2"))  # seconds per dependency check
+READY_CACHE_TTL = float(os.getenv("READY_CACHE_TTL", "1"))  # seconds a readiness result is reused
+
+router = APIRouter()
+
+_last_ready: Optional[Dict[str, Any]] = None
+_last_ready_at = 0.0
+
+
+async def _check(probe) -> Optional[str]:
+    """Run one dependency probe, returning None when it passed or the reason it failed."""
+    try:
+        await asyncio.wait_for(probe(), READY_TIMEOUT)
+        return None
+    except asyncio.TimeoutError:
+        return f"Timed out after {READY_TIMEOUT}s"
+    except Exception as e:
+        return str(e) or type(e).__name__
+
+
+@router.get("/healthz", include_in_schema=False)
+async def healthz():
+    # Liveness only: the worker's event loop answers, dependencies are /readyz's business
+    return {"status": "ok"}
+
+
+@router.get("/readyz", include_in_schema=False)
+async def readyz():
+    global _last_ready, _last_ready_at
+
+    # Probes can come from several load balancers, don't turn each into Docker and database round trips
+    if _last_ready is None or time.monotonic() - _last_ready_at > READY_CACHE_TTL:
+        docker_error, supabase_error = await asyncio.gather(
+            _check(DockerService.ping_async), _check(server_repository.ping))
+        checks = {
+            "docker": docker_error or "ok",
+            "supabase": supabase_error or "ok",
+            "container_events": "ok" if container_cache.stats()["live"] else "reconnecting",
+        }
+        _last_ready = {"ready": docker_error is None and supabase_error is None, "checks": checks}
+        _last_ready_at = time.monotonic()
+
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if _last_ready["ready"] else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content=_last_ready
+    )
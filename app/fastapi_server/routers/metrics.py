@@ -0,0 +1,18 @@
+import secrets
+
+from fastapi import APIRouter, Request, status
+from fastapi.responses import PlainTextResponse
+
+from fastapi_server.core.metrics import METRICS_TOKEN
+from scripts.utils.metrics import registry
+
+router = APIRouter()
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    if METRICS_TOKEN:
+        supplied = request.headers.get("authorization", "")
+        if not secrets.compare_digest(supplied, f"Bearer {METRICS_TOKEN}"):
+            return PlainTextResponse("Unauthorized\n", status_code=status.HTTP_401_UNAUTHORIZED)
+
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
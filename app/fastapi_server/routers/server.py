@@ -1,22 +1,54 @@
-from fastapi import APIRouter, Depends, status, WebSocket, WebSocketDisconnect, BackgroundTasks
-from fastapi.responses import JSONResponse
-import datetime
+from fastapi import APIRouter, Depends, HTTPException, Request, status, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials
+from typing import Any, Dict, Optional, Set
 import asyncio
-from python_on_whales import docker
+import json
 
+from scripts.server.config import LOG_PAGE_LIMIT, STATS_AUTH_TIMEOUT
 from scripts.server.models.server import ServerConfig
-from config.supabase import supabase
 from fastapi_server.core.security import verify_token
-from fastapi_server.models.server import ServerCreateRequest, StandardResponse
+from fastapi_server.models.server import BackupRestoreRequest, ServerCreateRequest, StandardResponse
 
 from scripts.server.services.server_service import ServerService
+from scripts.server.services.backups import BackupError, SnapshotNotFound, backup_manager, backup_store
+from scripts.server.services.disk_usage import QuotaExceeded, disk_usage
+from scripts.server.services.docker_service import DockerService
+from scripts.server.services.docker_hosts import docker_hosts
+from scripts.server.services.server_repository import server_repository
+from scripts.server.services.log_broker import log_broker
+from scripts.server.services.log_store import compile_query, log_store
+from scripts.server.services.executors import run_io
+from scripts.server.services.lifecycle import LifecycleError, lifecycle
+from scripts.server.services.port_allocator import port_allocator
+from scripts.server.services.rcon import RconError, rcon_pool
+from scripts.server.services.sleep_state import sleep_state
+from scripts.server.services.start_jobs import start_jobs
+from scripts.server.services.stats_collector import RESOLUTIONS, stats_collector
+from scripts.server.services.world_transfer import TarArchive, TransferError, parse_range, world_transfers, zip_stream
 
 router = APIRouter()
 
+async def owns_server(server_id: str, user: Dict[str, Any]) -> bool:
+    """Whether the server exists and belongs to the user of the token."""
+    server = await server_repository.get(server_id)
+    return server is not None and server.get("user_id") == user["sub"]
+
+def server_not_found() -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_404_NOT_FOUND,
+        content=StandardResponse(
+            success=False,
+            error="Server not found"
+        ).dict()
+    )
+
 @router.post("/servers/{server_id}")
 async def get_server(server_id: str, user = Depends(verify_token)):
     try:
-        resp = (supabase.table("servers").select("*").eq("id", server_id).single().execute())
+        server = await server_repository.get(server_id)
+        if server is None:
+            raise Exception("Server not found")
     except Exception as e:
         return StandardResponse(
             success=False,
@@ -27,8 +59,8 @@ async def get_server(server_id: str, user = Depends(verify_token)):
         return StandardResponse(
             success=True,
             data={
-                "status": ServerService.get_server_info(server_id),
-                "server": resp.data
+                "status": await ServerService.get_server_info_async(server_id),
+                "server": server
             }
         )
     except Exception as e:
@@ -43,17 +75,14 @@ async def get_server(server_id: str, user = Depends(verify_token)):
 @router.get("/servers")
 async def get_all_servers(user = Depends(verify_token)):
     try:
-        response = (supabase.table("servers")
-            .select("*")
-            .eq("user_id", user["sub"])
-            .is_("deleted_at", None)
-            .execute())
+        rows = await server_repository.list_for_user(user["sub"])
 
+        infos = await ServerService.get_servers_info_async(server["id"] for server in rows)
         servers = []
-        for server in response.data:
+        for server in rows:
             servers.append({
                 "server": server,
-                "status": ServerService.get_server_info(server["id"]),
+                "status": infos[server["id"]],
             })
         return StandardResponse(
             success=True,
@@ -68,16 +97,8 @@ async def get_all_servers(user = Depends(verify_token)):
 @router.post("/servers")
 async def create_server(request: ServerCreateRequest, user = Depends(verify_token)):
     try:
-        existing_server = supabase.table("servers").select("*").eq("user_id", user["sub"]).eq("name", request.name).execute()
-        if existing_server.data:
-            raise Exception("Server with the same name already exists")
-
-        (supabase.table("servers").insert({
-                "user_id": user["sub"],
-                "name": request.name,
-                "version": request.version,
-                "type": request.type
-            }).execute())
+        # Raises if the user already has a server with the same name
+        await server_repository.create(user["sub"], request.name, request.version, request.type)
 
         return StandardResponse(
             success=True
@@ -93,16 +114,28 @@ async def create_server(request: ServerCreateRequest, user = Depends(verify_toke
 
 @router.post("/servers/{server_id}/delete")
 async def delete_server(server_id: str, user = Depends(verify_token)):
+    if not await owns_server(server_id, user):
+        return server_not_found()
+
     try:
-        (supabase.table("servers")
-            .update({"deleted_at": datetime.datetime.now(datetime.timezone.utc).isoformat()})
-            .eq("id", server_id)
-            .eq("user_id", user["sub"])
-            .execute())
+        # A running container would keep the port and host given up below
+        async with lifecycle.hold(server_id, "delete"):
+            await server_repository.soft_delete(server_id, user["sub"])
+            await run_io(sleep_state.release, server_id)
+            await run_io(port_allocator.forget, server_id)
+            await run_io(docker_hosts.forget, server_id)
 
         return StandardResponse(
             success=True
         )
+    except LifecycleError as e:
+        return JSONResponse(
+            status_code=status.HTTP_409_CONFLICT,
+            content=StandardResponse(
+                success=False,
+                error=str(e)
+            ).dict()
+        )
     except Exception as e:
         return StandardResponse(
             success=False,
@@ -112,13 +145,15 @@ async def delete_server(server_id: str, user = Depends(verify_token)):
 @router.post("/servers/{server_id}/start")
 async def start_server(server_id: str, user = Depends(verify_token)):
     try:
-        resp = (supabase.table("servers").select("*").eq("id", server_id).single().execute())
+        server = await server_repository.get(server_id)
+        if server is None:
+            raise Exception("Server not found")
 
         config = ServerConfig(
-            id = resp.data["id"],
-            name = resp.data["name"],
-            type = resp.data["type"],
-            version = resp.data["version"]
+            id = server["id"],
+            name = server["name"],
+            type = server["type"],
+            version = server["version"]
         )
     except Exception as e:
         print(f"Error fetching server: {e}")
@@ -131,13 +166,31 @@ async def start_server(server_id: str, user = Depends(verify_token)):
         )
 
     try:
-        ok, port = ServerService.start_server(config)
+        disk_usage.check_quota(server_id)
+    except QuotaExceeded as e:
+        return JSONResponse(
+            status_code=status.HTTP_409_CONFLICT,
+            content=StandardResponse(
+                success=False,
+                error=str(e)
+            ).dict()
+        )
 
-        if not ok:
-            raise Exception("Failed to start server")
+    try:
+        # Runs in the background, progress is available from the job endpoints below
+        operation = await lifecycle.start(config, user["sub"])
 
         return StandardResponse(
             success=True,
+            data=start_jobs.get(operation.job_id)
+        )
+    except LifecycleError as e:
+        return JSONResponse(
+            status_code=status.HTTP_409_CONFLICT,
+            content=StandardResponse(
+                success=False,
+                error=str(e)
+            ).dict()
         )
     except Exception as e:
         print(f"Error starting server: {e}")
@@ -149,14 +202,66 @@ async def start_server(server_id: str, user = Depends(verify_token)):
             ).dict()
         )
 
+@router.get("/servers/{server_id}/start/{job_id}")
+async def get_start_job(server_id: str, job_id: str, user = Depends(verify_token)):
+    job = await start_jobs.find(job_id, user["sub"])
+    if job is None or job.server_id != server_id:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content=StandardResponse(
+                success=False,
+                error="Start job not found"
+            ).dict()
+        )
+
+    return StandardResponse(
+        success=True,
+        data=job
+    )
+
+@router.get("/servers/{server_id}/start/{job_id}/events")
+async def stream_start_job(server_id: str, job_id: str, user = Depends(verify_token)):
+    job = await start_jobs.find(job_id, user["sub"])
+    if job is None or job.server_id != server_id:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content=StandardResponse(
+                success=False,
+                error="Start job not found"
+            ).dict()
+        )
+
+    async def event_stream():
+        async for snapshot in start_jobs.events(job_id, heartbeat=15):
+            if snapshot is None:
+                # Comment line, keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: {snapshot.stage.value}\ndata: {snapshot.json()}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post("/servers/{server_id}/stop")
-async def stop_server(server_id: str, background_tasks: BackgroundTasks, user = Depends(verify_token)):
+async def stop_server(server_id: str, user = Depends(verify_token)):
     try:
-        background_tasks.add_task(ServerService.stop_server, server_id)
+        # Runs in the background, after a start of the server still in progress
+        await lifecycle.stop(server_id)
 
         return StandardResponse(
             success=True,
         )
+    except LifecycleError as e:
+        return JSONResponse(
+            status_code=status.HTTP_409_CONFLICT,
+            content=StandardResponse(
+                success=False,
+                error=str(e)
+            ).dict()
+        )
     except Exception as e:
         print(f"Error stopping server: {e}")
         return JSONResponse(
@@ -167,77 +272,412 @@ async def stop_server(server_id: str, background_tasks: BackgroundTasks, user =
             ).dict()
         )
 
+@router.get("/servers/{server_id}/stats")
+async def get_server_stats(server_id: str, resolution: str = "fine", since: float = 0, user = Depends(verify_token)):
+    if not await owns_server(server_id, user):
+        return server_not_found()
+
+    if resolution not in RESOLUTIONS:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content=StandardResponse(
+                success=False,
+                error=f"Resolution must be one of {', '.join(RESOLUTIONS)}"
+            ).dict()
+        )
+
+    return StandardResponse(
+        success=True,
+        data=stats_collector.history(server_id, resolution, since)
+    )
+
+@router.get("/servers/{server_id}/logs")
+async def get_server_logs(server_id: str, before: Optional[int] = None, until: Optional[float] = None,
+                          limit: int = 100, user = Depends(verify_token)):
+    if not await owns_server(server_id, user):
+        return server_not_found()
+
+    # Newest lines by default, `before` from the previous page goes further back in the history
+    page = await run_io(log_store.page, server_id, before, until, max(1, min(limit, LOG_PAGE_LIMIT)))
+    return StandardResponse(
+        success=True,
+        data=page
+    )
+
+
+@router.get("/servers/{server_id}/logs/search")
+async def search_server_logs(server_id: str, q: str, before: Optional[int] = None,
+                             since: Optional[float] = None, until: Optional[float] = None, limit: int = 100,
+                             user = Depends(verify_token)):
+    if not await owns_server(server_id, user):
+        return server_not_found()
+
+    try:
+        pattern = compile_query(q)
+    except ValueError as e:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content=StandardResponse(
+                success=False,
+                error=str(e)
+            ).dict()
+        )
+
+    result = await run_io(log_store.search, server_id, pattern, before, since, until,
+                              max(1, min(limit, LOG_PAGE_LIMIT)))
+    return StandardResponse(
+        success=True,
+        data=result
+    )
+
+
+@router.get("/servers/{server_id}/backups")
+async def list_backups(server_id: str, user = Depends(verify_token)):
+    if not await owns_server(server_id, user):
+        return server_not_found()
+
+    return StandardResponse(
+        success=True,
+        data=await run_io(backup_store.list, server_id)
+    )
+
+
+@router.post("/servers/{server_id}/backups")
+async def create_backup(server_id: str, user = Depends(verify_token)):
+    if not await owns_server(server_id, user):
+        return server_not_found()
+
+    # Waits for the backup, only files changed since the last one are read
+    try:
+        return StandardResponse(
+            success=True,
+            data=await backup_manager.create(server_id)
+        )
+    except BackupError as e:
+        return JSONResponse(
+            status_code=status.HTTP_409_CONFLICT,
+            content=StandardResponse(
+                success=False,
+                error=str(e)
+            ).dict()
+        )
+    except Exception as e:
+        print(f"Error backing up server: {e}")
+        return JSONResponse(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            content=StandardResponse(
+                success=False,
+                error=str(e)
+            ).dict()
+        )
+
+
+@router.get("/servers/{server_id}/backups/{snapshot_id}/files")
+async def list_backup_files(server_id: str, snapshot_id: str, prefix: str = "", user = Depends(verify_token)):
+    if not await owns_server(server_id, user):
+        return server_not_found()
+
+    try:
+        files = await run_io(backup_manager.files, server_id, snapshot_id, prefix)
+    except BackupError as e:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content=StandardResponse(
+                success=False,
+                error=str(e)
+            ).dict()
+        )
+
+    return StandardResponse(
+        success=True,
+        data=files
+    )
+
+
+@router.post("/servers/{server_id}/backups/{snapshot_id}/restore")
+async def restore_backup(server_id: str, snapshot_id: str, request: Optional[BackupRestoreRequest] = None,
+                         user = Depends(verify_token)):
+    if not await owns_server(server_id, user):
+        return server_not_found()
+
+    # Without paths the whole world goes back to the snapshot
+    try:
+        return StandardResponse(
+            success=True,
+            data=await backup_manager.restore(server_id, snapshot_id, request.paths if request else None)
+        )
+    except SnapshotNotFound as e:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content=StandardResponse(
+                success=False,
+                error=str(e)
+            ).dict()
+        )
+    except BackupError as e:
+        return JSONResponse(
+            status_code=status.HTTP_409_CONFLICT,
+            content=StandardResponse(
+                success=False,
+                error=str(e)
+            ).dict()
+        )
+    except Exception as e:
+        print(f"Error restoring server: {e}")
+        return JSONResponse(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            content=StandardResponse(
+                success=False,
+                error=str(e)
+            ).dict()
+        )
+
+
+@router.post("/servers/{server_id}/backups/{snapshot_id}/delete")
+async def delete_backup(server_id: str, snapshot_id: str, user = Depends(verify_token)):
+    if not await owns_server(server_id, user):
+        return server_not_found()
+
+    try:
+        await backup_manager.delete(server_id, snapshot_id)
+    except BackupError as e:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content=StandardResponse(
+                success=False,
+                error=str(e)
+            ).dict()
+        )
+
+    return StandardResponse(
+        success=True
+    )
+
+
+@router.get("/servers/{server_id}/world")
+async def download_world(server_id: str, request: Request, format: str = "tar", user = Depends(verify_token)):
+    if not await owns_server(server_id, user):
+        return server_not_found()
+    if format not in ("tar", "zip"):
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content=StandardResponse(
+                success=False,
+                error="Format must be tar or zip"
+            ).dict()
+        )
+
+    try:
+        data_dir, files = await world_transfers.listing(server_id)
+    except TransferError as e:
+        return JSONResponse(
+            status_code=status.HTTP_409_CONFLICT,
+            content=StandardResponse(
+                success=False,
+                error=str(e)
+            ).dict()
+        )
+
+    if format == "zip":
+        # Compressed as it is sent, its size is not known ahead so it cannot be resumed
+        return StreamingResponse(
+            world_transfers.counted(zip_stream(data_dir, files)),
+            media_type="application/zip",
+            headers={"Content-Disposition": f'attachment; filename="{server_id}.zip"'}
+        )
+
+    archive = TarArchive(data_dir, files)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": archive.etag,
+        "Content-Disposition": f'attachment; filename="{server_id}.tar"',
+    }
+    try:
+        # A range of an archive that has changed since is answered with the whole new one
+        if_range = request.headers.get("if-range")
+        byte_range = parse_range(request.headers.get("range"), archive.size) if if_range in (None, archive.etag) else None
+    except ValueError as e:
+        return JSONResponse(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers={"Content-Range": f"bytes */{archive.size}"},
+            content=StandardResponse(
+                success=False,
+                error=str(e)
+            ).dict()
+        )
+
+    start, end = byte_range or (0, archive.size - 1)
+    headers["Content-Length"] = str(end - start + 1)
+    if byte_range is not None:
+        headers["Content-Range"] = f"bytes {start}-{end}/{archive.size}"
+    return StreamingResponse(
+        world_transfers.counted(archive.read(start, end)),
+        status_code=status.HTTP_206_PARTIAL_CONTENT if byte_range is not None else status.HTTP_200_OK,
+        media_type="application/x-tar",
+        headers=headers
+    )
+
+
+@router.post("/servers/{server_id}/world")
+async def upload_world(server_id: str, request: Request, user = Depends(verify_token)):
+    if not await owns_server(server_id, user):
+        return server_not_found()
+    # The body is the archive itself (tar, tar.gz or zip), extracted while it arrives
+    length = request.headers.get("content-length")
+    try:
+        return StandardResponse(
+            success=True,
+            data=await world_transfers.upload(server_id, request.stream(), int(length) if length and length.isdigit() else None)
+        )
+    except TransferError as e:
+        return JSONResponse(
+            status_code=status.HTTP_409_CONFLICT,
+            content=StandardResponse(
+                success=False,
+                error=str(e)
+            ).dict()
+        )
+    except Exception as e:
+        print(f"Error uploading world: {e}")
+        return JSONResponse(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            content=StandardResponse(
+                success=False,
+                error=str(e)
+            ).dict()
+        )
+
 
-server_processes = {}
 @router.websocket("/ws/console/{server_id}")
 async def websocket_endpoint(websocket: WebSocket, server_id: str):
     await websocket.accept()
 
-    # Initialize server entry if it doesn't exist
-    if server_id not in server_processes:
-        server_processes[server_id] = {
-            'connected_clients': set()
-        }
+    try:
+        states = await DockerService.get_container_states_async([server_id])
+        if server_id not in states:
+            raise Exception(f"No such container: {server_id}")
+    except Exception as e:
+        await websocket.send_text(f"[ERROR] {str(e)}")
+        await websocket.send_text("[SERVER_NOT_RUNNING]")
+        return
 
-    # Add this client to the set of connected clients
-    server_processes[server_id]['connected_clients'].add(websocket)
+    # All viewers of a server share one log stream, this client gets the recent lines plus everything new
+    subscription = log_broker.subscribe(server_id)
+    send_lock = asyncio.Lock()
+    user: Dict[str, Any] = {}
+    commands: Set[asyncio.Task] = set()
 
-    try:
-        # Get the container ID for this server
-        container_id = server_id
-        if not container_id:
-            await websocket.send_text("[SERVER_NOT_RUNNING]")
-        else:
+    async def send(text: str):
+        async with send_lock:
+            await websocket.send_text(text)
+
+    async def send_logs():
+        for line in subscription.backlog:
+            await send(line)
+        async for line in subscription:
+            await send(line)
+
+    async def run_command(request_id: Any, command: str):
+        try:
+            result = {"id": request_id, "output": await rcon_pool.execute(server_id, command)}
+        except RconError as e:
+            result = {"id": request_id, "error": str(e)}
+        await send("[COMMAND_RESULT] " + json.dumps(result))
+
+    async def authenticate(token: str):
+        try:
+            payload = await verify_token(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token))
+            server = await server_repository.get(server_id)
+            if server is None or server.get("user_id") != payload["sub"]:
+                raise HTTPException(status_code=403, detail="Only the owner can send commands")
+        except HTTPException as e:
+            await send(f"[ERROR] {e.detail}")
+            return
+        user.update(payload)
+        await send("[AUTHENTICATED]")
+
+    async def receive_commands():
+        # Clients send {"type": "auth", "token": ...} once, then {"type": "command", "id": ..., "command": ...}
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
             try:
-                # Get the container
-                container = docker.container.inspect(container_id)
-
-                # Send historical logs first (last 100 lines)
-                logs = container.logs(tail=100).splitlines()
-                for line in logs:
-                    line_text = line.decode('utf-8').strip() if isinstance(line, bytes) else line.strip()
-                    await websocket.send_text(line_text)
-
-                # For python-on-whales, we need to use asyncio subprocess to stream logs
-                async def stream_logs():
-                    # Use docker CLI directly for streaming
-                    process = await asyncio.create_subprocess_shell(
-                        f"docker logs -f {container_id}",
-                        stdout=asyncio.subprocess.PIPE,
-                        stderr=asyncio.subprocess.PIPE
-                    )
-
-                    # Check if process started correctly
-                    if process.stdout is None:
-                        await websocket.send_text("[ERROR] Failed to start log streaming")
-                        return
-
-                    while True:
-                        line = await process.stdout.readline()
-                        if not line:
-                            break
-                        line_text = line.decode('utf-8').strip()
-                        try:
-                            await websocket.send_text(line_text)
-                        except Exception:
-                            # WebSocket closed
-                            process.kill()
-                            break
-
-                # Start stream logs task
-                task = asyncio.create_task(stream_logs())
-
-                # Keep the websocket open
-                try:
-                    while True:
-                        await asyncio.sleep(1)  # Simple keep-alive approach
-                except WebSocketDisconnect:
-                    task.cancel()
-
-            except Exception as e:
-                await websocket.send_text(f"[ERROR] {str(e)}")
-                await websocket.send_text("[SERVER_NOT_RUNNING]")
+                request = json.loads(message.get("text") or "")
+            except ValueError:
+                continue
+            if not isinstance(request, dict):
+                continue
+
+            if request.get("type") == "auth":
+                await authenticate(str(request.get("token", "")))
+            elif request.get("type") == "command":
+                if not user:
+                    await send("[COMMAND_RESULT] " + json.dumps({"id": request.get("id"), "error": "Not authenticated"}))
+                elif not rcon_pool.allow(user["sub"]):
+                    await send("[COMMAND_RESULT] " + json.dumps({"id": request.get("id"), "error": "Too many commands"}))
+                else:
+                    # Commands run concurrently, pipelined on the server's RCON connection
+                    task = asyncio.create_task(run_command(request.get("id"), str(request.get("command", ""))))
+                    commands.add(task)
+                    task.add_done_callback(commands.discard)
+
+    sender = asyncio.create_task(send_logs())
+    receiver = asyncio.create_task(receive_commands())
+    try:
+        done, _ = await asyncio.wait([sender, receiver], return_when=asyncio.FIRST_COMPLETED)
+        if receiver not in done:
+            if subscription.evicted:
+                # Too slow to keep up with the log stream
+                await websocket.close(code=1013)
+            elif sender.exception() is None:
+                # Log stream ended (container stopped), keep the socket open until the client leaves
+                await receiver
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        receiver.cancel()
+        for task in commands:
+            task.cancel()
+        await log_broker.unsubscribe(subscription)
+
+
+@router.websocket("/ws/stats/{server_id}")
+async def stats_websocket(websocket: WebSocket, server_id: str):
+    await websocket.accept()
+
+    # Like the console, the client sends {"type": "auth", "token": ...} first. Only the owner gets samples.
+    try:
+        request = json.loads(await asyncio.wait_for(websocket.receive_text(), STATS_AUTH_TIMEOUT))
+        payload = await verify_token(HTTPAuthorizationCredentials(scheme="Bearer", credentials=str(request.get("token", ""))))
+        if not await owns_server(server_id, payload):
+            raise HTTPException(status_code=403, detail="Only the owner can view stats")
+    except WebSocketDisconnect:
+        return
+    except (asyncio.TimeoutError, ValueError, AttributeError, HTTPException) as e:
+        await websocket.send_text(json.dumps({"error": e.detail if isinstance(e, HTTPException) else "Not authenticated"}))
+        await websocket.close(code=1008)
+        return
+
+    # Samples arrive about once a second while the server runs, the socket stays open across restarts
+    subscription = stats_collector.subscribe(server_id)
+
+    async def send_stats():
+        async for message in subscription:
+            await websocket.send_text(message)
+
+    async def wait_for_disconnect():
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    sender = asyncio.create_task(send_stats())
+    receiver = asyncio.create_task(wait_for_disconnect())
+    try:
+        await asyncio.wait([sender, receiver], return_when=asyncio.FIRST_COMPLETED)
     except WebSocketDisconnect:
-        # Remove this client from the set of connected clients
-        if server_id in server_processes:
-            server_processes[server_id]['connected_clients'].discard(websocket)
+        pass
+    finally:
+        sender.cancel()
+        receiver.cancel()
+        stats_collector.unsubscribe(subscription)
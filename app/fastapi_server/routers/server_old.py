@@ -1,7 +1,6 @@
 from fastapi import APIRouter, Depends, WebSocket, status, BackgroundTasks
 from fastapi.responses import JSONResponse
 import datetime
-from python_on_whales import docker
 import asyncio
 
 from starlette.websockets import WebSocketDisconnect
@@ -9,25 +8,27 @@ from starlette.websockets import WebSocketDisconnect
 from fastapi_server.core.security import verify_token
 from fastapi_server.routers.server_models import ServerCreationReq, ServerCreationResp, CreationStatus, ErrorDetail, ServerStartReq, ServerStartResp, ServerData, StandardResp
 
-from config.supabase import supabase
+from config.supabase import get_supabase
 from scripts.server.handler import start_server, stop_server
 from scripts.server.info import get_server_status
+from scripts.server.services.docker_backend import get_backend
+from scripts.server.services.executors import run_docker, run_supabase
 
 router = APIRouter()
 
 @router.post("/server", status_code=status.HTTP_201_CREATED, response_model=ServerCreationResp)
 async def create_new_server(request: ServerCreationReq, user = Depends(verify_token)):
     try:
-        existing_server = supabase.table("servers").select("*").eq("user_id", user["sub"]).eq("name", request.name).execute()
+        existing_server = await run_supabase(get_supabase().table("servers").select("*").eq("user_id", user["sub"]).eq("name", request.name).execute)
         if existing_server.data:
             raise Exception("Server with the same name already exists")
 
-        resp = (supabase.table("servers").insert({
+        resp = (await run_supabase(get_supabase().table("servers").insert({
             "user_id": user["sub"],
             "name": request.name,
             "version": request.version,
             "type": request.type
-        }).execute())
+        }).execute))
         id = resp.data[0]['id']
 
         return ServerCreationResp(
@@ -51,7 +52,7 @@ async def create_new_server(request: ServerCreationReq, user = Depends(verify_to
 @router.post("/server/{server_id}/start", status_code=status.HTTP_200_OK, response_model=ServerStartResp)
 async def start_server_(request: ServerStartReq, user = Depends(verify_token)):
     try:
-        resp = (supabase.table("servers").select("*").eq("id", request.server_id).single().execute())
+        resp = (await run_supabase(get_supabase().table("servers").select("*").eq("id", request.server_id).single().execute))
         server_type = resp.data["type"]
         server_version = resp.data["version"]
         server_name = resp.data["name"]
@@ -69,7 +70,7 @@ async def start_server_(request: ServerStartReq, user = Depends(verify_token)):
         )
 
     try:
-        port = start_server(request.server_id, server_name, server_type, server_version)
+        port = await run_docker(start_server, request.server_id, server_name, server_type, server_version)
 
         if (port == -1):
             raise Exception("Failed to start server")
@@ -101,7 +102,7 @@ async def start_server_(request: ServerStartReq, user = Depends(verify_token)):
 @router.post("/server/{server_id}/stop")
 async def stop_server_(server_id: str, background_tasks: BackgroundTasks, user = Depends(verify_token)):
     try:
-        background_tasks.add_task(stop_server, server_id)
+        background_tasks.add_task(run_docker, stop_server, server_id)
 
         return {"message": "Server stopped"}
     except Exception as e:
@@ -111,11 +112,11 @@ async def stop_server_(server_id: str, background_tasks: BackgroundTasks, user =
 @router.post("/server/{server_id}/delete")
 async def delete_server_(server_id: str, user = Depends(verify_token)):
     try:
-        response = (supabase.table("servers")
+        response = (await run_supabase(get_supabase().table("servers")
             .update({"deleted_at": datetime.datetime.now(datetime.timezone.utc).isoformat()})
             .eq("id", server_id)
             .eq("user_id", user["sub"])
-            .execute())
+            .execute))
 
         return response
     except Exception as e:
@@ -125,17 +126,17 @@ async def delete_server_(server_id: str, user = Depends(verify_token)):
 @router.get("/server")
 async def get_all_servers(user = Depends(verify_token)):
     try:
-        response = (supabase.table("servers")
+        response = (await run_supabase(get_supabase().table("servers")
             .select("*")
             .eq("user_id", user["sub"])
             .is_("deleted_at", None)
-            .execute())
+            .execute))
 
         servers = []
         for server in response.data:
             servers.append({
                 "server": server,
-                "status": get_server_status(server["id"]),
+                "status": await run_docker(get_server_status, server["id"]),
             })
         return StandardResp(
             success=True,
@@ -152,7 +153,7 @@ async def get_all_servers(user = Depends(verify_token)):
 @router.post("/server/{server_id}")
 async def get_server_(server_id: str, user = Depends(verify_token)):
     try:
-        resp = (supabase.table("servers").select("*").eq("id", server_id).single().execute())
+        resp = (await run_supabase(get_supabase().table("servers").select("*").eq("id", server_id).single().execute))
     except Exception as e:
         print(f"Error fetching server: {e}")
         return {"error": "Error fetching server"}
@@ -161,7 +162,7 @@ async def get_server_(server_id: str, user = Depends(verify_token)):
         return StandardResp(
             success=True,
             data={
-                "status": get_server_status(server_id),
+                "status": await run_docker(get_server_status, server_id),
                 "server": resp.data
             }
         )
@@ -197,10 +198,13 @@ async def websocket_endpoint(websocket: WebSocket, server_id: str):
         else:
             try:
                 # Get the container
-                container = docker.container.inspect(container_id)
+                backend = get_backend()
+                container = await run_docker(backend.inspect, container_id)
+                if container is None:
+                    raise Exception(f"No such container: {container_id}")
 
                 # Send historical logs first (last 100 lines)
-                logs = container.logs(tail=100).splitlines()
+                logs = (await run_docker(backend.logs, container_id, tail=100)).splitlines()
                 for line in logs:
                     line_text = line.decode('utf-8').strip() if isinstance(line, bytes) else line.strip()
                     await websocket.send_text(line_text)
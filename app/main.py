@@ -1,19 +1,72 @@
+import time
+IMPORT_STARTED = time.perf_counter()
+
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi_server.core.metrics import MetricsMiddleware, loop_lag_monitor, record_startup
+from fastapi_server.routers import health
+from fastapi_server.routers import metrics
 from fastapi_server.routers import server
 from fastapi_server.routers import server_old
+from scripts.server.services.admission import admission
+from scripts.server.services.backups import backup_manager
+from scripts.server.services.container_cache import container_cache
+from scripts.server.services.disk_usage import disk_usage
+from scripts.server.services.docker_hosts import docker_hosts
+from scripts.server.services.docker_service import DockerService
+from scripts.server.services.executors import shutdown_executors
+from scripts.server.services.hibernation import hibernator
+from scripts.server.services.lifecycle import lifecycle
+from scripts.server.services.log_broker import log_broker
+from scripts.server.services.log_store import log_archiver
+from scripts.server.services.rcon import rcon_pool
+from scripts.server.services.server_repository import server_repository
+from scripts.server.services.start_jobs import start_jobs
+from scripts.server.services.stats_collector import stats_collector
+from scripts.server.services.warm_pool import warm_pool
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Nothing here waits on Docker or Supabase, the worker serves right away and /readyz reports
+    # when its dependencies are reachable. The socket permission check runs in the background.
+    docker_check = asyncio.create_task(DockerService.ensure_access_async())
+    await docker_hosts.start()
+    await container_cache.start()
+    await admission.start()
+    await warm_pool.start()
+    await hibernator.start()
+    await stats_collector.start()
+    await log_archiver.start()
+    await rcon_pool.start()
+    await backup_manager.start()
+    await disk_usage.start()
+    loop_lag_monitor.start()
+    record_startup("lifespan")
 
-# You might need to add this to your startup script if you have permission issues
-import subprocess
+    yield
 
-# Check if Docker socket permissions need to be adjusted (if not running as root)
-try:
-    subprocess.run(["docker", "info"], check=True)
-except:
-    # Try to fix permissions if you have sudo access
-    subprocess.run(["sudo", "chmod", "666", "/var/run/docker.sock"])
+    docker_check.cancel()
+    await loop_lag_monitor.close()
+    await lifecycle.close()
+    await start_jobs.close()
+    await stats_collector.close()
+    await log_archiver.close()
+    await backup_manager.close()
+    await disk_usage.close()
+    await rcon_pool.close()
+    await hibernator.close()
+    await admission.close()
+    await warm_pool.close()
+    await container_cache.stop()
+    await docker_hosts.close()
+    await log_broker.close()
+    await server_repository.close()
+    shutdown_executors()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -30,7 +83,12 @@ app.add_middleware(
     allow_headers=["Content-Type", "Authorization"],
 )
 
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(server.router)
+app.include_router(health.router)
+app.include_router(metrics.router)
+
 # app.include_router(server_old.router)
 
 @app.get("/")
@@ -39,3 +97,5 @@ def read_root():
         "status": "online",
         "api_version": "0.0.1"
     }
+
+record_startup("import", origin=IMPORT_STARTED)
@@ -11,3 +11,158 @@ MINECRAFT_PORT = 25565
 
 # Server settings
 DATA_DIR_TEMPLATE = "{base_dir}/data/servers/{server_id}"
+
+# Docker Engine API settings
+DOCKER_BACKEND = os.environ.get('DOCKER_BACKEND', 'api')  # "api" (unix socket) or "cli" (python-on-whales)
+DOCKER_SOCKET = os.environ.get('DOCKER_SOCKET', '/var/run/docker.sock')
+DOCKER_API_VERSION = os.environ.get('DOCKER_API_VERSION', 'v1.41')
+DOCKER_TIMEOUT = float(os.environ.get('DOCKER_TIMEOUT', '30'))
+DOCKER_MAX_CONNECTIONS = int(os.environ.get('DOCKER_MAX_CONNECTIONS', '16'))
+DOCKER_FIX_PERMISSIONS = os.environ.get('DOCKER_FIX_PERMISSIONS', 'true').lower() == 'true'  # sudo chmod the socket if unusable
+
+# Container state cache settings
+CONTAINER_CACHE_ENABLED = os.environ.get('CONTAINER_CACHE_ENABLED', 'true').lower() == 'true'
+CONTAINER_CACHE_TTL = float(os.environ.get('CONTAINER_CACHE_TTL', '2'))  # seconds, used while the event stream is down
+CONTAINER_CACHE_RETRY = float(os.environ.get('CONTAINER_CACHE_RETRY', '1'))  # seconds between event stream reconnects
+
+# Executor settings, blocking Docker and Supabase calls run on their own bounded thread pools
+DOCKER_WORKERS = int(os.environ.get('DOCKER_WORKERS', '8'))
+SUPABASE_WORKERS = int(os.environ.get('SUPABASE_WORKERS', '8'))
+IO_WORKERS = int(os.environ.get('IO_WORKERS', '4'))  # directory walks, state files and lock waits of background jobs
+
+# Console log broker settings
+LOG_BUFFER_LINES = int(os.environ.get('LOG_BUFFER_LINES', '100'))  # recent lines replayed to new viewers
+LOG_SUBSCRIBER_QUEUE = int(os.environ.get('LOG_SUBSCRIBER_QUEUE', '1000'))  # lines buffered per viewer
+LOG_MAX_DROPPED = int(os.environ.get('LOG_MAX_DROPPED', '500'))  # lines a slow viewer may miss before it is disconnected
+
+# Supabase (PostgREST) HTTP client settings
+SUPABASE_MAX_CONNECTIONS = int(os.environ.get('SUPABASE_MAX_CONNECTIONS', '20'))
+SUPABASE_TIMEOUT = float(os.environ.get('SUPABASE_TIMEOUT', '10'))
+SERVER_CACHE_TTL = float(os.environ.get('SERVER_CACHE_TTL', '30'))  # seconds a cached server row is served
+SERVER_CACHE_SIZE = int(os.environ.get('SERVER_CACHE_SIZE', '2048'))  # cached rows and per-user listings, each
+
+# Start job settings
+START_HEALTH_TIMEOUT = float(os.environ.get('START_HEALTH_TIMEOUT', '600'))  # seconds to wait for a healthy container
+START_POLL_INTERVAL = float(os.environ.get('START_POLL_INTERVAL', '1'))  # re-check interval when no event arrives
+START_JOB_HISTORY = int(os.environ.get('START_JOB_HISTORY', '256'))  # finished jobs kept for status queries
+START_JOB_STATE_TEMPLATE = "{base_dir}/data/start_jobs.json"  # job progress shared with the other workers
+START_JOB_POLL_INTERVAL = float(os.environ.get('START_JOB_POLL_INTERVAL', '0.5'))  # how often streams of another worker's job re-read it
+
+# Warm pool settings, pre-initialized data directories for the most started TYPE/VERSION pairs
+WARM_POOL_ENABLED = os.environ.get('WARM_POOL_ENABLED', 'true').lower() == 'true'
+WARM_POOL_PAIRS = int(os.environ.get('WARM_POOL_PAIRS', '3'))  # most started pairs kept warm
+WARM_POOL_SLOTS = int(os.environ.get('WARM_POOL_SLOTS', '1'))  # ready templates per pair
+WARM_POOL_INTERVAL = float(os.environ.get('WARM_POOL_INTERVAL', '300'))  # seconds between refills
+WARM_POOL_CLAIM_INTERVAL = float(os.environ.get('WARM_POOL_CLAIM_INTERVAL', '5'))  # seconds between checks for templates claimed by other workers
+WARM_POOL_HISTORY = int(os.environ.get('WARM_POOL_HISTORY', '200'))  # recent starts used to rank pairs
+WARM_POOL_SETUP_TIMEOUT = float(os.environ.get('WARM_POOL_SETUP_TIMEOUT', '600'))
+TEMPLATE_DIR_TEMPLATE = "{base_dir}/data/templates"
+
+# Server List Ping settings, readiness and player counts straight from the Minecraft port
+PING_ENABLED = os.environ.get('PING_ENABLED', 'true').lower() == 'true'
+PING_HOST = os.environ.get('PING_HOST', SERVER_HOST_IP)  # where published server ports are reachable from here
+PING_TIMEOUT = float(os.environ.get('PING_TIMEOUT', '0.5'))  # seconds for one full ping
+PING_CONCURRENCY = int(os.environ.get('PING_CONCURRENCY', '32'))  # pings in flight at once
+PING_CACHE_TTL = float(os.environ.get('PING_CACHE_TTL', '2'))  # seconds a ping result is reused
+PING_READY_INTERVAL = float(os.environ.get('PING_READY_INTERVAL', '0.5'))  # probe interval while a server boots
+
+# Host port allocation, every server keeps its own port in this range across restarts
+PORT_RANGE_START = int(os.environ.get('PORT_RANGE_START', '30000'))
+PORT_RANGE_END = int(os.environ.get('PORT_RANGE_END', '30999'))  # inclusive
+PORT_BLOCK_SECONDS = float(os.environ.get('PORT_BLOCK_SECONDS', '600'))  # skip a port found taken outside our control
+PORT_STATE_TEMPLATE = "{base_dir}/data/ports.json"
+
+# Idle hibernation, servers without players are stopped and a listener on their port wakes them on login.
+# The backend must share the host's network namespace for players to reach its listeners.
+HIBERNATE_ENABLED = os.environ.get('HIBERNATE_ENABLED', 'false').lower() == 'true'
+HIBERNATE_IDLE_SECONDS = float(os.environ.get('HIBERNATE_IDLE_SECONDS', '900'))  # empty this long before stopping
+HIBERNATE_CHECK_INTERVAL = float(os.environ.get('HIBERNATE_CHECK_INTERVAL', '60'))  # seconds between player count checks
+HIBERNATE_SYNC_INTERVAL = float(os.environ.get('HIBERNATE_SYNC_INTERVAL', '1'))  # listener reconciliation interval
+HIBERNATE_LISTEN_HOST = os.environ.get('HIBERNATE_LISTEN_HOST', '0.0.0.0')
+HIBERNATE_CLIENT_TIMEOUT = float(os.environ.get('HIBERNATE_CLIENT_TIMEOUT', '5'))  # seconds a client gets to handshake
+HIBERNATE_RELEASE_TIMEOUT = float(os.environ.get('HIBERNATE_RELEASE_TIMEOUT', '3'))  # wait for a listener to free its port
+HIBERNATE_MOTD = os.environ.get('HIBERNATE_MOTD', '§7Sleeping, join to wake it up')
+SLEEP_STATE_TEMPLATE = "{base_dir}/data/sleeping.json"
+SLEEP_STATE_CACHE_TTL = float(os.environ.get('SLEEP_STATE_CACHE_TTL', '1'))  # seconds server listings reuse the sleeping servers read last
+
+# Admission control, starts wait in a fair queue while the host has no memory left for them
+ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'true').lower() == 'true'
+ADMISSION_MEMORY = os.environ.get('ADMISSION_MEMORY', '')  # memory servers may commit, e.g. "24G", empty for host RAM minus the reserve
+ADMISSION_RESERVED_MEMORY = os.environ.get('ADMISSION_RESERVED_MEMORY', '2G')  # left for the OS, Docker and this backend
+ADMISSION_MEMORY_OVERHEAD = float(os.environ.get('ADMISSION_MEMORY_OVERHEAD', '1.25'))  # container footprint per byte of heap
+ADMISSION_USER_CONCURRENCY = int(os.environ.get('ADMISSION_USER_CONCURRENCY', '2'))  # starts in progress per user
+ADMISSION_POLL_INTERVAL = float(os.environ.get('ADMISSION_POLL_INTERVAL', '2'))  # capacity re-check while starts wait
+ADMISSION_STATE_TEMPLATE = "{base_dir}/data/admission.json"
+
+# Docker hosts servers are placed on, a JSON list of {"name", "endpoint", "public_ip"} with optional
+# "ping_host" (address used to ping servers from here) and "memory" (overrides the host's RAM for admission).
+# Empty for the single local daemon at DOCKER_SOCKET, reachable at SERVER_HOST_IP.
+DOCKER_HOSTS = os.environ.get('DOCKER_HOSTS', '')
+PLACEMENT_STATE_TEMPLATE = "{base_dir}/data/placements.json"
+PLACEMENT_CACHE_TTL = float(os.environ.get('PLACEMENT_CACHE_TTL', '1'))  # seconds placements made by other workers may take to be seen
+
+# Container resource stats, one stats stream per running server downsampled into in-memory ring buffers
+STATS_ENABLED = os.environ.get('STATS_ENABLED', 'true').lower() == 'true'
+STATS_FINE_INTERVAL = int(os.environ.get('STATS_FINE_INTERVAL', '1'))  # seconds per point of the recent series
+STATS_FINE_POINTS = int(os.environ.get('STATS_FINE_POINTS', '300'))  # 5 minutes at 1s
+STATS_COARSE_INTERVAL = int(os.environ.get('STATS_COARSE_INTERVAL', '60'))  # seconds per point of the long series
+STATS_COARSE_POINTS = int(os.environ.get('STATS_COARSE_POINTS', '1440'))  # a day at 1m
+STATS_MAX_SERVERS = int(os.environ.get('STATS_MAX_SERVERS', '1000'))  # series kept, least recently updated dropped first
+STATS_SYNC_INTERVAL = float(os.environ.get('STATS_SYNC_INTERVAL', '5'))  # seconds between stream reconciliations
+STATS_SUBSCRIBER_QUEUE = int(os.environ.get('STATS_SUBSCRIBER_QUEUE', '8'))  # samples buffered per live viewer
+STATS_RELAY_TEMPLATE = "{base_dir}/data/stats.sock"  # the worker following the containers sends samples to the others here
+STATS_AUTH_TIMEOUT = float(os.environ.get('STATS_AUTH_TIMEOUT', '10'))  # seconds a live stats viewer has to send its token
+STATS_RELAY_QUEUE = int(os.environ.get('STATS_RELAY_QUEUE', '4096'))  # samples buffered per worker, a slower one reconnects
+
+# Console log archive, every running server's output kept in compressed append-only segments with an index
+LOG_STORE_ENABLED = os.environ.get('LOG_STORE_ENABLED', 'true').lower() == 'true'
+LOG_STORE_DIR_TEMPLATE = "{base_dir}/data/logs"  # one directory per server below it
+LOG_FLUSH_INTERVAL = float(os.environ.get('LOG_FLUSH_INTERVAL', '5'))  # seconds lines may wait in memory
+LOG_FLUSH_BYTES = int(os.environ.get('LOG_FLUSH_BYTES', str(64 * 1024)))  # buffered bytes that force a write
+LOG_SEGMENT_BYTES = int(os.environ.get('LOG_SEGMENT_BYTES', str(4 * 1024 * 1024)))  # compressed size of a segment file
+LOG_RETENTION_BYTES = int(os.environ.get('LOG_RETENTION_BYTES', str(64 * 1024 * 1024)))  # per server, oldest segments go first
+LOG_PAGE_LIMIT = int(os.environ.get('LOG_PAGE_LIMIT', '1000'))  # most lines returned by one history or search call
+LOG_SEARCH_MAX_BLOCKS = int(os.environ.get('LOG_SEARCH_MAX_BLOCKS', '256'))  # blocks one search call decompresses
+LOG_SYNC_INTERVAL = float(os.environ.get('LOG_SYNC_INTERVAL', '5'))  # seconds between log stream reconciliations
+
+# RCON, console commands go over one persistent connection per running server
+RCON_ENABLED = os.environ.get('RCON_ENABLED', 'true').lower() == 'true'
+RCON_PORT = int(os.environ.get('RCON_PORT', '25575'))  # inside the container, reached on its network address
+RCON_SECRET = os.environ.get('RCON_SECRET', '')  # server passwords are derived from it, empty for a generated one
+RCON_SECRET_TEMPLATE = "{base_dir}/data/rcon.secret"  # where the generated secret is kept
+RCON_CONNECT_TIMEOUT = float(os.environ.get('RCON_CONNECT_TIMEOUT', '3'))  # seconds to connect and log in
+RCON_TIMEOUT = float(os.environ.get('RCON_TIMEOUT', '10'))  # seconds a command may take
+RCON_IDLE_SECONDS = float(os.environ.get('RCON_IDLE_SECONDS', '300'))  # unused connections are closed after this
+RCON_RATE = float(os.environ.get('RCON_RATE', '5'))  # commands per second per user
+RCON_BURST = int(os.environ.get('RCON_BURST', '10'))  # commands a user may send at once
+
+# World backups, files split into content-defined chunks kept once in a compressed store shared by all servers
+BACKUP_DIR_TEMPLATE = "{base_dir}/data/backups"  # chunks/ and one snapshots/{server_id}/ per server below it
+BACKUP_WORKERS = int(os.environ.get('BACKUP_WORKERS', str(max(1, (os.cpu_count() or 2) // 2))))  # processes hashing and compressing
+BACKUP_COMPRESSION_LEVEL = int(os.environ.get('BACKUP_COMPRESSION_LEVEL', '6'))  # zlib level of stored chunks
+BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', '20'))  # snapshots kept per server, oldest go first
+BACKUP_INTERVAL = float(os.environ.get('BACKUP_INTERVAL', '0'))  # seconds between automatic backups of running servers, 0 disables
+BACKUP_EXCLUDE = [pattern for pattern in os.environ.get('BACKUP_EXCLUDE', 'logs/*,crash-reports/*,*.lock').split(',') if pattern]  # relative paths left out
+
+# World transfers, archives streamed straight from and into data directories without temporary files
+WORLD_TRANSFER_WORKERS = int(os.environ.get('WORLD_TRANSFER_WORKERS', '4'))  # threads reading, compressing and extracting archives
+WORLD_CHUNK_BYTES = int(os.environ.get('WORLD_CHUNK_BYTES', str(256 * 1024)))  # read and sent at a time, per transfer
+WORLD_ZIP_LEVEL = int(os.environ.get('WORLD_ZIP_LEVEL', '1'))  # deflate level of zip downloads, region files are compressed already
+WORLD_UPLOAD_MAX_BYTES = int(os.environ.get('WORLD_UPLOAD_MAX_BYTES', str(4 * 1024 ** 3)))  # size of an uploaded archive
+WORLD_UPLOAD_MAX_EXTRACTED_BYTES = int(os.environ.get('WORLD_UPLOAD_MAX_EXTRACTED_BYTES', str(8 * 1024 ** 3)))  # its contents, against archive bombs
+WORLD_UPLOAD_MAX_FILES = int(os.environ.get('WORLD_UPLOAD_MAX_FILES', '100000'))  # files and directories in it
+
+# Disk usage accounting, one scan of the server data directories and then inotify keeps per-server totals current
+DISK_USAGE_ENABLED = os.environ.get('DISK_USAGE_ENABLED', 'true').lower() == 'true'
+DISK_USAGE_STATE_TEMPLATE = "{base_dir}/data/disk_usage.json"  # totals shared with the workers not watching
+DISK_USAGE_FLUSH_INTERVAL = float(os.environ.get('DISK_USAGE_FLUSH_INTERVAL', '2'))  # seconds written files wait to be measured
+DISK_USAGE_RESCAN_INTERVAL = float(os.environ.get('DISK_USAGE_RESCAN_INTERVAL', '21600'))  # seconds between full rescans, the only updates without inotify
+# Per-server disk quotas, starts and uploads are refused over them. A JSON object of {server_id: bytes}
+# overrides the default for single servers.
+DISK_QUOTA_BYTES = int(os.environ.get('DISK_QUOTA_BYTES', '0'))  # 0 for no limit
+DISK_QUOTAS = os.environ.get('DISK_QUOTAS', '')
+DISK_QUOTA_WARN_RATIO = float(os.environ.get('DISK_QUOTA_WARN_RATIO', '0.9'))  # share of the quota that logs a warning
+
+# Server lifecycle, starts and stops of a server run one at a time in request order, on every worker
+LIFECYCLE_LOCK_TEMPLATE = "{base_dir}/data/lifecycle/{server_id}.lock"  # held by the worker running an operation
+LIFECYCLE_LOCK_POLL = float(os.environ.get('LIFECYCLE_LOCK_POLL', '0.1'))  # seconds between tries for another worker's lock
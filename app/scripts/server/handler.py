@@ -1,6 +1,7 @@
-from python_on_whales import docker
 import os
 
+from scripts.server.services.docker_backend import get_backend
+
 host_pwd = os.environ.get('HOST_PWD')
 
 def start_server(server_id: str, name: str, type: str, version: str):
@@ -11,16 +12,14 @@ def start_server(server_id: str, name: str, type: str, version: str):
     data_dir = f"{host_pwd}/data/servers/{server_id}"
     os.makedirs(data_dir, exist_ok=True)
 
-    if docker.container.exists(server_id):
-        docker.remove(server_id)
+    backend = get_backend()
+    if backend.exists(server_id):
+        backend.remove(server_id)
 
-    docker.run(
+    backend.run(
+        server_id,
         "itzg/minecraft-server",
-        detach=True,
-        interactive=True,
-        tty=True,
-        publish=[(0, 25565)],
-        envs={
+        {
             "EULA": "TRUE",
             "MEMORY": "512M",
             "MOTD": f"{name}",
@@ -28,14 +27,14 @@ def start_server(server_id: str, name: str, type: str, version: str):
             "TYPE": type,
             "ONLINE_MODE": "true"
         },
-        name=server_id,
-        volumes=[(data_dir, "/data")]
+        data_dir,
+        [(0, 25565)]
     )
 
-    ports = docker.container.inspect(server_id).network_settings.ports
+    state = backend.inspect(server_id)
 
-    if ports:
-        return ports["25565/tcp"][0]["HostPort"]
+    if state and state.port:
+        return state.port
 
     return -1
 
@@ -43,6 +42,7 @@ def stop_server(server_id: str):
     '''
     Stop and remove container
     '''
-    if docker.container.exists(server_id):
-        docker.stop(server_id)
-        docker.remove(server_id)
+    backend = get_backend()
+    if backend.exists(server_id):
+        backend.stop(server_id)
+        backend.remove(server_id)
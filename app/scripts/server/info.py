@@ -1,13 +1,13 @@
-from python_on_whales import docker
 import os
 
+from scripts.server.services.docker_backend import get_backend
+
 host_pwd = os.environ.get('HOST_PWD')
 
 def get_server_port(server_id: str):
-    if docker.container.exists(server_id) and docker.container.inspect(server_id).state.status == "running":
-        ports = docker.container.inspect(server_id).network_settings.ports
-        if ports:
-            return ports["25565/tcp"][0]["HostPort"]
+    state = get_backend().inspect(server_id)
+    if state and state.status == "running" and state.port:
+        return state.port
     return ""
 
 def get_server_status(server_id: str):
@@ -18,29 +18,29 @@ def get_server_status(server_id: str):
         "error": ""
     }
 
+    container = get_backend().inspect(server_id)
+
     # Server does not exist
-    if not docker.container.exists(server_id):
+    if container is None:
         resp["status"] = "stopped"
         return resp
 
-    container = docker.container.inspect(server_id)
-
     # Server not running
-    if container.state.status == "exited":
+    if container.status == "exited":
         resp["status"] = "stopped"
         return resp
 
-    if container.state.status == "running" and container.state.health:
-        resp["port"] = get_server_port(server_id)
+    if container.status == "running" and container.health:
+        resp["port"] = container.port or ""
         resp["url"] = f"129.213.144.81:{resp['port']}"
 
         # Server starting
-        if container.state.health.status == "starting":
+        if container.health == "starting":
             resp["status"] = "starting"
             return resp
 
         # Server running
-        if container.state.health.status == "healthy":
+        if container.health == "healthy":
             resp["status"] = "running"
             return resp
 
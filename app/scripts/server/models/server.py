@@ -6,13 +6,35 @@ class ServerStatus(str, Enum):
     RUNNING = "running"
     STARTING = "starting"
     STOPPED = "stopped"
+    SLEEPING = "sleeping"
     UNKNOWN = "unknown"
 
+class LifecycleState(str, Enum):
+    STOPPED = "stopped"
+    STARTING = "starting"
+    RUNNING = "running"
+    STOPPING = "stopping"
+
+class ServerPing(BaseModel):
+    online_players: int = 0
+    max_players: int = 0
+    version: Optional[str] = None
+    protocol: Optional[int] = None
+    motd: str = ""
+    latency_ms: Optional[float] = None
+
+class ServerDisk(BaseModel):
+    used_bytes: int
+    quota_bytes: Optional[int] = None
+    over_quota: bool = False
+
 class ServerInfo(BaseModel):
     port: Optional[str] = None
     url: Optional[str] = None
     status: ServerStatus = ServerStatus.STOPPED
     error: Optional[str] = None
+    ping: Optional[ServerPing] = None
+    disk: Optional[ServerDisk] = None
 
 class ServerConfig(BaseModel):
     id: str
@@ -22,3 +44,33 @@ class ServerConfig(BaseModel):
     memory: str = "512M"
     motd: Optional[str] = None
     online_mode: bool = True
+
+class ContainerState(BaseModel):
+    id: str
+    status: str
+    health: Optional[str] = None
+    port: Optional[str] = None
+    host: Optional[str] = None  # name of the Docker host it runs on
+
+class StartStage(str, Enum):
+    QUEUED = "queued"
+    PREPARE = "prepare"
+    PULL = "pull"
+    CREATE = "create"
+    BOOT = "boot"
+    HEALTHY = "healthy"
+    FAILED = "failed"
+
+class StartJob(BaseModel):
+    id: str
+    server_id: str
+    stage: StartStage = StartStage.QUEUED
+    progress: Optional[int] = None
+    port: Optional[str] = None
+    url: Optional[str] = None
+    error: Optional[str] = None
+    warm: Optional[bool] = None
+    queue_position: Optional[int] = None
+    estimated_wait: Optional[float] = None  # seconds until admitted, once there is enough history
+    created_at: float
+    updated_at: float
@@ -0,0 +1,323 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from collections import Counter, OrderedDict, deque
+from typing import AbstractSet, Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from scripts.server.config import (
+    ADMISSION_ENABLED,
+    ADMISSION_MEMORY,
+    ADMISSION_MEMORY_OVERHEAD,
+    ADMISSION_POLL_INTERVAL,
+    ADMISSION_RESERVED_MEMORY,
+    ADMISSION_STATE_TEMPLATE,
+    ADMISSION_USER_CONCURRENCY,
+    DEFAULT_MEMORY,
+    HOST_PWD,
+    PORT_RANGE_END,
+    PORT_RANGE_START,
+    START_HEALTH_TIMEOUT,
+)
+from scripts.server.models.server import ServerConfig
+from scripts.server.services.container_cache import container_cache
+from scripts.server.services.docker_api import DockerAPIClient
+from scripts.server.services.docker_hosts import DockerHost, docker_hosts
+from scripts.server.services.executors import run_docker, run_io
+from scripts.utils.json_state import JSONStateFile
+from scripts.utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+MEMORY_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+MEMORY_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$", re.IGNORECASE)
+
+admission_wait_seconds = registry.histogram(
+    "admission_wait_seconds", "Time server starts waited in the admission queue",
+    buckets=(0.01, 0.1, 1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0))
+
+PositionCallback = Callable[[int, Optional[float]], None]
+
+
+def memory_bytes(value: str) -> int:
+    """Bytes of a Docker/JVM style memory size such as "512M" or "2G"."""
+    match = MEMORY_PATTERN.match(value or "")
+    if match is None:
+        raise ValueError(f"Invalid memory size: {value!r}")
+    return int(float(match.group(1)) * MEMORY_UNITS[match.group(2).upper()])
+
+
+def host_capacity(host: DockerHost) -> int:
+    """Memory servers may commit on a host: its configured memory, ADMISSION_MEMORY, or its RAM minus the reserve."""
+    if host.memory:
+        return memory_bytes(host.memory)
+    if ADMISSION_MEMORY:
+        return memory_bytes(ADMISSION_MEMORY)
+    if host.local:
+        total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    else:
+        client = DockerAPIClient(host.endpoint, max_connections=1)
+        try:
+            total = client.info()["MemTotal"]
+        finally:
+            client.close()
+    return max(0, total - memory_bytes(ADMISSION_RESERVED_MEMORY))
+
+
+class _Ticket:
+    __slots__ = ("server_id", "user_id", "memory", "future", "enqueued_at", "on_position", "reported")
+
+    def __init__(self, server_id: str, user_id: str, memory: int, future: asyncio.Future,
+                 on_position: Optional[PositionCallback]):
+        self.server_id = server_id
+        self.user_id = user_id
+        self.memory = memory
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.on_position = on_position
+        self.reported = None
+
+
+class AdmissionController:
+    """
+    Admits server starts only while a Docker host has memory for them, queueing the rest.
+
+    Every admitted server commits its MEMORY times ADMISSION_MEMORY_OVERHEAD on its host until it
+    stops. Commitments live in a JSON file so all workers count against the same capacity, running
+    servers started before they were tracked count with DEFAULT_MEMORY. A server that was never
+    placed goes to the host with the most free memory, then the fewest running servers, and stays there.
+    A start that does not fit holds back later starts on its own hosts only, the other hosts keep admitting.
+
+    Waiting starts are served round-robin across users, each user having at most
+    ADMISSION_USER_CONCURRENCY starts in progress. The queue itself is per worker.
+    """
+
+    def __init__(self, path: str = ADMISSION_STATE_TEMPLATE.format(base_dir=HOST_PWD)):
+        self._file = JSONStateFile(path, keys=("commitments",))
+        self._capacity: Dict[str, int] = {}
+        self._queues: "OrderedDict[str, Deque[_Ticket]]" = OrderedDict()
+        self._starting: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._last_admitted: Optional[float] = None
+        self._admit_interval: Optional[float] = None
+
+        self.admitted = 0
+
+    async def start(self) -> None:
+        if not ADMISSION_ENABLED or self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        for queue in self._queues.values():
+            for ticket in queue:
+                ticket.future.cancel()
+        self._queues.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "capacity_bytes": sum(self._capacity.values()),
+            "committed_bytes": sum(self._committed(self._file.read()["commitments"], self._running()).values()),
+            "queued": sum(len(queue) for queue in self._queues.values()),
+            "starting": sum(self._starting.values()),
+            "admitted": self.admitted,
+        }
+
+    async def admit(self, config: ServerConfig, user_id: Optional[str] = None,
+                    on_position: Optional[PositionCallback] = None) -> None:
+        """
+        Wait until the server may start. `on_position(position, estimated_wait)` is called while it waits.
+
+        Every admission must be followed by finished() once the start succeeded or failed.
+        """
+        if self._task is None:
+            await run_io(self._place, config.id)
+            return
+        ticket = _Ticket(config.id, user_id or f"server:{config.id}",
+                         int(memory_bytes(config.memory) * ADMISSION_MEMORY_OVERHEAD),
+                         self._loop.create_future(), on_position)
+        self._queues.setdefault(ticket.user_id, deque()).append(ticket)
+        self._wakeup.set()
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            queue = self._queues.get(ticket.user_id)
+            if queue is not None and ticket in queue:
+                queue.remove(ticket)
+                if not queue:
+                    del self._queues[ticket.user_id]
+            elif ticket.future.done() and not ticket.future.cancelled():
+                await self.finished(config.id, user_id, started=False)
+            raise
+
+    async def finished(self, server_id: str, user_id: Optional[str] = None, started: bool = True) -> None:
+        """End an admitted start. A failed start gives its memory back right away."""
+        if self._task is None:
+            return
+        key = user_id or f"server:{server_id}"
+        self._starting[key] = self._starting.get(key, 1) - 1
+        if self._starting[key] <= 0:
+            del self._starting[key]
+        self._wakeup.set()
+        if not started:
+            await run_io(self.release, server_id)
+
+    def release(self, server_id: str) -> None:
+        """Give back the memory of a stopped server. Safe to call from any thread."""
+        with self._file.locked() as state:
+            state["commitments"].pop(server_id, None)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    @staticmethod
+    def _running() -> Dict[str, str]:
+        """{server_id: host name} of running servers."""
+        return {state.id: state.host or docker_hosts.default.name for state in container_cache.running()
+                if PORT_RANGE_START <= int(state.port) <= PORT_RANGE_END}
+
+    @staticmethod
+    def _committed(commitments: Dict[str, Any], running: Dict[str, str]) -> Dict[str, int]:
+        """Committed bytes per host."""
+        committed: Dict[str, int] = Counter()
+        for server_id, entry in commitments.items():
+            committed[entry.get("host") or docker_hosts.host_for(server_id).name] += entry["bytes"]
+        for server_id, host in running.items():
+            if server_id not in commitments:
+                committed[host] += int(memory_bytes(DEFAULT_MEMORY) * ADMISSION_MEMORY_OVERHEAD)
+        return committed
+
+    def _capacity_of(self, host: DockerHost) -> int:
+        capacity = self._capacity.get(host.name)
+        if capacity is None:
+            try:
+                capacity = self._capacity[host.name] = host_capacity(host)
+            except Exception as e:
+                # Not placeable until its daemon answers, asked again on the next dispatch
+                logger.error(f"Cannot read the memory of host {host.name}: {e}")
+                return 0
+            logger.info(f"Admitting servers on {host.name} up to {capacity / (1 << 30):.1f} GiB of committed memory")
+        return capacity
+
+    def _place(self, server_id: str) -> None:
+        """Place a server that never was on the host with the fewest running servers, when admission is off."""
+        if docker_hosts.locate(server_id) is None:
+            count = Counter(self._running().values())
+            docker_hosts.place(server_id, min(docker_hosts.hosts.values(), key=lambda host: count[host.name]))
+
+    def _commit(self, server_id: str, memory: int, skip: AbstractSet[str] = frozenset()) -> Tuple[bool, List[str]]:
+        """
+        Commit memory for a server if a host outside `skip` has room for it, returning whether it did and
+        the names of the hosts it waits for otherwise. Runs on the Docker pool, it takes the state file lock.
+        """
+        now = time.time()
+        with self._file.locked() as state:
+            commitments = state["commitments"]
+            running = self._running()
+            if container_cache.live:
+                # Servers stopped by another worker, or crashed, no longer use their memory
+                for owner in list(commitments):
+                    if owner not in running and now - commitments[owner]["since"] > START_HEALTH_TIMEOUT:
+                        del commitments[owner]
+
+            commitments.pop(server_id, None)
+            committed = self._committed(commitments, running)
+            placed = docker_hosts.locate(server_id)
+            candidates = [placed] if placed is not None else list(docker_hosts.hosts.values())
+            candidates = [host for host in candidates if host.name not in skip]
+            fitting = [host for host in candidates if committed[host.name] + memory <= self._capacity_of(host)]
+            if not fitting:
+                return False, [host.name for host in candidates]
+
+            count = Counter(running.values())
+            host = min(fitting, key=lambda host: (committed[host.name] - self._capacity_of(host), count[host.name]))
+            if placed is None:
+                docker_hosts.place(server_id, host)
+            commitments[server_id] = {"bytes": memory, "since": now, "host": host.name}
+            return True, []
+
+    def _next(self, skip: AbstractSet[str]) -> Optional[_Ticket]:
+        """Head of the first queue in round-robin order, outside `skip`, whose user may start another server."""
+        for user_id, queue in self._queues.items():
+            if user_id not in skip and self._starting.get(user_id, 0) < ADMISSION_USER_CONCURRENCY:
+                return queue[0]
+        return None
+
+    def _order(self) -> List[_Ticket]:
+        """Waiting tickets in the order they are expected to be admitted."""
+        queues = [list(queue) for queue in self._queues.values()]
+        order = []
+        for index in range(max((len(queue) for queue in queues), default=0)):
+            order.extend(queue[index] for queue in queues if index < len(queue))
+        return order
+
+    async def _dispatch(self) -> None:
+        # Hosts whose head of the line is waiting for room, and the users of the waiting heads
+        full: Set[str] = set()
+        waiting: Set[str] = set()
+        while len(full) < len(docker_hosts.hosts):
+            ticket = self._next(waiting)
+            if ticket is None:
+                break
+            # The head of the line of a host waits for room rather than being overtaken by smaller servers
+            admitted, hosts = await run_docker(self._commit, ticket.server_id, ticket.memory, frozenset(full))
+            if not admitted:
+                full.update(hosts)
+                waiting.add(ticket.user_id)
+                continue
+
+            queue = self._queues.pop(ticket.user_id)
+            queue.popleft()
+            if queue:
+                # Round-robin, the user goes to the back of the line
+                self._queues[ticket.user_id] = queue
+            self._starting[ticket.user_id] = self._starting.get(ticket.user_id, 0) + 1
+
+            now = time.monotonic()
+            waited = now - ticket.enqueued_at
+            admission_wait_seconds.observe(waited)
+            if waited > ADMISSION_POLL_INTERVAL and self._last_admitted is not None:
+                sample = now - max(self._last_admitted, ticket.enqueued_at)
+                self._admit_interval = sample if self._admit_interval is None else 0.7 * self._admit_interval + 0.3 * sample
+            self._last_admitted = now
+            self.admitted += 1
+            if not ticket.future.done():
+                ticket.future.set_result(None)
+
+        for position, ticket in enumerate(self._order(), start=1):
+            estimate = round(position * self._admit_interval) if self._admit_interval is not None else None
+            if ticket.on_position is not None and ticket.reported != (position, estimate):
+                ticket.reported = (position, estimate)
+                ticket.on_position(position, estimate)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._dispatch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error admitting server starts: {e}")
+
+            # Capacity freed by other workers is only seen by polling
+            timeout = ADMISSION_POLL_INTERVAL if self._queues else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+
+admission = AdmissionController()
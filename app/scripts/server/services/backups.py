@@ -0,0 +1,459 @@
+import asyncio
+import fcntl
+import fnmatch
+import json
+import logging
+import os
+import secrets
+import stat
+import time
+from typing import IO, Any, Dict, List, Optional, Sequence, Tuple
+
+from scripts.server.config import (
+    BACKUP_COMPRESSION_LEVEL,
+    BACKUP_DIR_TEMPLATE,
+    BACKUP_EXCLUDE,
+    BACKUP_INTERVAL,
+    BACKUP_KEEP,
+    DATA_DIR_TEMPLATE,
+    HOST_PWD,
+    PORT_RANGE_END,
+    PORT_RANGE_START,
+)
+from scripts.server.services.container_cache import container_cache
+from scripts.server.services.docker_hosts import docker_hosts
+from scripts.server.services.executors import run_backup, run_io
+from scripts.server.services.lifecycle import LifecycleError, lifecycle
+from scripts.server.services.rcon import RconError, rcon_pool
+from scripts.utils.chunking import restore_file, store_file
+from scripts.utils.json_state import JSONStateFile
+from scripts.utils.leader_lock import LeaderLock
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE_CHECK = 60  # seconds between looks for servers due a backup
+
+
+class BackupError(Exception):
+    """Raised when a backup or restore cannot be done."""
+
+
+class SnapshotNotFound(BackupError):
+    pass
+
+
+def scan(data_dir: str, exclude: Sequence[str] = BACKUP_EXCLUDE) -> Dict[str, Tuple[int, int, int]]:
+    """Regular files below a data directory as {relative path: (size, mtime_ns, mode)}, without `exclude` patterns."""
+    files = {}
+    for root, _, names in os.walk(data_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, data_dir)
+            if any(fnmatch.fnmatch(relative, pattern) for pattern in exclude):
+                continue
+            try:
+                info = os.lstat(path)
+            except FileNotFoundError:
+                continue
+            # Symlinks are left out, restoring one could point writes outside the directory
+            if stat.S_ISREG(info.st_mode):
+                files[relative] = (info.st_size, info.st_mtime_ns, info.st_mode)
+    return files
+
+
+def _gather_errors(results: List[Any]) -> None:
+    error = next((result for result in results if isinstance(result, BaseException)), None)
+    if error is not None:
+        raise error
+
+
+class BackupStore:
+    """
+    Snapshots of server worlds on top of a content-addressed chunk store shared by every server.
+
+    Layout below `root`: chunks/ab/<sha256> holds each distinct chunk once, zlib-compressed, and
+    snapshots/{server_id}/ a {snapshot_id}.json manifest per snapshot (every file with its size,
+    mtime, mode and chunk digests) plus an index.json of snapshot summaries. Backups hold a shared
+    flock on chunks.lock from their first chunk until their manifest is saved and garbage collection
+    takes it exclusively, so it never deletes chunks a snapshot in progress refers to.
+    """
+
+    def __init__(self, root: str = BACKUP_DIR_TEMPLATE.format(base_dir=HOST_PWD)):
+        self.root = root
+        self.chunks = os.path.join(root, "chunks")
+        self._indexes: Dict[str, JSONStateFile] = {}
+
+    def _server_dir(self, server_id: str) -> str:
+        return os.path.join(self.root, "snapshots", server_id)
+
+    def _index(self, server_id: str) -> JSONStateFile:
+        index = self._indexes.get(server_id)
+        if index is None:
+            index = self._indexes[server_id] = JSONStateFile(
+                os.path.join(self._server_dir(server_id), "index.json"), keys=("snapshots",))
+        return index
+
+    def server_lock_path(self, server_id: str) -> str:
+        """Lock file held while a server is backed up or restored."""
+        return os.path.join(self._server_dir(server_id), ".lock")
+
+    def lock_chunks(self, exclusive: bool = False, blocking: bool = True) -> Optional[IO]:
+        """Lock the chunk store, close the returned file to unlock. None if a non-blocking lock is taken."""
+        os.makedirs(self.root, exist_ok=True)
+        lock_file = open(os.path.join(self.root, "chunks.lock"), "a")
+        try:
+            fcntl.flock(lock_file, (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | (0 if blocking else fcntl.LOCK_NB))
+        except OSError:
+            lock_file.close()
+            if blocking:
+                raise
+            return None
+        return lock_file
+
+    def list(self, server_id: str) -> List[Dict[str, Any]]:
+        """Summaries of a server's snapshots, newest first."""
+        snapshots = self._index(server_id).read()["snapshots"]
+        return [snapshots[snapshot_id] for snapshot_id in sorted(snapshots, reverse=True)]
+
+    def load(self, server_id: str, snapshot_id: str) -> Dict[str, Any]:
+        # Only IDs from the index are turned into paths
+        if snapshot_id not in self._index(server_id).read()["snapshots"]:
+            raise SnapshotNotFound("Snapshot not found")
+        with open(os.path.join(self._server_dir(server_id), f"{snapshot_id}.json")) as f:
+            return json.load(f)
+
+    def latest(self, server_id: str) -> Optional[Dict[str, Any]]:
+        snapshots = self.list(server_id)
+        return self.load(server_id, snapshots[0]["id"]) if snapshots else None
+
+    def save(self, manifest: Dict[str, Any]) -> List[str]:
+        """Write a snapshot's manifest and index it. Returns the IDs of the snapshots dropped past BACKUP_KEEP."""
+        server_id, snapshot_id = manifest["server_id"], manifest["id"]
+        server_dir = self._server_dir(server_id)
+        os.makedirs(server_dir, exist_ok=True)
+        path = os.path.join(server_dir, f"{snapshot_id}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+
+        with self._index(server_id).locked() as state:
+            snapshots = state["snapshots"]
+            snapshots[snapshot_id] = {"id": snapshot_id, "created_at": manifest["created_at"], **manifest["stats"]}
+            # IDs start with the UTC time, sorting them sorts by age
+            dropped = sorted(snapshots)[:max(0, len(snapshots) - BACKUP_KEEP)]
+            for dropped_id in dropped:
+                del snapshots[dropped_id]
+        for dropped_id in dropped:
+            self._remove_manifest(server_id, dropped_id)
+        return dropped
+
+    def delete(self, server_id: str, snapshot_id: str) -> None:
+        with self._index(server_id).locked() as state:
+            if state["snapshots"].pop(snapshot_id, None) is None:
+                raise SnapshotNotFound("Snapshot not found")
+        self._remove_manifest(server_id, snapshot_id)
+
+    def _remove_manifest(self, server_id: str, snapshot_id: str) -> None:
+        try:
+            os.remove(os.path.join(self._server_dir(server_id), f"{snapshot_id}.json"))
+        except FileNotFoundError:
+            pass
+
+    def collect_garbage(self) -> Optional[Tuple[int, int]]:
+        """
+        Delete chunks no manifest refers to. Returns (chunks, bytes) removed, or None when a backup
+        is writing chunks, the next collection gets them.
+        """
+        lock = self.lock_chunks(exclusive=True, blocking=False)
+        if lock is None:
+            return None
+        try:
+            referenced = set()
+            snapshots_dir = os.path.join(self.root, "snapshots")
+            for server_id in os.listdir(snapshots_dir) if os.path.isdir(snapshots_dir) else ():
+                server_dir = os.path.join(snapshots_dir, server_id)
+                for name in os.listdir(server_dir):
+                    if not name.endswith(".json") or name == "index.json":
+                        continue
+                    with open(os.path.join(server_dir, name)) as f:
+                        manifest = json.load(f)
+                    for entry in manifest["files"].values():
+                        referenced.update(entry["chunks"])
+
+            removed = freed = 0
+            for prefix in os.listdir(self.chunks) if os.path.isdir(self.chunks) else ():
+                prefix_dir = os.path.join(self.chunks, prefix)
+                # Also the .tmp files of writers that died, no writer is running now
+                for name in os.listdir(prefix_dir):
+                    if name not in referenced:
+                        path = os.path.join(prefix_dir, name)
+                        freed += os.path.getsize(path)
+                        os.remove(path)
+                        removed += 1
+            return removed, freed
+        finally:
+            lock.close()
+
+
+def remove_unlisted(data_dir: str, files: Dict[str, Any]) -> int:
+    """Delete files of a data directory that are not in `files`. Returns how many were deleted."""
+    removed = 0
+    for path in scan(data_dir):
+        if path not in files:
+            os.remove(os.path.join(data_dir, path))
+            removed += 1
+    return removed
+
+
+class BackupManager:
+    """
+    Backs up and restores the worlds of servers on local Docker hosts.
+
+    A backup only reads files whose size or mtime changed since the server's last snapshot, the rest
+    are carried over from its manifest. Changed files are chunked, hashed and compressed in the backup
+    process pool, and only chunks the store does not have yet are written, so time and space follow
+    what changed. A running server is told over RCON to flush its world and stop saving while it is
+    read. With BACKUP_INTERVAL set, the worker holding the leader lock backs up running servers that often.
+    """
+
+    def __init__(self, store: BackupStore):
+        self._store = store
+        self._leader = LeaderLock(os.path.join(store.root, ".leader"))
+        self._task: Optional[asyncio.Task] = None
+
+        self.active = 0
+        self.backups = 0
+        self.restores = 0
+        self.new_bytes = 0
+
+    async def start(self) -> None:
+        if BACKUP_INTERVAL <= 0 or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._leader.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "leader": self._leader.held,
+            "active": self.active,
+            "backups": self.backups,
+            "restores": self.restores,
+            "new_bytes": self.new_bytes,
+        }
+
+    def _data_dir(self, server_id: str) -> str:
+        if not docker_hosts.host_for(server_id).local:
+            raise BackupError("The server's world is on another host")
+        return DATA_DIR_TEMPLATE.format(base_dir=HOST_PWD, server_id=server_id)
+
+    async def _locked(self, server_id: str) -> LeaderLock:
+        lock = LeaderLock(self._store.server_lock_path(server_id))
+        if not await run_io(lock.try_acquire):
+            raise BackupError("A backup or restore of this server is already running")
+        return lock
+
+    async def create(self, server_id: str) -> Dict[str, Any]:
+        """Back up a server's world now and return the snapshot's summary."""
+        data_dir = self._data_dir(server_id)
+        if not os.path.isdir(data_dir):
+            raise BackupError("The server has no world yet")
+
+        lock = await self._locked(server_id)
+        self.active += 1
+        try:
+            paused = await self._pause_saving(server_id)
+            try:
+                chunks_lock = await run_io(self._store.lock_chunks)
+                try:
+                    manifest = await self._snapshot(server_id, data_dir)
+                    dropped = await run_io(self._store.save, manifest)
+                finally:
+                    chunks_lock.close()
+            finally:
+                if paused:
+                    await self._resume_saving(server_id)
+        finally:
+            self.active -= 1
+            lock.release()
+
+        self.backups += 1
+        self.new_bytes += manifest["stats"]["new_bytes"]
+        if dropped:
+            await run_io(self._store.collect_garbage)
+        return {"id": manifest["id"], "created_at": manifest["created_at"], **manifest["stats"]}
+
+    async def _snapshot(self, server_id: str, data_dir: str) -> Dict[str, Any]:
+        started = time.monotonic()
+        previous = await run_io(self._store.latest, server_id)
+        previous_files = previous["files"] if previous is not None else {}
+        files = await run_io(scan, data_dir)
+
+        entries: Dict[str, Dict[str, Any]] = {}
+        changed = []
+        for path, (size, mtime_ns, mode) in files.items():
+            entry = previous_files.get(path)
+            if entry is not None and entry["size"] == size and entry["mtime_ns"] == mtime_ns and entry["mode"] == mode:
+                entries[path] = entry
+            else:
+                changed.append(path)
+
+        results = await asyncio.gather(*(
+            run_backup(store_file, os.path.join(data_dir, path), self._store.chunks, BACKUP_COMPRESSION_LEVEL)
+            for path in changed
+        ), return_exceptions=True)
+        new_chunks = new_bytes = 0
+        for path, result in zip(changed, results):
+            if isinstance(result, FileNotFoundError):
+                continue  # deleted since the scan
+            if isinstance(result, BaseException):
+                raise result
+            digests, stored_chunks, stored_bytes = result
+            size, mtime_ns, mode = files[path]
+            entries[path] = {"size": size, "mtime_ns": mtime_ns, "mode": mode, "chunks": digests}
+            new_chunks += stored_chunks
+            new_bytes += stored_bytes
+
+        return {
+            "id": time.strftime("%Y%m%dT%H%M%SZ", time.gmtime()) + "-" + secrets.token_hex(3),
+            "server_id": server_id,
+            "created_at": time.time(),
+            "files": entries,
+            "stats": {
+                "files": len(entries),
+                "bytes": sum(entry["size"] for entry in entries.values()),
+                "changed_files": len(changed),
+                "new_chunks": new_chunks,
+                "new_bytes": new_bytes,
+                "seconds": round(time.monotonic() - started, 3),
+            },
+        }
+
+    async def _pause_saving(self, server_id: str) -> bool:
+        """Have a running server write its world out and stop saving. False if it is not running or has no console."""
+        try:
+            await rcon_pool.execute(server_id, "save-off")
+        except RconError:
+            return False
+        try:
+            await rcon_pool.execute(server_id, "save-all flush")
+        except RconError as e:
+            logger.warning(f"Could not flush the world of {server_id} before backing it up: {e}")
+        return True
+
+    async def _resume_saving(self, server_id: str) -> None:
+        try:
+            await rcon_pool.execute(server_id, "save-on")
+        except RconError as e:
+            logger.warning(f"Could not turn saving back on for {server_id}: {e}")
+
+    def files(self, server_id: str, snapshot_id: str, prefix: str = "") -> List[Dict[str, Any]]:
+        """Files of a snapshot, optionally only those below `prefix`. Blocking, run it off the loop."""
+        manifest = self._store.load(server_id, snapshot_id)
+        prefix = prefix.strip("/")
+        return [
+            {"path": path, "size": entry["size"], "mtime": entry["mtime_ns"] / 1e9}
+            for path, entry in sorted(manifest["files"].items())
+            if not prefix or path == prefix or path.startswith(prefix + "/")
+        ]
+
+    async def restore(self, server_id: str, snapshot_id: str, paths: Optional[List[str]] = None) -> Dict[str, int]:
+        """
+        Write a snapshot back into the server's data directory: the files at or below `paths`, or all
+        of them, in which case files the snapshot does not have are deleted. The server must be stopped.
+        """
+        try:
+            # Starts, wake-ups included, wait until the files are back
+            async with lifecycle.hold(server_id, "restore"):
+                return await self._restore(server_id, snapshot_id, paths)
+        except LifecycleError as e:
+            raise BackupError(str(e))
+
+    async def _restore(self, server_id: str, snapshot_id: str, paths: Optional[List[str]]) -> Dict[str, int]:
+        data_dir = self._data_dir(server_id)
+        manifest = await run_io(self._store.load, server_id, snapshot_id)
+        files = manifest["files"]
+        if paths:
+            prefixes = [path.strip("/") for path in paths]
+            files = {path: entry for path, entry in files.items()
+                     if any(path == prefix or path.startswith(prefix + "/") for prefix in prefixes if prefix)}
+            if not files:
+                raise BackupError("None of the paths are in the snapshot")
+
+        lock = await self._locked(server_id)
+        self.active += 1
+        try:
+            # Files still as they were in the snapshot are left alone
+            current = await run_io(scan, data_dir)
+            changed = {path: entry for path, entry in files.items()
+                       if current.get(path) != (entry["size"], entry["mtime_ns"], entry["mode"])}
+            chunks_lock = await run_io(self._store.lock_chunks)
+            try:
+                _gather_errors(await asyncio.gather(*(
+                    run_backup(restore_file, self._store.chunks, entry["chunks"], os.path.join(data_dir, path),
+                               entry["mode"], entry["mtime_ns"])
+                    for path, entry in changed.items()
+                ), return_exceptions=True))
+            finally:
+                chunks_lock.close()
+            removed = 0 if paths else await run_io(remove_unlisted, data_dir, files)
+        finally:
+            self.active -= 1
+            lock.release()
+
+        self.restores += 1
+        logger.info(f"Restored {len(changed)} files of {server_id} from snapshot {snapshot_id}")
+        return {"files": len(files), "restored": len(changed), "removed": removed}
+
+    async def delete(self, server_id: str, snapshot_id: str) -> None:
+        await run_io(self._store.delete, server_id, snapshot_id)
+        await run_io(self._store.collect_garbage)
+
+    def _try_lead(self) -> bool:
+        if self._leader.held:
+            return True
+        if not self._leader.try_acquire():
+            return False
+        logger.info("This worker now runs scheduled backups")
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if await run_io(self._try_lead):
+                    await self._backup_due()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error running scheduled backups: {e}")
+            await asyncio.sleep(min(BACKUP_INTERVAL, SCHEDULE_CHECK))
+
+    async def _backup_due(self) -> None:
+        """Back up running servers on local hosts whose last snapshot is BACKUP_INTERVAL old, one at a time."""
+        for state in container_cache.running():
+            if not PORT_RANGE_START <= int(state.port) <= PORT_RANGE_END:
+                continue
+            if not (docker_hosts.get(state.host) if state.host else docker_hosts.default).local:
+                continue
+            snapshots = await run_io(self._store.list, state.id)
+            if snapshots and time.time() - snapshots[0]["created_at"] < BACKUP_INTERVAL:
+                continue
+            try:
+                summary = await self.create(state.id)
+                logger.info(f"Backed up {state.id}: {summary['changed_files']} changed files, "
+                            f"{summary['new_bytes']} new bytes in {summary['seconds']}s")
+            except BackupError as e:
+                logger.info(f"Skipped the scheduled backup of {state.id}: {e}")
+
+
+backup_store = BackupStore()
+backup_manager = BackupManager(backup_store)
@@ -0,0 +1,273 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from scripts.server.config import CONTAINER_CACHE_ENABLED, CONTAINER_CACHE_RETRY, CONTAINER_CACHE_TTL
+from scripts.server.models.server import ContainerState
+from scripts.server.services.docker_api import AsyncDockerAPIClient, DockerNotFound
+from scripts.server.services.docker_backend import state_from_inspect, state_from_summary
+from scripts.server.services.docker_hosts import DockerHost, docker_hosts
+
+logger = logging.getLogger(__name__)
+
+EVENT_FILTERS = {
+    "type": ["container"],
+    "event": ["create", "start", "die", "stop", "health_status", "destroy", "rename"],
+}
+MAX_RETRY_DELAY = 30
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class ContainerStateCache:
+    """
+    In-process cache of container state keyed by container name (the server ID).
+
+    For every Docker host a background task takes a full listing and then follows the events
+    stream, so while all streams are connected every lookup is answered from memory. When a stream
+    drops, entries are only trusted for CONTAINER_CACHE_TTL seconds and callers refresh them on a miss.
+
+    The state is only changed on the event loop. Stores from executor threads are handed over to it,
+    so they cannot interleave with a resync replacing a host's entries.
+    """
+
+    def __init__(self, ttl: float = CONTAINER_CACHE_TTL):
+        self._ttl = ttl
+        self._clients: Dict[str, AsyncDockerAPIClient] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._states: Dict[str, ContainerState] = {}
+        self._updated: Dict[str, float] = {}
+        self._synced_at: Optional[float] = None
+        self._live_hosts: Set[str] = set()
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.events = 0
+        self.resyncs = 0
+        self.stream_drops = 0
+
+    @property
+    def live(self) -> bool:
+        return self._task is not None and len(self._live_hosts) == len(docker_hosts.hosts)
+
+    async def start(self) -> None:
+        if not CONTAINER_CACHE_ENABLED or self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._clients = {name: AsyncDockerAPIClient(host.endpoint) for name, host in docker_hosts.hosts.items()}
+        self._task = asyncio.create_task(self._run_all())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        for client in self._clients.values():
+            await client.close()
+        self._task = None
+        self._clients = {}
+        self._live_hosts.clear()
+
+    def lookup(self, container_id: str) -> Tuple[bool, Optional[ContainerState]]:
+        """Return (hit, state). A hit with state None means the container does not exist."""
+        if self._task is None:
+            return False, None
+
+        if not self.live:
+            updated = self._updated.get(container_id, self._synced_at)
+            if updated is None or time.monotonic() - updated > self._ttl:
+                if updated is not None:
+                    self.stale += 1
+                self.misses += 1
+                return False, None
+
+        self.hits += 1
+        return True, self._states.get(container_id)
+
+    def lookup_many(self, container_ids: Iterable[str]) -> Optional[Dict[str, ContainerState]]:
+        """Return the known states of all given containers, or None if any of them is a miss."""
+        states = {}
+        for container_id in container_ids:
+            hit, state = self.lookup(container_id)
+            if not hit:
+                return None
+            if state is not None:
+                states[container_id] = state
+        return states
+
+    def running(self) -> List[ContainerState]:
+        """Running containers that publish a port, on every host. Empty while a stream is down."""
+        if not self.live:
+            return []
+        return [state for state in list(self._states.values()) if state.status == "running" and state.port]
+
+    def published_ports(self) -> Dict[int, str]:
+        """Host ports published by running containers, {port: container_id}. Empty while a stream is down."""
+        return {int(state.port): state.id for state in self.running()}
+
+    async def wait_for_change(self, container_id: str, timeout: float) -> bool:
+        """Wait until the state of a container changes, or timeout. Returns whether it changed."""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(container_id, []).append(future)
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            waiters = self._waiters.get(container_id)
+            if waiters and future in waiters:
+                waiters.remove(future)
+                if not waiters:
+                    del self._waiters[container_id]
+
+    def _notify(self, container_id: str) -> None:
+        for future in self._waiters.pop(container_id, []):
+            _wake(future)
+
+    def _on_loop(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    def store(self, container_id: str, state: Optional[ContainerState]) -> None:
+        """Record a state fetched directly from Docker, None meaning the container is gone. Safe from any thread."""
+        if self._task is None:
+            return
+        if not self._on_loop():
+            # Applied in order with the callback completing the executor call, so the caller sees it
+            self._loop.call_soon_threadsafe(self.store, container_id, state)
+            return
+        if state is None:
+            self._states.pop(container_id, None)
+        else:
+            if state.host is None:
+                state.host = docker_hosts.host_for(container_id).name
+            self._states[container_id] = state
+        self._updated[container_id] = time.monotonic()
+        self._notify(container_id)
+
+    def store_provisional(self, container_id: str, state: ContainerState) -> None:
+        """Record a state we expect without asking Docker, unless its start event came first. Safe from any thread."""
+        if self._task is None:
+            return
+        if not self._on_loop():
+            self._loop.call_soon_threadsafe(self.store_provisional, container_id, state)
+            return
+        current = self._states.get(container_id)
+        if current is not None and current.status == "running" and current.port == state.port:
+            return
+        self.store(container_id, state)
+
+    def stats(self) -> Dict[str, Any]:
+        last_update = max(self._updated.values(), default=self._synced_at)
+        return {
+            "live": self.live,
+            "live_hosts": len(self._live_hosts),
+            "entries": len(self._states),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "events": self.events,
+            "resyncs": self.resyncs,
+            "stream_drops": self.stream_drops,
+            "seconds_since_update": time.monotonic() - last_update if last_update is not None else None,
+        }
+
+    async def _run_all(self) -> None:
+        await asyncio.gather(*(self._run(host) for host in docker_hosts.hosts.values()))
+
+    async def _run(self, host: DockerHost) -> None:
+        client = self._clients[host.name]
+        delay = CONTAINER_CACHE_RETRY
+        while True:
+            try:
+                # Replay events from just before the listing so nothing falls between the two
+                since = f"{time.time():.9f}"
+                await self._resync(host, client)
+                self._live_hosts.add(host.name)
+                delay = CONTAINER_CACHE_RETRY
+
+                params = {"since": since, "filters": json.dumps(EVENT_FILTERS)}
+                async for event in client.stream_json("/events", params=params):
+                    await self._apply(host, client, event)
+                logger.warning(f"Docker event stream of {host.name} closed")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Docker event stream of {host.name} failed: {e}")
+
+            if host.name in self._live_hosts:
+                self.stream_drops += 1
+            self._live_hosts.discard(host.name)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RETRY_DELAY)
+
+    async def _resync(self, host: DockerHost, client: AsyncDockerAPIClient) -> None:
+        containers = await client.list_containers(all=True)
+        states = {state.id: state for state in map(state_from_summary, containers)}
+        for state in states.values():
+            state.host = host.name
+        # Only this host's containers are replaced, the other streams keep theirs
+        self._states = {container_id: state for container_id, state in self._states.items()
+                        if state.host != host.name}
+        self._states.update(states)
+        for container_id in states:
+            self._updated.pop(container_id, None)
+        self._synced_at = time.monotonic()
+        self.resyncs += 1
+        for container_id in list(self._waiters):
+            self._notify(container_id)
+
+    async def _apply(self, host: DockerHost, client: AsyncDockerAPIClient, event: Dict[str, Any]) -> None:
+        action = event.get("Action") or event.get("status") or ""
+        attributes = (event.get("Actor") or {}).get("Attributes", {})
+        name = attributes.get("name")
+        if not name:
+            return
+        self.events += 1
+
+        if action == "rename":
+            self._states.pop(attributes.get("oldName", "").lstrip("/"), None)
+
+        if action.startswith("health_status"):
+            current = self._states.get(name)
+            if current is not None:
+                self._states[name] = ContainerState(
+                    id=current.id,
+                    status=current.status,
+                    health=action.split(":", 1)[1].strip(),
+                    port=current.port,
+                    host=current.host,
+                )
+        else:
+            # A destroy is inspected too: it may be of the container a start just replaced
+            try:
+                state = state_from_inspect(await client.inspect_container(name))
+                state.host = host.name
+                self._states[name] = state
+            except DockerNotFound:
+                self._forget(host, name)
+        self._updated[name] = time.monotonic()
+        self._notify(name)
+
+    def _forget(self, host: DockerHost, name: str) -> None:
+        # A container of the same name on another host is a different one
+        current = self._states.get(name)
+        if current is not None and current.host == host.name:
+            del self._states[name]
+
+
+container_cache = ContainerStateCache()
@@ -0,0 +1,354 @@
+import asyncio
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import struct
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from scripts.server.config import (
+    DATA_DIR_TEMPLATE,
+    DISK_QUOTA_BYTES,
+    DISK_QUOTA_WARN_RATIO,
+    DISK_QUOTAS,
+    DISK_USAGE_ENABLED,
+    DISK_USAGE_FLUSH_INTERVAL,
+    DISK_USAGE_RESCAN_INTERVAL,
+    DISK_USAGE_STATE_TEMPLATE,
+    HOST_PWD,
+)
+from scripts.server.models.server import ServerDisk
+from scripts.server.services.executors import run_io
+from scripts.utils.json_state import JSONStateFile
+from scripts.utils.leader_lock import LeaderLock
+
+logger = logging.getLogger(__name__)
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+EVENT = struct.Struct("iIII")
+
+# Server directories appearing, disappearing or being swapped (world uploads)
+ROOT_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR
+DIRECTORY_MASK = ROOT_MASK | IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE
+
+
+class QuotaExceeded(Exception):
+    """Raised when a server is at or over its disk quota."""
+
+
+def parse_quotas(spec: str) -> Dict[str, int]:
+    """Per-server quotas from a DISK_QUOTAS JSON object."""
+    return {server_id: int(quota) for server_id, quota in json.loads(spec).items()} if spec else {}
+
+
+class Inotify:
+    """Just enough of inotify(7), through libc."""
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def add_watch(self, path: str, mask: int) -> int:
+        """Watch a directory. Watching it again returns the same descriptor."""
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def remove_watch(self, wd: int) -> None:
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self) -> List[Tuple[int, int, str]]:
+        """Pending events as (wd, mask, name), empty when there are none."""
+        try:
+            data = os.read(self.fd, 256 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            events.append((wd, mask, os.fsdecode(data[offset:offset + length].rstrip(b"\0"))))
+            offset += length
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def _measure(path: str) -> Optional[int]:
+    """Bytes a file takes on disk, like du. None once it is gone."""
+    try:
+        return os.lstat(path).st_blocks * 512
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+class DiskUsage:
+    """
+    Disk space taken by each server's data directory, kept current without walking it again.
+
+    The worker holding the leader lock scans the servers directory once and puts an inotify watch
+    on every directory in it. From then on deletions are subtracted as their events arrive, and
+    written files are measured every DISK_USAGE_FLUSH_INTERVAL seconds, once however often they
+    were written to. A directory created, moved or deleted inside a world gets that server
+    rescanned. Totals go to a state file that the other workers reload on the same interval, so
+    usage() is a dictionary lookup in every worker. A full rescan every DISK_USAGE_RESCAN_INTERVAL
+    seconds corrects anything missed, and it is the only source of updates where inotify is unavailable.
+    """
+
+    def __init__(self, root: str = os.path.dirname(DATA_DIR_TEMPLATE.format(base_dir=HOST_PWD, server_id="_")),
+                 state_path: str = DISK_USAGE_STATE_TEMPLATE.format(base_dir=HOST_PWD)):
+        self.root = root
+        self._state = JSONStateFile(state_path, keys=("servers",))
+        self._leader = LeaderLock(state_path + ".leader")
+        self._quotas = parse_quotas(DISK_QUOTAS)
+        self._totals: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+        # Leader only
+        self._inotify: Optional[Inotify] = None
+        self._files: Dict[str, Dict[str, int]] = {}
+        self._watches: Dict[int, Tuple[str, str]] = {}  # wd: (server_id, directory), "" for the root
+        self._dirty: Set[Tuple[str, str]] = set()
+        self._rescans: Set[str] = set()
+        self._rescanned_at = 0.0
+        self._published: Dict[str, int] = {}
+        self._warned: Set[str] = set()
+
+        self.events = 0
+        self.measured = 0
+        self.scans = 0
+        self.overflows = 0
+
+    async def start(self) -> None:
+        if not DISK_USAGE_ENABLED or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._stop_watching()
+        self._leader.release()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "leader": self._leader.held,
+            "servers": len(self._totals),
+            "watches": len(self._watches),
+            "events": self.events,
+            "measured": self.measured,
+            "scans": self.scans,
+            "overflows": self.overflows,
+        }
+
+    def usage(self, server_id: str) -> Optional[int]:
+        """Bytes a server's data directory takes, None before it is known (or on remote hosts)."""
+        return self._totals.get(server_id)
+
+    def quota(self, server_id: str) -> Optional[int]:
+        return self._quotas.get(server_id, DISK_QUOTA_BYTES) or None
+
+    def info(self, server_id: str) -> Optional[ServerDisk]:
+        used = self._totals.get(server_id)
+        if used is None:
+            return None
+        quota = self.quota(server_id)
+        return ServerDisk(used_bytes=used, quota_bytes=quota, over_quota=quota is not None and used >= quota)
+
+    def check_quota(self, server_id: str) -> None:
+        """Raise QuotaExceeded when the server may not grow, it is then refused starts and uploads."""
+        used, quota = self._totals.get(server_id), self.quota(server_id)
+        if used is not None and quota is not None and used >= quota:
+            raise QuotaExceeded(f"The server uses {used // 2 ** 20} MB of its {quota // 2 ** 20} MB disk quota, "
+                                "delete files or restore a smaller backup to start it again")
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if await run_io(self._try_lead):
+                    await self._update()
+                else:
+                    self._totals = dict((await run_io(self._state.read))["servers"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error updating disk usage: {e}")
+            await asyncio.sleep(DISK_USAGE_FLUSH_INTERVAL)
+
+    def _try_lead(self) -> bool:
+        if self._leader.held:
+            return True
+        if not self._leader.try_acquire():
+            return False
+        logger.info("This worker now accounts disk usage")
+        return True
+
+    async def _update(self) -> None:
+        if self._rescanned_at == 0 or time.monotonic() - self._rescanned_at > DISK_USAGE_RESCAN_INTERVAL:
+            await self._watch_root()
+        rescans, self._rescans = self._rescans, set()
+        for server_id in rescans:
+            await self._scan(server_id)
+
+        dirty = [(server_id, path) for server_id, path in self._dirty if server_id not in rescans]
+        self._dirty.clear()
+        if dirty:
+            sizes = await run_io(lambda: [_measure(os.path.join(self.root, server_id, path))
+                                              for server_id, path in dirty])
+            for (server_id, path), size in zip(dirty, sizes):
+                self._set(server_id, path, size)
+            self.measured += len(dirty)
+
+        if self._totals != self._published:
+            await run_io(self._publish, dict(self._totals))
+            self._published = dict(self._totals)
+
+    async def _watch_root(self) -> None:
+        """Start watching on becoming the leader, or rescan everything when it is time to."""
+        os.makedirs(self.root, exist_ok=True)
+        if self._inotify is None:
+            try:
+                self._inotify = Inotify()
+                self._watches[self._inotify.add_watch(self.root, ROOT_MASK)] = ("", "")
+                asyncio.get_running_loop().add_reader(self._inotify.fd, self._on_events)
+            except (OSError, AttributeError) as e:
+                # AttributeError: a libc without inotify
+                logger.warning(f"Cannot watch {self.root}, disk usage is updated by rescans only: {e}")
+                self._stop_watching()
+        self._rescanned_at = time.monotonic()
+        names = await run_io(lambda: [name for name in os.listdir(self.root)
+                                          if os.path.isdir(os.path.join(self.root, name))])
+        self._rescans.update(names)
+        self._rescans.update(self._files)
+        for server_id in list(self._rescans):
+            await self._scan(server_id)
+        self._rescans.clear()
+
+    def _stop_watching(self) -> None:
+        if self._inotify is not None:
+            try:
+                asyncio.get_running_loop().remove_reader(self._inotify.fd)
+            except RuntimeError:
+                pass
+            self._inotify.close()
+            self._inotify = None
+        self._watches.clear()
+
+    def _scan_tree(self, server_id: str) -> Tuple[Optional[Dict[str, int]], List[Tuple[int, str]]]:
+        """Sizes of every file of a server and the watches on its directories. Blocking."""
+        base = os.path.join(self.root, server_id)
+        if not os.path.isdir(base):
+            return None, []
+        files: Dict[str, int] = {}
+        watches: List[Tuple[int, str]] = []
+        for directory, _, names in os.walk(base):
+            relative = os.path.relpath(directory, base)
+            relative = "" if relative == "." else relative
+            # Watched before it is listed, nothing created in between is missed
+            if self._inotify is not None:
+                try:
+                    watches.append((self._inotify.add_watch(directory, DIRECTORY_MASK), relative))
+                except OSError as e:
+                    logger.warning(f"Cannot watch {directory}, raise fs.inotify.max_user_watches: {e}")
+            for name in names:
+                size = _measure(os.path.join(directory, name))
+                if size is not None:
+                    files[os.path.join(relative, name)] = size
+        return files, watches
+
+    async def _scan(self, server_id: str) -> None:
+        files, watches = await run_io(self._scan_tree, server_id)
+        self.scans += 1
+        current = {wd for wd, _ in watches}
+        for wd, (watched, _) in list(self._watches.items()):
+            if watched == server_id and wd not in current:
+                del self._watches[wd]
+                if self._inotify is not None:
+                    self._inotify.remove_watch(wd)
+        if files is None:
+            self._files.pop(server_id, None)
+            self._totals.pop(server_id, None)
+            self._dirty = {entry for entry in self._dirty if entry[0] != server_id}
+            return
+        for wd, directory in watches:
+            self._watches[wd] = (server_id, directory)
+        self._files[server_id] = files
+        self._totals[server_id] = sum(files.values())
+
+    def _set(self, server_id: str, path: str, size: Optional[int]) -> None:
+        files = self._files.get(server_id)
+        if files is None:
+            return  # a scan of the server is due and will count it
+        previous = files.pop(path, 0) if size is None else files.get(path, 0)
+        if size is not None:
+            files[path] = size
+        self._totals[server_id] += (size or 0) - previous
+
+    def _on_events(self) -> None:
+        if self._inotify is None:
+            return
+        for wd, mask, name in self._inotify.read():
+            self.events += 1
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, only a rescan can tell what changed
+                self.overflows += 1
+                self._rescanned_at = 0
+                continue
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            watched = self._watches.get(wd)
+            if watched is None:
+                continue
+            server_id, directory = watched
+            if not server_id:
+                if mask & IN_ISDIR:
+                    self._rescans.add(name)
+            elif mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO):
+                    self._rescans.add(server_id)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self._set(server_id, os.path.join(directory, name), None)
+                self._dirty.discard((server_id, os.path.join(directory, name)))
+            elif name:
+                self._dirty.add((server_id, os.path.join(directory, name)))
+
+    def _publish(self, totals: Dict[str, int]) -> None:
+        with self._state.locked() as state:
+            state["servers"] = totals
+            state["updated_at"] = time.time()
+        for server_id, used in totals.items():
+            quota = self.quota(server_id)
+            if quota is None or used < quota * DISK_QUOTA_WARN_RATIO:
+                self._warned.discard(server_id)
+            elif server_id not in self._warned:
+                self._warned.add(server_id)
+                logger.warning(f"Server {server_id} uses {used} of its {quota} bytes of disk quota")
+
+
+disk_usage = DiskUsage()
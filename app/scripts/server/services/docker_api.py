@@ -0,0 +1,319 @@
+import json
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from scripts.server.config import (
+    DOCKER_API_VERSION,
+    DOCKER_MAX_CONNECTIONS,
+    DOCKER_SOCKET,
+    DOCKER_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class DockerAPIError(Exception):
+    """Raised when the Docker Engine API answers with an error status."""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"Docker API error {status_code}: {message}")
+        self.status_code = status_code
+        self.message = message
+
+
+class DockerNotFound(DockerAPIError):
+    """Raised when the requested container or image does not exist."""
+
+
+def _raise_for_status(response: httpx.Response) -> None:
+    if response.status_code < 400:
+        return
+    try:
+        message = response.json().get("message", response.text)
+    except ValueError:
+        message = response.text
+    if response.status_code == 404:
+        raise DockerNotFound(response.status_code, message)
+    raise DockerAPIError(response.status_code, message)
+
+
+def _create_body(image: str, env_vars: Dict[str, Any], volume_path: str,
+                 ports: List[Tuple[int, int]], labels: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Build the /containers/create payload equivalent to `docker run -dit`."""
+    exposed = {f"{container_port}/tcp": {} for _, container_port in ports}
+    bindings = {
+        f"{container_port}/tcp": [{"HostPort": str(host_port) if host_port else ""}]
+        for host_port, container_port in ports
+    }
+    return {
+        "Image": image,
+        "Env": [f"{key}={value}" for key, value in env_vars.items()],
+        "Tty": True,
+        "OpenStdin": True,
+        "Labels": labels or {},
+        "ExposedPorts": exposed,
+        "HostConfig": {
+            "PortBindings": bindings,
+            "Binds": [f"{volume_path}:/data"],
+        },
+    }
+
+
+def _connection(endpoint: str) -> Tuple[Dict[str, Any], str]:
+    """Transport options and base URL for a daemon endpoint: a socket path, unix://, tcp:// or http(s)://."""
+    if endpoint.startswith("tcp://"):
+        return {}, "http://" + endpoint[len("tcp://"):]
+    if endpoint.startswith(("http://", "https://")):
+        return {}, endpoint
+    if endpoint.startswith("unix://"):
+        endpoint = endpoint[len("unix://"):]
+    return {"uds": endpoint}, "http://docker"
+
+
+def _split_image(image: str) -> Tuple[str, str]:
+    name, _, tag = image.rpartition(":")
+    if not name or "/" in tag:
+        return image, "latest"
+    return name, tag
+
+
+class PullProgress:
+    """Aggregate the per-layer progress messages of an image pull into one percentage."""
+
+    def __init__(self, on_progress: Optional[Callable[[float], None]]):
+        self._on_progress = on_progress
+        self._layers: Dict[str, Tuple[int, int]] = {}
+        self._reported = -1
+
+    def feed(self, line: str) -> None:
+        if not line.strip():
+            return
+        message = json.loads(line)
+        if "error" in message:
+            raise DockerAPIError(500, message["error"])
+        if self._on_progress is None:
+            return
+
+        detail = message.get("progressDetail") or {}
+        if message.get("status") == "Downloading" and detail.get("total"):
+            self._layers[message["id"]] = (detail.get("current", 0), detail["total"])
+        elif message.get("status") in ("Download complete", "Already exists", "Pull complete") and "id" in message:
+            _, total = self._layers.get(message["id"], (1, 1))
+            self._layers[message["id"]] = (total, total)
+
+        if self._layers:
+            percent = int(100 * sum(c for c, _ in self._layers.values()) / sum(t for _, t in self._layers.values()))
+            if percent != self._reported:
+                self._reported = percent
+                self._on_progress(percent)
+
+
+def demux_logs(raw: bytes) -> bytes:
+    """Strip the 8 byte stream headers Docker adds to logs of non-TTY containers."""
+    if len(raw) < 8 or raw[0] not in (0, 1, 2) or raw[1:4] != b"\x00\x00\x00":
+        return raw
+
+    out = bytearray()
+    offset = 0
+    while offset + 8 <= len(raw):
+        size = int.from_bytes(raw[offset + 4:offset + 8], "big")
+        out += raw[offset + 8:offset + 8 + size]
+        offset += 8 + size
+    return bytes(out)
+
+
+class DockerAPIClient:
+    """Synchronous Docker Engine API client (unix socket or TCP) with pooled keep-alive connections."""
+
+    def __init__(self, endpoint: str = DOCKER_SOCKET, api_version: str = DOCKER_API_VERSION,
+                 timeout: float = DOCKER_TIMEOUT, max_connections: int = DOCKER_MAX_CONNECTIONS):
+        options, base_url = _connection(endpoint)
+        transport = httpx.HTTPTransport(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            **options,
+        )
+        self._client = httpx.Client(transport=transport, base_url=base_url, timeout=timeout)
+        self._prefix = f"/{api_version}" if api_version else ""
+
+    def _request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        response = self._client.request(method, self._prefix + path, **kwargs)
+        _raise_for_status(response)
+        return response
+
+    def close(self) -> None:
+        self._client.close()
+
+    def ping(self) -> bool:
+        return self._request("GET", "/_ping").text == "OK"
+
+    def info(self) -> Dict[str, Any]:
+        return self._request("GET", "/info").json()
+
+    def inspect_container(self, container_id: str) -> Dict[str, Any]:
+        return self._request("GET", f"/containers/{container_id}/json").json()
+
+    def container_exists(self, container_id: str) -> bool:
+        try:
+            self.inspect_container(container_id)
+            return True
+        except DockerNotFound:
+            return False
+
+    def list_containers(self, all: bool = True, filters: Optional[Dict[str, List[str]]] = None) -> List[Dict[str, Any]]:
+        params = {"all": "1" if all else "0"}
+        if filters:
+            params["filters"] = json.dumps(filters)
+        return self._request("GET", "/containers/json", params=params).json()
+
+    def image_exists(self, image: str) -> bool:
+        try:
+            self._request("GET", f"/images/{image}/json")
+            return True
+        except DockerNotFound:
+            return False
+
+    def pull_image(self, image: str, on_progress: Optional[Callable[[float], None]] = None) -> None:
+        name, tag = _split_image(image)
+        progress = PullProgress(on_progress)
+        with self._client.stream("POST", self._prefix + "/images/create",
+                                 params={"fromImage": name, "tag": tag}, timeout=None) as response:
+            if response.status_code >= 400:
+                response.read()
+                _raise_for_status(response)
+            for line in response.iter_lines():
+                progress.feed(line)
+
+    def create_container(self, name: str, image: str, env_vars: Dict[str, Any], volume_path: str,
+                         ports: List[Tuple[int, int]], labels: Optional[Dict[str, str]] = None) -> str:
+        body = _create_body(image, env_vars, volume_path, ports, labels)
+        try:
+            response = self._request("POST", "/containers/create", params={"name": name}, json=body)
+        except DockerNotFound:
+            # `docker run` pulls missing images implicitly, do the same here
+            self.pull_image(image)
+            response = self._request("POST", "/containers/create", params={"name": name}, json=body)
+        return response.json()["Id"]
+
+    def start_container(self, container_id: str) -> None:
+        self._request("POST", f"/containers/{container_id}/start")
+
+    def stop_container(self, container_id: str, timeout: int = 10) -> None:
+        self._request("POST", f"/containers/{container_id}/stop", params={"t": timeout},
+                      timeout=DOCKER_TIMEOUT + timeout)
+
+    def remove_container(self, container_id: str, force: bool = False) -> None:
+        self._request("DELETE", f"/containers/{container_id}", params={"force": "1" if force else "0"})
+
+    def logs(self, container_id: str, tail: int = 100) -> str:
+        response = self._request("GET", f"/containers/{container_id}/logs",
+                                 params={"stdout": "1", "stderr": "1", "tail": str(tail)})
+        return demux_logs(response.content).decode("utf-8", errors="replace")
+
+
+class AsyncDockerAPIClient:
+    """Asyncio flavour of DockerAPIClient, also used for the long-lived event and log streams."""
+
+    def __init__(self, endpoint: str = DOCKER_SOCKET, api_version: str = DOCKER_API_VERSION,
+                 timeout: float = DOCKER_TIMEOUT, max_connections: int = DOCKER_MAX_CONNECTIONS):
+        options, base_url = _connection(endpoint)
+        transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            **options,
+        )
+        self._client = httpx.AsyncClient(transport=transport, base_url=base_url, timeout=timeout)
+        self._prefix = f"/{api_version}" if api_version else ""
+
+    async def _request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        response = await self._client.request(method, self._prefix + path, **kwargs)
+        _raise_for_status(response)
+        return response
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+    async def ping(self) -> bool:
+        return (await self._request("GET", "/_ping")).text == "OK"
+
+    async def info(self) -> Dict[str, Any]:
+        return (await self._request("GET", "/info")).json()
+
+    async def inspect_container(self, container_id: str) -> Dict[str, Any]:
+        return (await self._request("GET", f"/containers/{container_id}/json")).json()
+
+    async def container_exists(self, container_id: str) -> bool:
+        try:
+            await self.inspect_container(container_id)
+            return True
+        except DockerNotFound:
+            return False
+
+    async def list_containers(self, all: bool = True,
+                              filters: Optional[Dict[str, List[str]]] = None) -> List[Dict[str, Any]]:
+        params = {"all": "1" if all else "0"}
+        if filters:
+            params["filters"] = json.dumps(filters)
+        return (await self._request("GET", "/containers/json", params=params)).json()
+
+    async def image_exists(self, image: str) -> bool:
+        try:
+            await self._request("GET", f"/images/{image}/json")
+            return True
+        except DockerNotFound:
+            return False
+
+    async def pull_image(self, image: str, on_progress: Optional[Callable[[float], None]] = None) -> None:
+        name, tag = _split_image(image)
+        progress = PullProgress(on_progress)
+        async with self._client.stream("POST", self._prefix + "/images/create",
+                                       params={"fromImage": name, "tag": tag}, timeout=None) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                _raise_for_status(response)
+            async for line in response.aiter_lines():
+                progress.feed(line)
+
+    async def create_container(self, name: str, image: str, env_vars: Dict[str, Any], volume_path: str,
+                               ports: List[Tuple[int, int]], labels: Optional[Dict[str, str]] = None) -> str:
+        body = _create_body(image, env_vars, volume_path, ports, labels)
+        try:
+            response = await self._request("POST", "/containers/create", params={"name": name}, json=body)
+        except DockerNotFound:
+            await self.pull_image(image)
+            response = await self._request("POST", "/containers/create", params={"name": name}, json=body)
+        return response.json()["Id"]
+
+    async def start_container(self, container_id: str) -> None:
+        await self._request("POST", f"/containers/{container_id}/start")
+
+    async def stop_container(self, container_id: str, timeout: int = 10) -> None:
+        await self._request("POST", f"/containers/{container_id}/stop", params={"t": timeout},
+                            timeout=DOCKER_TIMEOUT + timeout)
+
+    async def remove_container(self, container_id: str, force: bool = False) -> None:
+        await self._request("DELETE", f"/containers/{container_id}", params={"force": "1" if force else "0"})
+
+    async def logs(self, container_id: str, tail: int = 100) -> str:
+        response = await self._request("GET", f"/containers/{container_id}/logs",
+                                       params={"stdout": "1", "stderr": "1", "tail": str(tail)})
+        return demux_logs(response.content).decode("utf-8", errors="replace")
+
+    async def stream(self, path: str, params: Optional[Dict[str, Any]] = None) -> AsyncIterator[bytes]:
+        """Yield raw chunks of a long-lived streaming endpoint until the daemon closes it."""
+        async with self._client.stream("GET", self._prefix + path, params=params, timeout=None) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                _raise_for_status(response)
+            async for chunk in response.aiter_raw():
+                yield chunk
+
+    async def stream_json(self, path: str, params: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Yield one decoded object per line of a streaming JSON endpoint (events, stats)."""
+        async with self._client.stream("GET", self._prefix + path, params=params, timeout=None) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                _raise_for_status(response)
+            async for line in response.aiter_lines():
+                if line.strip():
+                    yield json.loads(line)
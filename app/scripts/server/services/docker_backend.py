@@ -0,0 +1,266 @@
+import functools
+import logging
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from scripts.server.config import DOCKER_BACKEND, MINECRAFT_PORT
+from scripts.server.models.server import ContainerState
+from scripts.server.services.docker_api import DockerAPIClient, DockerNotFound
+from scripts.server.services.docker_hosts import DockerHost, docker_hosts
+from scripts.utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+OPERATIONS = ("exists", "inspect", "list", "image_exists", "pull", "create", "start", "run", "stop", "remove", "logs")
+
+docker_operation_seconds = registry.histogram(
+    "docker_operation_seconds", "Duration of Docker backend operations", ["backend", "operation"])
+docker_operation_errors = registry.counter(
+    "docker_operation_errors_total", "Docker backend operations that raised", ["backend", "operation"])
+
+
+def _instrumented(cls):
+    """Time every backend operation of `cls` into the Docker metrics."""
+    def wrap(operation: str, method: Callable) -> Callable:
+        @functools.wraps(method)
+        def timed(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            except Exception:
+                docker_operation_errors.inc(backend=cls.name, operation=operation)
+                raise
+            finally:
+                docker_operation_seconds.observe(time.perf_counter() - start, backend=cls.name, operation=operation)
+        return timed
+
+    for operation in OPERATIONS:
+        setattr(cls, operation, wrap(operation, getattr(cls, operation)))
+    return cls
+
+
+def _host_port(ports: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Extract the host port bound to the Minecraft port from a Docker port mapping."""
+    bindings = (ports or {}).get(f"{MINECRAFT_PORT}/tcp")
+    if bindings:
+        return bindings[0]["HostPort"]
+    return None
+
+
+def _health_from_summary(status_text: str) -> Optional[str]:
+    """Recover the health status from the human readable `Status` of a container listing."""
+    if "(healthy)" in status_text:
+        return "healthy"
+    if "(health: starting)" in status_text:
+        return "starting"
+    if "(unhealthy)" in status_text:
+        return "unhealthy"
+    return None
+
+
+def state_from_inspect(container: Dict[str, Any]) -> ContainerState:
+    """Build a ContainerState from an Engine API `/containers/{id}/json` document."""
+    state = container["State"]
+    return ContainerState(
+        id=container["Name"].lstrip("/"),
+        status=state["Status"],
+        health=(state.get("Health") or {}).get("Status"),
+        port=_host_port(container["NetworkSettings"].get("Ports")),
+    )
+
+
+def state_from_summary(summary: Dict[str, Any]) -> ContainerState:
+    """Build a ContainerState from one entry of an Engine API `/containers/json` listing."""
+    port = next((str(p["PublicPort"]) for p in summary.get("Ports") or []
+                 if p.get("PrivatePort") == MINECRAFT_PORT and p.get("Type") == "tcp" and p.get("PublicPort")),
+                None)
+    return ContainerState(
+        id=(summary.get("Names") or ["/"])[0].lstrip("/"),
+        status=summary["State"],
+        health=_health_from_summary(summary.get("Status", "")),
+        port=port,
+    )
+
+
+def name_filters(container_ids: Iterable[str]) -> Dict[str, List[str]]:
+    # The name filter is a regex match, anchor it so "abc" does not also match "abcd"
+    return {"name": [f"^/{container_id}$" for container_id in container_ids]}
+
+
+@_instrumented
+class CliBackend:
+    """Docker backend that shells out to the docker CLI through python-on-whales."""
+
+    name = "cli"
+
+    def __init__(self, endpoint: str):
+        # Imported here, the CLI wrapper is slow to import and only needed when this backend is selected
+        from python_on_whales import DockerClient
+        from python_on_whales.exceptions import NoSuchContainer
+
+        if "://" not in endpoint:
+            endpoint = f"unix://{endpoint}"
+        self.docker = DockerClient(host=endpoint)
+        self._no_such_container = NoSuchContainer
+
+    def exists(self, container_id: str) -> bool:
+        return self.docker.container.exists(container_id)
+
+    def inspect(self, container_id: str) -> Optional[ContainerState]:
+        try:
+            container = self.docker.container.inspect(container_id)
+        except self._no_such_container:
+            return None
+        return self._to_state(container)
+
+    def list(self, container_ids: Iterable[str]) -> Dict[str, ContainerState]:
+        wanted = set(container_ids)
+        if not wanted:
+            return {}
+
+        # One `docker ps` plus one multi-argument `docker inspect`, whatever the number of containers
+        ids = [container.id for container in self.docker.container.list(all=True, filters=name_filters(wanted))]
+        if not ids:
+            return {}
+        states = (self._to_state(container) for container in self.docker.container.inspect(ids))
+        return {state.id: state for state in states if state.id in wanted}
+
+    @staticmethod
+    def _to_state(container) -> ContainerState:
+        return ContainerState(
+            id=container.name,
+            status=container.state.status,
+            health=container.state.health.status if container.state.health else None,
+            port=_host_port(container.network_settings.ports),
+        )
+
+    def image_exists(self, image: str) -> bool:
+        return self.docker.image.exists(image)
+
+    def pull(self, image: str, on_progress: Optional[Callable[[float], None]] = None) -> None:
+        self.docker.image.pull(image, quiet=True)
+
+    def create(self, container_id: str, image: str, env_vars: Dict[str, Any], volume_path: str,
+               ports: List[Tuple[int, int]]) -> None:
+        self.docker.container.create(
+            image,
+            interactive=True,
+            tty=True,
+            publish=ports,
+            envs=env_vars,
+            name=container_id,
+            volumes=[(volume_path, "/data")]
+        )
+
+    def start(self, container_id: str) -> None:
+        self.docker.container.start(container_id)
+
+    def run(self, container_id: str, image: str, env_vars: Dict[str, Any], volume_path: str,
+            ports: List[Tuple[int, int]]) -> None:
+        self.docker.run(
+            image,
+            detach=True,
+            interactive=True,
+            tty=True,
+            publish=ports,
+            envs=env_vars,
+            name=container_id,
+            volumes=[(volume_path, "/data")]
+        )
+
+    def stop(self, container_id: str) -> None:
+        self.docker.stop(container_id)
+
+    def remove(self, container_id: str) -> None:
+        self.docker.remove(container_id)
+
+    def logs(self, container_id: str, tail: int = 100) -> str:
+        return self.docker.container.logs(container_id, tail=tail)
+
+
+@_instrumented
+class ApiBackend:
+    """Docker backend that talks HTTP to the Engine API, over the unix socket or TCP."""
+
+    name = "api"
+
+    def __init__(self, endpoint: str):
+        self.client = DockerAPIClient(endpoint)
+
+    def exists(self, container_id: str) -> bool:
+        return self.client.container_exists(container_id)
+
+    def inspect(self, container_id: str) -> Optional[ContainerState]:
+        try:
+            return state_from_inspect(self.client.inspect_container(container_id))
+        except DockerNotFound:
+            return None
+
+    def list(self, container_ids: Iterable[str]) -> Dict[str, ContainerState]:
+        wanted = set(container_ids)
+        if not wanted:
+            return {}
+
+        states = (state_from_summary(summary)
+                  for summary in self.client.list_containers(all=True, filters=name_filters(wanted)))
+        return {state.id: state for state in states if state.id in wanted}
+
+    def image_exists(self, image: str) -> bool:
+        return self.client.image_exists(image)
+
+    def pull(self, image: str, on_progress: Optional[Callable[[float], None]] = None) -> None:
+        self.client.pull_image(image, on_progress)
+
+    def create(self, container_id: str, image: str, env_vars: Dict[str, Any], volume_path: str,
+               ports: List[Tuple[int, int]]) -> None:
+        self.client.create_container(container_id, image, env_vars, volume_path, ports)
+
+    def start(self, container_id: str) -> None:
+        self.client.start_container(container_id)
+
+    def run(self, container_id: str, image: str, env_vars: Dict[str, Any], volume_path: str,
+            ports: List[Tuple[int, int]]) -> None:
+        self.create(container_id, image, env_vars, volume_path, ports)
+        self.start(container_id)
+
+    def stop(self, container_id: str) -> None:
+        self.client.stop_container(container_id)
+
+    def remove(self, container_id: str) -> None:
+        self.client.remove_container(container_id)
+
+    def logs(self, container_id: str, tail: int = 100) -> str:
+        return self.client.logs(container_id, tail=tail)
+
+
+_BACKENDS = {
+    CliBackend.name: CliBackend,
+    ApiBackend.name: ApiBackend,
+}
+_backend_name = DOCKER_BACKEND
+_backends: Dict[str, Any] = {}
+
+
+def get_backend(host: Optional[DockerHost] = None):
+    """Return the Docker backend selected by DOCKER_BACKEND for a host, by default the first one of the pool."""
+    host = host or docker_hosts.default
+    backend = _backends.get(host.name)
+    if backend is None:
+        backend = _backends[host.name] = _BACKENDS[_backend_name](host.endpoint)
+    return backend
+
+
+def backend_for(server_id: str):
+    """The backend of the host a server lives on."""
+    return get_backend(docker_hosts.host_for(server_id))
+
+
+def set_backend(name: str):
+    """Switch the process-wide Docker backend, e.g. to compare "cli" and "api" on the same host."""
+    global _backend_name
+    if name not in _BACKENDS:
+        raise ValueError(f"Unknown docker backend: {name}")
+    _backend_name = name
+    _backends.clear()
+    logger.info(f"Using docker backend: {name}")
+    return get_backend()
@@ -0,0 +1,131 @@
+import asyncio
+import json
+import logging
+from typing import Dict, List, Optional
+
+from scripts.server.config import (
+    DOCKER_HOSTS,
+    DOCKER_SOCKET,
+    HOST_PWD,
+    PING_HOST,
+    PLACEMENT_CACHE_TTL,
+    PLACEMENT_STATE_TEMPLATE,
+    SERVER_HOST_IP,
+)
+from scripts.server.services.executors import run_io
+from scripts.utils.json_state import JSONStateFile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "local"
+
+
+class DockerHost:
+    """One Docker daemon servers can run on, with the address players connect to."""
+
+    def __init__(self, name: str, endpoint: str, public_ip: str, ping_host: Optional[str] = None,
+                 memory: Optional[str] = None):
+        self.name = name
+        self.endpoint = endpoint
+        self.public_ip = public_ip
+        self.ping_host = ping_host or public_ip
+        self.memory = memory
+
+    @property
+    def local(self) -> bool:
+        """Whether the daemon runs on this machine, so data directories and listeners here are its own."""
+        return not self.endpoint.startswith(("tcp://", "http://", "https://"))
+
+    def address(self, port: str) -> str:
+        return f"{self.public_ip}:{port}"
+
+
+def parse_hosts(spec: str) -> List[DockerHost]:
+    """Hosts from a DOCKER_HOSTS JSON list, or the single local daemon when empty."""
+    if not spec.strip():
+        return [DockerHost(DEFAULT_HOST, DOCKER_SOCKET, SERVER_HOST_IP, PING_HOST)]
+    hosts = [DockerHost(entry["name"], entry["endpoint"], entry["public_ip"], entry.get("ping_host"),
+                        entry.get("memory")) for entry in json.loads(spec)]
+    if not hosts or len({host.name for host in hosts}) != len(hosts):
+        raise ValueError("DOCKER_HOSTS needs at least one host and unique names")
+    return hosts
+
+
+class HostRegistry:
+    """
+    The Docker hosts of the pool and which one each server lives on.
+
+    A server stays on the host it was first placed on, its world is on that host's disk. The
+    placements are kept in a JSON file shared by all workers. Servers without a placement, from
+    before there was a pool, live on the first host.
+
+    Lookups happen on the event loop for every status request, so they use the copy of the file a
+    background task re-reads every half PLACEMENT_CACHE_TTL and only read the file themselves when
+    that copy is older (on a thread, or before start()).
+    """
+
+    def __init__(self, hosts: List[DockerHost], path: str = PLACEMENT_STATE_TEMPLATE.format(base_dir=HOST_PWD)):
+        self.hosts: Dict[str, DockerHost] = {host.name: host for host in hosts}
+        self.default = hosts[0]
+        self._file = JSONStateFile(path, keys=("servers",))
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if len(self.hosts) == 1 or self._task is not None:
+            return
+        await run_io(self._file.read)
+        self._task = asyncio.create_task(self._refresh())
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _refresh(self) -> None:
+        while True:
+            await asyncio.sleep(PLACEMENT_CACHE_TTL / 2)
+            try:
+                await run_io(self._file.read)
+            except Exception as e:
+                logger.error(f"Error reading server placements: {e}")
+
+    def get(self, name: str) -> DockerHost:
+        # A host removed from the configuration falls back to the default one
+        return self.hosts.get(name, self.default)
+
+    def locate(self, server_id: str) -> Optional[DockerHost]:
+        """The host a server was placed on, None if it never was."""
+        if len(self.hosts) == 1:
+            return self.default
+        state = self._file.recent(PLACEMENT_CACHE_TTL)
+        if state is None:
+            state = self._file.read()
+        name = state["servers"].get(server_id)
+        return self.get(name) if name is not None else None
+
+    def host_for(self, server_id: str) -> DockerHost:
+        return self.locate(server_id) or self.default
+
+    def place(self, server_id: str, host: DockerHost) -> None:
+        if len(self.hosts) == 1:
+            return
+        logger.info(f"Placing server {server_id} on host {host.name}")
+        with self._file.locked() as state:
+            state["servers"][server_id] = host.name
+        # Loaded again here, off the loop, rather than by the next lookup
+        self._file.read()
+
+    def forget(self, server_id: str) -> None:
+        if len(self.hosts) == 1:
+            return
+        with self._file.locked() as state:
+            state["servers"].pop(server_id, None)
+        self._file.read()
+
+
+docker_hosts = HostRegistry(parse_hosts(DOCKER_HOSTS))
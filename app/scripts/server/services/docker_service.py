@@ -1,99 +1,146 @@
-from python_on_whales import docker
+import asyncio
 import logging
-from typing import Tuple, Optional, Dict, Any
-from scripts.server.models.server import ServerStatus
-from scripts.server.config import MINECRAFT_PORT, MINECRAFT_IMAGE
+import shutil
+from typing import Tuple, Optional, Dict, Any, Iterable, List, Callable
+from scripts.server.models.server import ServerStatus, ContainerState
+from scripts.server.config import MINECRAFT_PORT, MINECRAFT_IMAGE, DOCKER_SOCKET, DOCKER_FIX_PERMISSIONS
+from scripts.server.services.docker_api import AsyncDockerAPIClient
+from scripts.server.services.docker_backend import backend_for, get_backend
+from scripts.server.services.docker_hosts import DockerHost, docker_hosts
+from scripts.server.services.container_cache import container_cache
+from scripts.server.services.executors import run_docker
+from scripts.server.services.port_allocator import port_allocator, is_port_conflict
+from scripts.server.services.admission import admission
 
 logger = logging.getLogger(__name__)
 
+PORT_CONFLICT_RETRIES = 3
+
 class DockerService:
     """Service for interacting with Docker containers running the Minecraft server. Consumed by ServerService."""
 
     @staticmethod
-    def container_exists(container_id: str) -> bool:
-        """Check if a container exists."""
+    async def ping_async(timeout: float = 2, host: Optional[DockerHost] = None) -> None:
+        """Check that a Docker daemon (the first host by default) answers, raising otherwise."""
+        host = host or docker_hosts.default
+        client = AsyncDockerAPIClient(host.endpoint, timeout=timeout, max_connections=1)
         try:
-            return docker.container.exists(container_id)
-        except Exception as e:
-            logger.error(f"Error checking container existence: {e}")
-            return False
+            if not await client.ping():
+                raise Exception("Unexpected answer to Docker ping")
+        finally:
+            await client.close()
 
     @staticmethod
-    def get_container_status(container_id: str) -> Tuple[ServerStatus, str]:
-        """Get the status of a container."""
+    async def ensure_access_async() -> bool:
+        """Check the Docker socket is usable, trying to fix its permissions with sudo if it is not."""
         try:
-            if not DockerService.container_exists(container_id):
-                return ServerStatus.STOPPED, ""
-
-            container = docker.container.inspect(container_id)
-
-            if container.state.status == "exited":
-                return ServerStatus.STOPPED, ""
-
-            if container.state.status == "running" and container.state.health:
-                health_status = container.state.health.status
-                if health_status == "starting":
-                    return ServerStatus.STARTING, ""
-                if health_status == "healthy":
-                    return ServerStatus.RUNNING, ""
-
-            return ServerStatus.UNKNOWN, "Unknown container health status"
+            await DockerService.ping_async()
+            return True
+        except Exception as e:
+            logger.warning(f"Docker socket not usable: {e}")
 
+        if not DOCKER_FIX_PERMISSIONS or shutil.which("sudo") is None:
+            return False
+        # -n: fail instead of waiting for a password prompt nobody will answer
+        process = await asyncio.create_subprocess_exec(
+            "sudo", "-n", "chmod", "666", DOCKER_SOCKET,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+        await process.wait()
+        try:
+            await DockerService.ping_async()
+            return True
         except Exception as e:
-            logger.error(f"Error getting container status: {e}")
-            return ServerStatus.UNKNOWN, str(e)
+            logger.error(f"Docker socket still not usable after fixing permissions: {e}")
+            return False
 
     @staticmethod
-    def get_container_port(container_id: str) -> Optional[str]:
-        """Get the host port for a container."""
-        try:
-            if not DockerService.container_exists(container_id):
-                return None
+    def status_from_state(state: Optional[ContainerState]) -> Tuple[ServerStatus, str]:
+        """Map a container state to the server status shown to users."""
+        if state is None or state.status == "exited":
+            return ServerStatus.STOPPED, ""
 
-            container = docker.container.inspect(container_id)
-            if container.state.status != "running":
-                return None
+        if state.status == "running" and state.health:
+            if state.health == "starting":
+                return ServerStatus.STARTING, ""
+            if state.health == "healthy":
+                return ServerStatus.RUNNING, ""
 
-            ports = container.network_settings.ports
-            if ports and f"{MINECRAFT_PORT}/tcp" in ports:
-                return ports[f"{MINECRAFT_PORT}/tcp"][0]["HostPort"]
-            return None
+        return ServerStatus.UNKNOWN, "Unknown container health status"
 
-        except Exception as e:
-            logger.error(f"Error getting container port: {e}")
-            return None
+    @staticmethod
+    async def get_container_state_async(container_id: str) -> Optional[ContainerState]:
+        """Get the state of a container from the state cache, only leaving the event loop when the cache misses."""
+        hit, state = container_cache.lookup(container_id)
+        if not hit:
+            state = await run_docker(backend_for(container_id).inspect, container_id)
+            container_cache.store(container_id, state)
+        return state
 
     @staticmethod
-    def run_container(container_id: str, env_vars: Dict[str, Any], volume_path: str) -> Optional[str]:
-        """Run a new container with the given parameters."""
-        try:
-            if DockerService.container_exists(container_id):
-                docker.remove(container_id)
-
-            docker.run(
-                MINECRAFT_IMAGE,
-                detach=True,
-                interactive=True,
-                tty=True,
-                publish=[(0, MINECRAFT_PORT)],
-                envs=env_vars,
-                name=container_id,
-                volumes=[(volume_path, "/data")]
-            )
-
-            return DockerService.get_container_port(container_id)
+    async def get_container_states_async(container_ids: Iterable[str]) -> Dict[str, ContainerState]:
+        """Snapshot the state of many containers with a single listing. Missing containers are omitted."""
+        container_ids = list(container_ids)
+        states = container_cache.lookup_many(container_ids)
+        if states is None:
+            states = await run_docker(DockerService._fetch_states, container_ids)
+        return states
 
-        except Exception as e:
-            logger.error(f"Error running container: {e}")
-            return None
+    @staticmethod
+    def _fetch_states(container_ids: List[str]) -> Dict[str, ContainerState]:
+        # One listing per host the servers live on
+        by_host: Dict[str, List[str]] = {}
+        for container_id in container_ids:
+            by_host.setdefault(docker_hosts.host_for(container_id).name, []).append(container_id)
+        states = {}
+        for name, ids in by_host.items():
+            states.update(get_backend(docker_hosts.get(name)).list(ids))
+        for container_id in container_ids:
+            container_cache.store(container_id, states.get(container_id))
+        return states
+
+    @staticmethod
+    def launch_container(container_id: str, env_vars: Dict[str, Any], volume_path: str,
+                         on_created: Optional[Callable[[int], None]] = None) -> ContainerState:
+        """
+        Create and start a server container on its allocated host port, returning its state.
+
+        The port is known before Docker is called, so no inspect is needed afterwards. If the host
+        port turns out to be taken by something else it is blocked and the start retried on another.
+        """
+        backend = backend_for(container_id)
+        for attempt in range(PORT_CONFLICT_RETRIES + 1):
+            port = port_allocator.allocate(container_id)
+            try:
+                backend.create(container_id, MINECRAFT_IMAGE, env_vars, volume_path, [(port, MINECRAFT_PORT)])
+                if on_created is not None:
+                    on_created(port)
+                backend.start(container_id)
+            except Exception as e:
+                if not is_port_conflict(e) or attempt == PORT_CONFLICT_RETRIES:
+                    port_allocator.release(container_id)
+                    raise
+                port_allocator.block(container_id, port)
+                if backend.exists(container_id):
+                    backend.remove(container_id)
+                continue
+
+            # Health is "starting" until the image's healthcheck passes, the event stream updates it
+            state = ContainerState(id=container_id, status="running", health="starting", port=str(port))
+            container_cache.store_provisional(container_id, state)
+            return state
 
     @staticmethod
-    def stop_container(container_id: str) -> bool:
-        """Stop and remove a container."""
+    def stop_container(container_id: str, release_port: bool = True) -> bool:
+        """Stop and remove a container. Hibernation keeps the port leased for its wake-up listener."""
         try:
-            if DockerService.container_exists(container_id):
-                docker.stop(container_id)
-                docker.remove(container_id)
+            backend = backend_for(container_id)
+            if backend.exists(container_id):
+                backend.stop(container_id)
+                backend.remove(container_id)
+            container_cache.store(container_id, None)
+            admission.release(container_id)
+            if release_port:
+                port_allocator.release(container_id)
             return True
         except Exception as e:
             logger.error(f"Error stopping container: {e}")
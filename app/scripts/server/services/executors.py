@@ -0,0 +1,58 @@
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+from scripts.server.config import BACKUP_WORKERS, DOCKER_WORKERS, IO_WORKERS, SUPABASE_WORKERS, WORLD_TRANSFER_WORKERS
+
+T = TypeVar("T")
+
+# Separate pools so a burst of slow `docker run`s cannot starve database queries and vice versa
+docker_executor = ThreadPoolExecutor(max_workers=DOCKER_WORKERS, thread_name_prefix="docker")
+supabase_executor = ThreadPoolExecutor(max_workers=SUPABASE_WORKERS, thread_name_prefix="supabase")
+# Local filesystem work that can take seconds (walking world directories, waiting for a store lock)
+io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+# World downloads and uploads hold a thread for as long as the client takes
+transfer_executor = ThreadPoolExecutor(max_workers=WORLD_TRANSFER_WORKERS, thread_name_prefix="transfer")
+# Hashing and compressing backups is CPU bound. Processes are spawned on first use rather than
+# forked, a fork of a worker with running threads can deadlock.
+backup_executor = ProcessPoolExecutor(max_workers=BACKUP_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+
+async def run_docker(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking Docker call on the Docker pool without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(docker_executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_supabase(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking Supabase call on the Supabase pool without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(supabase_executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_io(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run blocking filesystem work on the I/O pool, away from Docker calls."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_transfer(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking step of a world transfer on the transfer pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(transfer_executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_backup(func: Callable[..., T], *args: Any) -> T:
+    """Run a CPU bound backup step in the backup process pool. Arguments must be picklable."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(backup_executor, functools.partial(func, *args))
+
+
+def shutdown_executors() -> None:
+    docker_executor.shutdown(wait=False)
+    supabase_executor.shutdown(wait=False)
+    io_executor.shutdown(wait=False)
+    transfer_executor.shutdown(wait=False)
+    backup_executor.shutdown(wait=False)
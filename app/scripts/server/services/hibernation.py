@@ -0,0 +1,302 @@
+import asyncio
+import json
+import logging
+import struct
+import time
+from typing import Any, Dict, Optional, Set, Tuple
+
+from scripts.server.config import (
+    HIBERNATE_CHECK_INTERVAL,
+    HIBERNATE_CLIENT_TIMEOUT,
+    HIBERNATE_ENABLED,
+    HIBERNATE_IDLE_SECONDS,
+    HIBERNATE_LISTEN_HOST,
+    HIBERNATE_MOTD,
+    HIBERNATE_SYNC_INTERVAL,
+    HOST_PWD,
+    PORT_RANGE_END,
+    PORT_RANGE_START,
+    SLEEP_STATE_TEMPLATE,
+)
+from scripts.server.models.server import ServerConfig, ServerPing, StartStage
+from scripts.server.services.container_cache import container_cache
+from scripts.server.services.docker_hosts import docker_hosts
+from scripts.server.services.executors import run_io
+from scripts.server.services.lifecycle import LifecycleError, lifecycle
+from scripts.server.services.minecraft_ping import (
+    PingError,
+    decode_varint,
+    encode_packet,
+    encode_string,
+    read_packet,
+    server_pinger,
+)
+from scripts.server.services.server_repository import server_repository
+from scripts.server.services.sleep_state import sleep_state
+from scripts.server.services.start_jobs import start_jobs
+from scripts.utils.leader_lock import LeaderLock
+from scripts.utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+NEXT_STATE_STATUS = 1
+NEXT_STATE_LOGIN = 2
+WAKE_MESSAGE = "The server is starting, join again in a minute"
+
+hibernations_total = registry.counter("hibernations_total", "Servers stopped for having no players")
+wakeups_total = registry.counter("hibernation_wakeups_total", "Hibernated servers started by a joining player", ["outcome"])
+
+
+def parse_handshake(payload: bytes) -> Tuple[int, str, int, int]:
+    """(protocol, address, port, next_state) of a handshake packet's payload."""
+    protocol, offset = decode_varint(payload, 0)
+    length, offset = decode_varint(payload, offset)
+    address = payload[offset:offset + length].decode("utf-8", "replace")
+    offset += length
+    if offset + 2 > len(payload):
+        raise PingError("Truncated handshake")
+    port = struct.unpack(">H", payload[offset:offset + 2])[0]
+    next_state, _ = decode_varint(payload, offset + 2)
+    if protocol & (1 << 31):
+        protocol -= 1 << 32
+    return protocol, address, port, next_state
+
+
+def _status_packet(entry: Dict[str, Any], protocol: int) -> bytes:
+    # Report the version the server last ran, so clients do not flag it as incompatible
+    status = {
+        "version": {"name": entry.get("version") or "Sleeping", "protocol": entry.get("protocol") or protocol},
+        "players": {"online": 0, "max": entry.get("max_players", 0), "sample": []},
+        "description": {"text": HIBERNATE_MOTD},
+    }
+    return encode_packet(0x00, encode_string(json.dumps(status)))
+
+
+class Hibernator:
+    """
+    Stops servers nobody played on for HIBERNATE_IDLE_SECONDS and starts them again when a player joins.
+
+    Player counts come from the status ping. While a server sleeps a small listener holds its port,
+    answers pings with HIBERNATE_MOTD and starts the server through the server lifecycle on
+    the first login. Only the worker holding the leader lock checks and listens, another one takes
+    over when it exits.
+    """
+
+    def __init__(self, lock_path: str = SLEEP_STATE_TEMPLATE.format(base_dir=HOST_PWD) + ".leader",
+                 idle_seconds: float = HIBERNATE_IDLE_SECONDS):
+        self._leader = LeaderLock(lock_path)
+        self._idle_seconds = idle_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._listeners: Dict[str, asyncio.AbstractServer] = {}
+        self._idle_since: Dict[str, float] = {}
+        self._waking: Set[str] = set()
+        self._wake_tasks: Set[asyncio.Task] = set()
+        self._last_check: Optional[float] = None
+
+    async def start(self) -> None:
+        if not HIBERNATE_ENABLED or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        for server_id in list(self._listeners):
+            await self._unlisten(server_id)
+        self._leader.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "leader": self._leader.held,
+            "listeners": len(self._listeners),
+            "idle": len(self._idle_since),
+        }
+
+    def _try_lead(self) -> bool:
+        if self._leader.held:
+            return True
+        if not self._leader.try_acquire():
+            return False
+        logger.info("This worker now runs server hibernation")
+        return True
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                if await run_io(self._try_lead):
+                    await self._sync_listeners()
+                    if self._last_check is None or loop.time() - self._last_check >= HIBERNATE_CHECK_INTERVAL:
+                        self._last_check = loop.time()
+                        await self._check_idle()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in hibernation loop: {e}")
+            await asyncio.sleep(HIBERNATE_SYNC_INTERVAL)
+
+    async def _check_idle(self) -> None:
+        if not container_cache.live:
+            return
+        # The wake-up listener binds on this machine, so only servers of local hosts can sleep
+        addresses = {}
+        for state in container_cache.running():
+            host = docker_hosts.get(state.host) if state.host else docker_hosts.default
+            if host.local and PORT_RANGE_START <= int(state.port) <= PORT_RANGE_END:
+                addresses[state.id] = (host.ping_host, int(state.port))
+        for server_id in list(self._idle_since):
+            if server_id not in addresses:
+                del self._idle_since[server_id]
+
+        now = time.time()
+        pings = await server_pinger.ping_many(addresses)
+        for server_id, ping in pings.items():
+            # Servers that do not answer (still booting, crashed) are never counted as idle
+            if ping is None or ping.online_players > 0:
+                self._idle_since.pop(server_id, None)
+                continue
+            since = self._idle_since.setdefault(server_id, now)
+            if now - since >= self._idle_seconds:
+                await self._hibernate(server_id, addresses[server_id][1], ping)
+
+    async def _hibernate(self, server_id: str, port: int, ping: ServerPing) -> None:
+        # Already being started or stopped
+        if lifecycle.state(server_id) is not None:
+            return
+        server = await server_repository.get(server_id)
+        if server is None:
+            self._idle_since.pop(server_id, None)
+            return
+        config = ServerConfig(
+            id=server["id"],
+            name=server["name"],
+            type=server["type"],
+            version=server["version"]
+        )
+
+        entry = {
+            "port": port,
+            "since": time.time(),
+            "config": config.dict(),
+            "version": ping.version,
+            "protocol": ping.protocol,
+            "max_players": ping.max_players,
+        }
+        logger.info(f"Hibernating server {server_id}, no players for {self._idle_seconds:.0f}s")
+        try:
+            # Queued like any stop, a start asked for meanwhile runs after it and wakes the server again
+            operation = await lifecycle.stop(server_id, sleep_entry=entry)
+        except LifecycleError:
+            return
+        if not await asyncio.shield(operation.task):
+            return
+        self._idle_since.pop(server_id, None)
+        hibernations_total.inc()
+        await self._listen(server_id, entry)
+
+    async def _sync_listeners(self) -> None:
+        """Listen for every hibernated server, stop listening for those woken or stopped by another worker."""
+        # Not the cached copy, a woken server's port must be given up as soon as possible
+        sleeping = await run_io(sleep_state.sleeping)
+        for server_id in list(self._listeners):
+            if server_id not in sleeping:
+                await self._unlisten(server_id)
+
+        running = set(container_cache.published_ports().values())
+        for server_id, entry in sleeping.items():
+            if server_id in running:
+                # Started while it was being put to sleep
+                await run_io(sleep_state.remove, server_id)
+            elif server_id not in self._listeners and server_id not in self._waking:
+                await self._listen(server_id, entry)
+
+    async def _listen(self, server_id: str, entry: Dict[str, Any]) -> None:
+        try:
+            self._listeners[server_id] = await asyncio.start_server(
+                lambda reader, writer: self._handle(server_id, reader, writer), HIBERNATE_LISTEN_HOST, entry["port"])
+        except OSError as e:
+            # Docker may not have let go of the port yet, the next sync tries again
+            logger.debug(f"Cannot listen on port {entry['port']} for {server_id}: {e}")
+
+    async def _unlisten(self, server_id: str) -> None:
+        server = self._listeners.pop(server_id, None)
+        if server is not None:
+            server.close()
+            await server.wait_closed()
+
+    async def _handle(self, server_id: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            login = await asyncio.wait_for(self._converse(server_id, reader, writer), HIBERNATE_CLIENT_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, OSError, PingError):
+            login = False
+        finally:
+            writer.close()
+
+        if login and server_id not in self._waking:
+            # Its own task, waking closes the listener this connection came in on
+            task = asyncio.create_task(self._wake(server_id))
+            self._wake_tasks.add(task)
+            task.add_done_callback(self._wake_tasks.discard)
+
+    async def _converse(self, server_id: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        """Answer one client connection. Returns whether it was a login."""
+        packet_id, payload = await read_packet(reader)
+        if packet_id != 0x00:
+            return False
+        protocol, _, _, next_state = parse_handshake(payload)
+
+        if next_state == NEXT_STATE_LOGIN:
+            writer.write(encode_packet(0x00, encode_string(json.dumps({"text": WAKE_MESSAGE}))))
+            await writer.drain()
+            return True
+        if next_state != NEXT_STATE_STATUS:
+            return False
+
+        packet_id, _ = await read_packet(reader)
+        if packet_id != 0x00:
+            return False
+        entry = (await sleep_state.sleeping_async()).get(server_id, {})
+        writer.write(_status_packet(entry, protocol))
+        await writer.drain()
+
+        packet_id, payload = await read_packet(reader)
+        if packet_id == 0x01:
+            writer.write(encode_packet(0x01, payload[:8]))
+            await writer.drain()
+        return False
+
+    async def _wake(self, server_id: str) -> None:
+        self._waking.add(server_id)
+        try:
+            entry = await run_io(sleep_state.remove, server_id)
+            await self._unlisten(server_id)
+            if entry is None:
+                return
+
+            logger.info(f"Waking server {server_id}, a player is joining")
+            try:
+                operation = await lifecycle.start(ServerConfig(**entry["config"]))
+            except LifecycleError:
+                # Started by a user in the meantime
+                return
+            await asyncio.shield(operation.task)
+            job = start_jobs.get(operation.job_id)
+            # A container that was created but is slow to become healthy is still woken up
+            if job is not None and job.stage == StartStage.FAILED and job.port is None:
+                logger.error(f"Error waking server {server_id}: {job.error}")
+                wakeups_total.inc(outcome="failed")
+                # Back to sleep, the next login tries again
+                await run_io(sleep_state.add, server_id, entry)
+                return
+            wakeups_total.inc(outcome="started")
+        finally:
+            self._waking.discard(server_id)
+
+
+hibernator = Hibernator()
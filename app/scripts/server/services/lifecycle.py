@@ -0,0 +1,208 @@
+import asyncio
+import contextlib
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+
+from scripts.server.config import HOST_PWD, LIFECYCLE_LOCK_POLL, LIFECYCLE_LOCK_TEMPLATE
+from scripts.server.models.server import ContainerState, LifecycleState, ServerConfig
+from scripts.server.services.docker_service import DockerService
+from scripts.server.services.executors import run_docker, run_io
+from scripts.server.services.server_service import ServerService
+from scripts.server.services.sleep_state import sleep_state
+from scripts.server.services.start_jobs import start_jobs
+from scripts.utils.leader_lock import LeaderLock
+
+logger = logging.getLogger(__name__)
+
+
+class LifecycleError(Exception):
+    """Raised for a start or stop the server's state does not allow."""
+
+
+class Operation:
+    """A start or stop queued for a server. Requests for the same thing while it is queued share it."""
+
+    def __init__(self, action: str, state: LifecycleState, job_id: Optional[str] = None):
+        self.action = action
+        self.state = state  # state of the server while it runs
+        self.job_id = job_id
+        self.task: Optional[asyncio.Task] = None
+
+
+def _hibernate(server_id: str, entry: Dict[str, Any]) -> bool:
+    """Stop a server keeping its port leased for the wake-up listener, and record it as sleeping."""
+    if not DockerService.stop_container(server_id, False):
+        return False
+    sleep_state.add(server_id, entry)
+    return True
+
+
+def observed_state(state: Optional[ContainerState]) -> LifecycleState:
+    """Lifecycle state of a server nothing is queued for, from its container."""
+    if state is None or state.status in ("exited", "dead"):
+        return LifecycleState.STOPPED
+    if state.status == "removing":
+        return LifecycleState.STOPPING
+    if state.status in ("created", "restarting") or state.health == "starting":
+        return LifecycleState.STARTING
+    return LifecycleState.RUNNING
+
+
+class ServerLifecycle:
+    """
+    Starts and stops every server in one ordered queue per server.
+
+    A start asked for while one is queued joins it, and so does a stop, instead of doing the container
+    work twice. A start behind a stop (or the other way round) waits for it. With nothing queued the
+    container decides: starting a running server or stopping one without a container is refused.
+    Operations also hold a per-server file lock while they run, so workers take turns on a server too.
+    Work on the files of a stopped server (uploads, restores) holds a place in the queue as well.
+    """
+
+    def __init__(self):
+        self._queues: Dict[str, List[Operation]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+        self.starts = 0
+        self.stops = 0
+        self.joined = 0
+        self.rejected = 0
+
+    async def close(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "servers": len(self._queues),
+            "starts": self.starts,
+            "stops": self.stops,
+            "joined": self.joined,
+            "rejected": self.rejected,
+        }
+
+    def state(self, server_id: str) -> Optional[LifecycleState]:
+        """State the server is in until its queued operations are done, None with nothing queued here."""
+        queue = self._queues.get(server_id)
+        return queue[-1].state if queue else None
+
+    async def start(self, config: ServerConfig, user_id: Optional[str] = None) -> Operation:
+        """Queue a start of the server, its progress is published as the start job `job_id`."""
+        queue = self._queues.get(config.id)
+        if not queue:
+            state = await DockerService.get_container_state_async(config.id)
+            # Another request may have queued something meanwhile
+            queue = self._queues.get(config.id)
+            if not queue and observed_state(state) == LifecycleState.RUNNING:
+                self.rejected += 1
+                raise LifecycleError("Server is already running")
+        if queue and queue[-1].action == "start":
+            self.joined += 1
+            return queue[-1]
+
+        self.starts += 1
+        job = start_jobs.create(config.id, user_id)
+        return self._enqueue(config.id, Operation("start", LifecycleState.STARTING, job.id),
+                             lambda: start_jobs.run(job, config, user_id))
+
+    async def stop(self, server_id: str, sleep_entry: Optional[Dict[str, Any]] = None) -> Operation:
+        """
+        Queue a stop of the server, which also takes it out of hibernation. Its task returns whether it worked.
+        With a `sleep_entry` the server is put into hibernation instead.
+        """
+        action = "stop" if sleep_entry is None else "hibernate"
+        queue = self._queues.get(server_id)
+        if not queue:
+            state = await DockerService.get_container_state_async(server_id)
+            queue = self._queues.get(server_id)
+            if not queue and state is None and not sleep_state.is_sleeping(server_id):
+                self.rejected += 1
+                raise LifecycleError("Server is not running")
+        if queue and queue[-1].action == action:
+            self.joined += 1
+            return queue[-1]
+
+        self.stops += 1
+        if sleep_entry is None:
+            run = lambda: run_docker(ServerService.stop_server, server_id)
+        else:
+            run = lambda: run_docker(_hibernate, server_id, sleep_entry)
+        return self._enqueue(server_id, Operation(action, LifecycleState.STOPPING), run)
+
+    @contextlib.asynccontextmanager
+    async def hold(self, server_id: str, action: str) -> AsyncIterator[None]:
+        """
+        Keep a stopped server stopped while the block runs, starts and stops asked for meanwhile wait
+        for it. Raises LifecycleError if the server is running or about to be.
+        """
+        queue = self._queues.get(server_id)
+        if not queue:
+            state = await DockerService.get_container_state_async(server_id)
+            queue = self._queues.get(server_id)
+            if not queue and observed_state(state) != LifecycleState.STOPPED:
+                self.rejected += 1
+                raise LifecycleError(f"Stop the server before the {action}")
+        if queue and queue[-1].state not in (LifecycleState.STOPPING, LifecycleState.STOPPED):
+            self.rejected += 1
+            raise LifecycleError(f"The server is starting, stop it before the {action}")
+
+        loop = asyncio.get_running_loop()
+        entered, finished = loop.create_future(), loop.create_future()
+
+        async def run() -> bool:
+            entered.set_result(None)
+            await finished
+            return True
+
+        operation = self._enqueue(server_id, Operation(action, LifecycleState.STOPPED), run)
+        try:
+            await asyncio.wait([entered, operation.task], return_when=asyncio.FIRST_COMPLETED)
+            if not entered.done():
+                raise LifecycleError(f"Could not start the {action}")
+            # Another worker may have started the server before this one got its turn
+            state = await DockerService.get_container_state_async(server_id)
+            if observed_state(state) != LifecycleState.STOPPED:
+                raise LifecycleError(f"Stop the server before the {action}")
+            yield
+        finally:
+            if not finished.done():
+                finished.set_result(None)
+
+    def _enqueue(self, server_id: str, operation: Operation, run: Callable[[], Awaitable]) -> Operation:
+        queue = self._queues.setdefault(server_id, [])
+        previous = queue[-1] if queue else None
+        queue.append(operation)
+        operation.task = asyncio.create_task(self._execute(server_id, operation, previous, run))
+        self._tasks.add(operation.task)
+        operation.task.add_done_callback(self._tasks.discard)
+        return operation
+
+    async def _execute(self, server_id: str, operation: Operation, previous: Optional[Operation],
+                       run: Callable[[], Awaitable]):
+        try:
+            if previous is not None:
+                # Only the order matters here, the previous operation reports its own outcome
+                await asyncio.wait([previous.task])
+
+            lock = LeaderLock(LIFECYCLE_LOCK_TEMPLATE.format(base_dir=HOST_PWD, server_id=server_id))
+            while not await run_io(lock.try_acquire):
+                await asyncio.sleep(LIFECYCLE_LOCK_POLL)
+            try:
+                return await run()
+            finally:
+                lock.release()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error running {operation.action} of server {server_id}: {e}")
+            return False
+        finally:
+            queue = self._queues.get(server_id)
+            if queue is not None:
+                queue.remove(operation)
+                if not queue:
+                    del self._queues[server_id]
+
+
+lifecycle = ServerLifecycle()
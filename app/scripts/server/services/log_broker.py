@@ -0,0 +1,192 @@
+import asyncio
+import logging
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, List, Optional, Set
+
+from scripts.server.config import LOG_BUFFER_LINES, LOG_MAX_DROPPED, LOG_SUBSCRIBER_QUEUE
+from scripts.server.services.docker_api import AsyncDockerAPIClient
+from scripts.server.services.docker_backend import backend_for
+from scripts.server.services.docker_hosts import docker_hosts
+
+logger = logging.getLogger(__name__)
+
+
+class _LineSplitter:
+    """Turn raw log stream chunks into lines, stripping stream headers of non-TTY containers."""
+
+    def __init__(self, multiplexed: bool):
+        self._multiplexed = multiplexed
+        self._raw = b""
+        self._buffer = b""
+
+    def feed(self, chunk: bytes) -> List[str]:
+        if self._multiplexed:
+            self._raw += chunk
+            while len(self._raw) >= 8:
+                size = int.from_bytes(self._raw[4:8], "big")
+                if len(self._raw) < 8 + size:
+                    break
+                self._buffer += self._raw[8:8 + size]
+                self._raw = self._raw[8 + size:]
+        else:
+            self._buffer += chunk
+
+        *lines, self._buffer = self._buffer.split(b"\n")
+        return [line.decode("utf-8", errors="replace").strip() for line in lines]
+
+
+class Subscription:
+    """One console viewer: the backlog it joined with plus a bounded queue of new lines."""
+
+    def __init__(self, container_id: str, backlog: List[str]):
+        self.container_id = container_id
+        self.backlog = backlog
+        self.dropped = 0
+        self.closed = False
+        self.evicted = False
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=LOG_SUBSCRIBER_QUEUE)
+
+    def _push(self, line: Optional[str]) -> None:
+        if self.closed:
+            return
+        if line is None:
+            self._close()
+            return
+        try:
+            self._queue.put_nowait(line)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.dropped > LOG_MAX_DROPPED:
+                logger.warning(f"Disconnecting slow console viewer of {self.container_id}")
+                self.evicted = True
+                self._close()
+
+    def _close(self) -> None:
+        self.closed = True
+        # Make room for the end marker so a waiting reader always wakes up
+        if self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait(None)
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        while True:
+            line = await self._queue.get()
+            if line is None:
+                return
+            yield line
+
+
+class _Follower:
+    """Single log stream for one container, fanned out to every subscription."""
+
+    def __init__(self, container_id: str):
+        self.container_id = container_id
+        self.lines: Deque[str] = deque(maxlen=LOG_BUFFER_LINES)
+        self.subscribers: Set[Subscription] = set()
+        self.task: Optional[asyncio.Task] = None
+
+    def publish(self, line: str) -> None:
+        self.lines.append(line)
+        for subscription in list(self.subscribers):
+            subscription._push(line)
+
+    def finish(self) -> None:
+        for subscription in list(self.subscribers):
+            subscription._push(None)
+
+
+class LogBroker:
+    """Shares one `docker logs -f` stream per container between all console websockets."""
+
+    def __init__(self):
+        self._followers: Dict[str, _Follower] = {}
+        self._clients: Dict[str, AsyncDockerAPIClient] = {}
+
+    def subscribe(self, container_id: str) -> Subscription:
+        follower = self._followers.get(container_id)
+        if follower is None:
+            follower = self._followers[container_id] = _Follower(container_id)
+        if follower.task is None or follower.task.done():
+            # First viewer, or the previous stream ended with the container: (re)start following
+            follower.lines.clear()
+            follower.task = asyncio.create_task(self._follow(follower))
+
+        subscription = Subscription(container_id, list(follower.lines))
+        follower.subscribers.add(subscription)
+        return subscription
+
+    async def unsubscribe(self, subscription: Subscription) -> None:
+        follower = self._followers.get(subscription.container_id)
+        if follower is None:
+            return
+        follower.subscribers.discard(subscription)
+        if not follower.subscribers:
+            # Last viewer left, tear the stream down
+            del self._followers[subscription.container_id]
+            follower.task.cancel()
+            try:
+                await follower.task
+            except asyncio.CancelledError:
+                pass
+
+    async def close(self) -> None:
+        for follower in list(self._followers.values()):
+            follower.task.cancel()
+        self._followers.clear()
+        for client in self._clients.values():
+            await client.close()
+        self._clients.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "followers": len(self._followers),
+            "subscribers": sum(len(follower.subscribers) for follower in self._followers.values()),
+        }
+
+    async def _follow(self, follower: _Follower) -> None:
+        try:
+            if backend_for(follower.container_id).name == "cli":
+                await self._follow_cli(follower)
+            else:
+                await self._follow_api(follower)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error following logs of {follower.container_id}: {e}")
+            follower.publish(f"[ERROR] {e}")
+        follower.finish()
+
+    async def _follow_api(self, follower: _Follower) -> None:
+        host = docker_hosts.host_for(follower.container_id)
+        client = self._clients.get(host.name)
+        if client is None:
+            client = self._clients[host.name] = AsyncDockerAPIClient(host.endpoint)
+
+        container = await client.inspect_container(follower.container_id)
+        splitter = _LineSplitter(multiplexed=not container["Config"].get("Tty", False))
+        params = {"follow": "1", "stdout": "1", "stderr": "1", "tail": str(LOG_BUFFER_LINES)}
+        async for chunk in client.stream(f"/containers/{follower.container_id}/logs", params=params):
+            for line in splitter.feed(chunk):
+                follower.publish(line)
+
+    async def _follow_cli(self, follower: _Follower) -> None:
+        host = docker_hosts.host_for(follower.container_id)
+        endpoint = host.endpoint if "://" in host.endpoint else f"unix://{host.endpoint}"
+        process = await asyncio.create_subprocess_exec(
+            "docker", "-H", endpoint, "logs", "-f", "--tail", str(LOG_BUFFER_LINES), follower.container_id,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT
+        )
+        try:
+            while True:
+                line = await process.stdout.readline()
+                if not line:
+                    break
+                follower.publish(line.decode("utf-8", errors="replace").strip())
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+
+
+log_broker = LogBroker()
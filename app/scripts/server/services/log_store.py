@@ -0,0 +1,460 @@
+import asyncio
+import bisect
+import calendar
+import logging
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Pattern, Tuple
+
+from scripts.server.config import (
+    HOST_PWD,
+    LOG_FLUSH_BYTES,
+    LOG_FLUSH_INTERVAL,
+    LOG_RETENTION_BYTES,
+    LOG_SEARCH_MAX_BLOCKS,
+    LOG_SEGMENT_BYTES,
+    LOG_STORE_DIR_TEMPLATE,
+    LOG_STORE_ENABLED,
+    LOG_SYNC_INTERVAL,
+    PORT_RANGE_END,
+    PORT_RANGE_START,
+)
+from scripts.server.services.container_cache import container_cache
+from scripts.server.services.docker_api import AsyncDockerAPIClient
+from scripts.server.services.docker_hosts import DockerHost, docker_hosts
+from scripts.server.services.executors import run_io
+from scripts.server.services.log_broker import _LineSplitter
+from scripts.utils.leader_lock import LeaderLock
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".seg"
+INDEX_SUFFIX = ".idx"
+# One record per block: offset and length in the segment, first line number, line count, first and last time
+INDEX_RECORD = struct.Struct("<QIQIdd")
+INDEX_CACHE_SERVERS = 64
+MAX_QUERY_LENGTH = 256
+
+Line = Tuple[float, str]
+
+
+def parse_timestamp(value: str) -> float:
+    """Epoch seconds of a Docker log timestamp such as 2024-05-01T12:00:00.123456789Z."""
+    base, _, fraction = value.rstrip("Z").partition(".")
+    seconds = calendar.timegm(time.strptime(base, "%Y-%m-%dT%H:%M:%S"))
+    return seconds + float("0." + fraction) if fraction else float(seconds)
+
+
+def compile_query(query: str) -> Pattern:
+    """
+    Case-insensitive pattern for a search, always a plain substring: user regular expressions can
+    backtrack for minutes on one line and hold a worker thread all that time. Raises ValueError.
+    """
+    if not query or len(query) > MAX_QUERY_LENGTH:
+        raise ValueError(f"Query must be 1 to {MAX_QUERY_LENGTH} characters")
+    return re.compile(re.escape(query), re.IGNORECASE)
+
+
+def _entry(number: int, timestamp: float, text: str) -> Dict[str, Any]:
+    return {"n": number, "time": timestamp, "text": text}
+
+
+class _Block(NamedTuple):
+    segment: int
+    offset: int
+    length: int
+    first_line: int
+    count: int
+    first_time: float
+    last_time: float
+
+    @property
+    def end_line(self) -> int:
+        return self.first_line + self.count
+
+
+class LogStore:
+    """
+    Console output of every server in compressed, append-only segment files.
+
+    Each write appends one zlib-compressed block of lines to the server's current segment, then a
+    fixed-size record to that segment's index: where the block is, its first line number and count,
+    its first and last timestamp. Lines are numbered from 0 per server and keep their number, so
+    pages and searches only decompress the blocks the index points them to. Segments roll at
+    LOG_SEGMENT_BYTES and the oldest go once a server has more than LOG_RETENTION_BYTES.
+    """
+
+    def __init__(self, root: str = LOG_STORE_DIR_TEMPLATE.format(base_dir=HOST_PWD)):
+        self.root = root
+        self._lock = threading.Lock()
+        # {server_id: {segment: (index bytes read, blocks)}}, index files only ever grow
+        self._indexes: "OrderedDict[str, Dict[int, Tuple[int, List[_Block]]]]" = OrderedDict()
+
+    def _path(self, server_id: str, segment: int, suffix: str) -> str:
+        return os.path.join(self.root, server_id, f"{segment:08d}{suffix}")
+
+    def _segments(self, server_id: str) -> List[int]:
+        try:
+            names = os.listdir(os.path.join(self.root, server_id))
+        except FileNotFoundError:
+            return []
+        return sorted(int(name[:-len(INDEX_SUFFIX)]) for name in names if name.endswith(INDEX_SUFFIX))
+
+    def blocks(self, server_id: str) -> List[_Block]:
+        """Every block of a server, oldest first. Only index records appended since the last call are read."""
+        with self._lock:
+            cached = self._indexes.pop(server_id, {})
+            self._indexes[server_id] = cached
+            if len(self._indexes) > INDEX_CACHE_SERVERS:
+                self._indexes.popitem(last=False)
+
+            segments = self._segments(server_id)
+            for segment in set(cached) - set(segments):
+                del cached[segment]
+            blocks: List[_Block] = []
+            for segment in segments:
+                read, known = cached.get(segment, (0, []))
+                try:
+                    with open(self._path(server_id, segment, INDEX_SUFFIX), "rb") as f:
+                        f.seek(read)
+                        data = f.read()
+                except FileNotFoundError:
+                    cached.pop(segment, None)
+                    continue
+                # A record still being written by the archiver is picked up next time
+                usable = len(data) - len(data) % INDEX_RECORD.size
+                known.extend(_Block(segment, *fields) for fields in INDEX_RECORD.iter_unpack(data[:usable]))
+                cached[segment] = (read + usable, known)
+                blocks.extend(known)
+            return blocks
+
+    def last_time(self, server_id: str) -> Optional[float]:
+        blocks = self.blocks(server_id)
+        return blocks[-1].last_time if blocks else None
+
+    def append(self, server_id: str, lines: List[Line]) -> None:
+        """Write lines as one block. Only the archiver leader appends."""
+        if not lines:
+            return
+        blocks = self.blocks(server_id)
+        segment = blocks[-1].segment if blocks else 0
+        first_line = blocks[-1].end_line if blocks else 0
+        data = zlib.compress("".join(f"{timestamp:.6f} {text}\n" for timestamp, text in lines).encode("utf-8"))
+
+        os.makedirs(os.path.join(self.root, server_id), exist_ok=True)
+        try:
+            offset = os.path.getsize(self._path(server_id, segment, SEGMENT_SUFFIX))
+        except FileNotFoundError:
+            offset = 0
+        rolled = offset > 0 and offset + len(data) > LOG_SEGMENT_BYTES
+        if rolled:
+            segment, offset = segment + 1, 0
+
+        with open(self._path(server_id, segment, SEGMENT_SUFFIX), "ab") as f:
+            f.write(data)
+        # The record goes in last, readers never see a block that is not completely written
+        with open(self._path(server_id, segment, INDEX_SUFFIX), "ab") as f:
+            f.write(INDEX_RECORD.pack(offset, len(data), first_line, len(lines), lines[0][0], lines[-1][0]))
+        if rolled:
+            self._trim(server_id)
+
+    def _trim(self, server_id: str) -> None:
+        segments = self._segments(server_id)
+        sizes = {}
+        for segment in segments:
+            try:
+                sizes[segment] = os.path.getsize(self._path(server_id, segment, SEGMENT_SUFFIX))
+            except FileNotFoundError:
+                sizes[segment] = 0
+        total = sum(sizes.values())
+        for segment in segments[:-1]:
+            if total <= LOG_RETENTION_BYTES:
+                break
+            total -= sizes[segment]
+            # Index first, so no reader looks for blocks of a deleted segment
+            for suffix in (INDEX_SUFFIX, SEGMENT_SUFFIX):
+                try:
+                    os.remove(self._path(server_id, segment, suffix))
+                except FileNotFoundError:
+                    pass
+
+    def _read(self, server_id: str, block: _Block) -> List[Line]:
+        try:
+            with open(self._path(server_id, block.segment, SEGMENT_SUFFIX), "rb") as f:
+                f.seek(block.offset)
+                data = f.read(block.length)
+        except FileNotFoundError:
+            # Trimmed since the index was read
+            return []
+        lines = []
+        for raw in zlib.decompress(data).decode("utf-8", errors="replace").split("\n")[:-1]:
+            stamp, _, text = raw.partition(" ")
+            lines.append((float(stamp), text))
+        return lines
+
+    @staticmethod
+    def _block_before(blocks: List[_Block], line: int) -> int:
+        """Index of the block holding the line just before `line`, -1 if there is none."""
+        return bisect.bisect_right([block.first_line for block in blocks], line - 1) - 1
+
+    def _line_after(self, server_id: str, blocks: List[_Block], until: float) -> int:
+        """Number of the first line written after `until`."""
+        index = bisect.bisect_right([block.last_time for block in blocks], until)
+        if index == len(blocks):
+            return blocks[-1].end_line if blocks else 0
+        block = blocks[index]
+        for number, (timestamp, _) in enumerate(self._read(server_id, block), block.first_line):
+            if timestamp > until:
+                return number
+        return block.end_line
+
+    def page(self, server_id: str, before: Optional[int] = None, until: Optional[float] = None,
+             limit: int = 100) -> Dict[str, Any]:
+        """
+        Up to `limit` lines, oldest first, that come before line number `before`, or were written up to
+        time `until`, or the newest ones. `next` is the `before` of the page preceding this one,
+        None at the start of the history.
+        """
+        blocks = self.blocks(server_id)
+        end = blocks[-1].end_line if blocks else 0
+        if until is not None:
+            before = self._line_after(server_id, blocks, until)
+        before = end if before is None else min(before, end)
+
+        lines: List[Dict[str, Any]] = []
+        index = self._block_before(blocks, before)
+        while index >= 0 and len(lines) < limit:
+            block = blocks[index]
+            for number, (timestamp, text) in reversed(list(enumerate(self._read(server_id, block), block.first_line))):
+                if number < before:
+                    lines.append(_entry(number, timestamp, text))
+                    if len(lines) == limit:
+                        break
+            index -= 1
+
+        lines.reverse()
+        start = lines[0]["n"] if lines else before
+        return {"lines": lines, "next": start if blocks and start > blocks[0].first_line else None}
+
+    def search(self, server_id: str, pattern: Pattern, before: Optional[int] = None,
+               since: Optional[float] = None, until: Optional[float] = None, limit: int = 100) -> Dict[str, Any]:
+        """
+        Lines matching `pattern` written between `since` and `until`, scanning backwards from `before`.
+
+        Blocks outside the time range are skipped on their index record alone. A call stops after
+        `limit` matches or LOG_SEARCH_MAX_BLOCKS decompressed blocks, `next` continues the scan.
+        """
+        blocks = self.blocks(server_id)
+        end = blocks[-1].end_line if blocks else 0
+        before = end if before is None else min(before, end)
+
+        matches: List[Dict[str, Any]] = []
+        cursor: Optional[int] = before
+        scanned = 0
+        for index in range(self._block_before(blocks, before), -1, -1):
+            block = blocks[index]
+            if len(matches) >= limit or scanned >= LOG_SEARCH_MAX_BLOCKS:
+                break
+            if since is not None and block.last_time < since:
+                # Everything older is older still
+                cursor = None
+                break
+            if until is not None and block.first_time > until:
+                cursor = block.first_line
+                continue
+
+            scanned += 1
+            for number, (timestamp, text) in reversed(list(enumerate(self._read(server_id, block), block.first_line))):
+                if number >= cursor:
+                    continue
+                cursor = number
+                if ((since is None or timestamp >= since) and (until is None or timestamp <= until)
+                        and pattern.search(text)):
+                    matches.append(_entry(number, timestamp, text))
+                    if len(matches) == limit:
+                        break
+
+        matches.reverse()
+        done = cursor is None or not blocks or cursor <= blocks[0].first_line
+        return {"lines": matches, "next": None if done else cursor}
+
+
+class LogArchiver:
+    """
+    Follows the output of every running server and writes it to the log store in batches.
+
+    Lines are buffered per server and written as one block once LOG_FLUSH_BYTES have gathered or
+    the oldest has waited LOG_FLUSH_INTERVAL seconds. Only the worker holding the leader lock
+    archives. A stream that restarts (new container, reconnect, new leader) resumes after the last
+    line stored.
+    """
+
+    def __init__(self, store: LogStore):
+        self._store = store
+        self._leader = LeaderLock(os.path.join(store.root, ".leader"))
+        self._task: Optional[asyncio.Task] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._streams: Dict[str, asyncio.Task] = {}
+        self._clients: Dict[str, AsyncDockerAPIClient] = {}
+        self._buffers: Dict[str, List[Line]] = {}
+        self._buffered_bytes: Dict[str, int] = {}
+        self._buffered_at: Dict[str, float] = {}
+
+        self.lines_written = 0
+        self.blocks_written = 0
+
+    async def start(self) -> None:
+        if not LOG_STORE_ENABLED or self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        tasks = [self._task, self._flusher, *self._streams.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = self._flusher = None
+        self._streams.clear()
+        try:
+            await self._flush(force=True)
+        except Exception as e:
+            logger.error(f"Error writing console logs on shutdown: {e}")
+        self._leader.release()
+        for client in self._clients.values():
+            await client.close()
+        self._clients.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "leader": self._leader.held,
+            "streams": len(self._streams),
+            "buffered_lines": sum(len(lines) for lines in self._buffers.values()),
+            "lines_written": self.lines_written,
+            "blocks_written": self.blocks_written,
+        }
+
+    def _try_lead(self) -> bool:
+        if self._leader.held:
+            return True
+        if not self._leader.try_acquire():
+            return False
+        logger.info("This worker now archives console logs")
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if await run_io(self._try_lead):
+                    self._sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error syncing log streams: {e}")
+            await asyncio.sleep(LOG_SYNC_INTERVAL)
+
+    def _sync(self) -> None:
+        """Follow every running server. Streams end with their container, failed ones are retried here."""
+        if not container_cache.live:
+            return
+        for state in container_cache.running():
+            if state.id in self._streams or not PORT_RANGE_START <= int(state.port) <= PORT_RANGE_END:
+                continue
+            host = docker_hosts.get(state.host) if state.host else docker_hosts.default
+            task = self._streams[state.id] = asyncio.create_task(self._follow(state.id, host))
+            task.add_done_callback(lambda task, server_id=state.id: self._ended(server_id, task))
+
+    def _ended(self, server_id: str, task: asyncio.Task) -> None:
+        if self._streams.get(server_id) is task:
+            del self._streams[server_id]
+            # Write what is left right away
+            self._wakeup.set()
+
+    async def _follow(self, server_id: str, host: DockerHost) -> None:
+        client = self._clients.get(host.name)
+        if client is None:
+            client = self._clients[host.name] = AsyncDockerAPIClient(host.endpoint)
+
+        try:
+            buffered = self._buffers.get(server_id)
+            since = buffered[-1][0] if buffered else await run_io(self._store.last_time, server_id)
+            container = await client.inspect_container(server_id)
+            splitter = _LineSplitter(multiplexed=not container["Config"].get("Tty", False))
+            params = {"follow": "1", "stdout": "1", "stderr": "1", "timestamps": "1"}
+            if since is not None:
+                params["since"] = f"{since:.6f}"
+
+            async for chunk in client.stream(f"/containers/{server_id}/logs", params=params):
+                for raw in splitter.feed(chunk):
+                    stamp, _, text = raw.partition(" ")
+                    try:
+                        timestamp = parse_timestamp(stamp)
+                    except ValueError:
+                        timestamp, text = time.time(), raw
+                    # `since` is inclusive, lines already stored come around again
+                    if since is None or timestamp > since:
+                        self._buffer(server_id, timestamp, text)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Log stream of {server_id} failed: {e}")
+
+    def _buffer(self, server_id: str, timestamp: float, text: str) -> None:
+        lines = self._buffers.get(server_id)
+        if lines is None:
+            lines = self._buffers[server_id] = []
+            self._buffered_bytes[server_id] = 0
+            self._buffered_at[server_id] = time.monotonic()
+        lines.append((timestamp, text))
+        self._buffered_bytes[server_id] += len(text) + 18
+        if self._buffered_bytes[server_id] >= LOG_FLUSH_BYTES:
+            self._wakeup.set()
+
+    async def _flush_loop(self) -> None:
+        # The only writer while running, so blocks of a server are appended in order
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self._flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error writing console logs: {e}")
+
+    async def _flush(self, force: bool = False) -> None:
+        now = time.monotonic()
+        batches = {}
+        for server_id in list(self._buffers):
+            if (force or server_id not in self._streams or self._buffered_bytes[server_id] >= LOG_FLUSH_BYTES
+                    or now - self._buffered_at[server_id] >= LOG_FLUSH_INTERVAL):
+                batches[server_id] = self._buffers.pop(server_id)
+                del self._buffered_bytes[server_id], self._buffered_at[server_id]
+        if batches:
+            await run_io(self._write, batches)
+
+    def _write(self, batches: Dict[str, List[Line]]) -> None:
+        for server_id, lines in batches.items():
+            try:
+                self._store.append(server_id, lines)
+            except OSError as e:
+                logger.error(f"Error writing console log of {server_id}, {len(lines)} lines lost: {e}")
+                continue
+            self.lines_written += len(lines)
+            self.blocks_written += 1
+
+
+log_store = LogStore()
+log_archiver = LogArchiver(log_store)
@@ -0,0 +1,232 @@
+import asyncio
+import json
+import logging
+import re
+import struct
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from scripts.server.config import PING_CACHE_TTL, PING_CONCURRENCY, PING_HOST, PING_TIMEOUT
+from scripts.server.models.server import ServerPing
+from scripts.utils.lru_cache import ExpiringLRUCache
+from scripts.utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# "Unknown" protocol version, servers answer the status request whatever their own version
+PROTOCOL_VERSION = -1
+MAX_PACKET = 1 << 21
+FORMATTING_CODES = re.compile("§.")
+
+ping_seconds = registry.histogram(
+    "minecraft_ping_seconds", "Duration of Server List Ping round trips", ["outcome"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+
+
+class PingError(Exception):
+    """Raised when a server does not answer the status ping correctly."""
+
+
+def encode_varint(value: int) -> bytes:
+    """Protocol VarInt of a 32-bit int, negative values in two's complement."""
+    value &= 0xFFFFFFFF
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def encode_string(value: str) -> bytes:
+    """Protocol string: UTF-8 bytes prefixed with their length."""
+    data = value.encode("utf-8")
+    return encode_varint(len(data)) + data
+
+
+def encode_packet(packet_id: int, payload: bytes = b"") -> bytes:
+    """Uncompressed packet framing: length, packet ID, payload."""
+    body = encode_varint(packet_id) + payload
+    return encode_varint(len(body)) + body
+
+
+async def _read_varint(reader: asyncio.StreamReader) -> int:
+    value = 0
+    for shift in range(0, 35, 7):
+        byte = (await reader.readexactly(1))[0]
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value - (1 << 32) if value & (1 << 31) else value
+    raise PingError("VarInt too long")
+
+
+def decode_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    """(value, offset after it) of a VarInt in `data`, raising PingError if it is cut off."""
+    value = 0
+    for shift in range(0, 35, 7):
+        if offset >= len(data):
+            raise PingError("Truncated packet")
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+    raise PingError("VarInt too long")
+
+
+async def read_packet(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+    """(packet ID, payload) of the next uncompressed packet on the stream."""
+    length = await _read_varint(reader)
+    if not 0 < length <= MAX_PACKET:
+        raise PingError(f"Invalid packet length {length}")
+    data = await reader.readexactly(length)
+    packet_id, offset = decode_varint(data, 0)
+    return packet_id, data[offset:]
+
+
+def _flatten_text(component: Any) -> str:
+    """Plain text of a chat component (string, dict with text/extra, or list), without formatting codes."""
+    if isinstance(component, str):
+        text = component
+    elif isinstance(component, list):
+        text = "".join(_flatten_text(part) for part in component)
+    elif isinstance(component, dict):
+        text = str(component.get("text", "")) + "".join(_flatten_text(part) for part in component.get("extra", []))
+    else:
+        text = ""
+    return FORMATTING_CODES.sub("", text)
+
+
+def parse_status(status: Dict[str, Any], latency_ms: Optional[float] = None) -> ServerPing:
+    players = status.get("players") or {}
+    version = status.get("version") or {}
+    return ServerPing(
+        online_players=int(players.get("online", 0)),
+        max_players=int(players.get("max", 0)),
+        version=version.get("name"),
+        protocol=version.get("protocol"),
+        motd=_flatten_text(status.get("description", "")),
+        latency_ms=latency_ms,
+    )
+
+
+async def _exchange(host: str, port: int) -> ServerPing:
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        handshake = encode_varint(PROTOCOL_VERSION) + encode_string(host) + struct.pack(">H", port) + encode_varint(1)
+        writer.write(encode_packet(0x00, handshake) + encode_packet(0x00))
+        await writer.drain()
+
+        packet_id, payload = await read_packet(reader)
+        if packet_id != 0x00:
+            raise PingError(f"Unexpected packet {packet_id:#x} in status response")
+        length, offset = decode_varint(payload, 0)
+        try:
+            status = json.loads(payload[offset:offset + length].decode("utf-8"))
+        except ValueError as e:
+            raise PingError(f"Malformed status JSON: {e}")
+
+        # Latency is the ping/pong round trip alone, as the client's server list shows it
+        token = int(time.time() * 1000)
+        sent = time.perf_counter()
+        writer.write(encode_packet(0x01, struct.pack(">q", token)))
+        await writer.drain()
+        packet_id, payload = await read_packet(reader)
+        latency_ms = (time.perf_counter() - sent) * 1000
+        if packet_id != 0x01 or struct.unpack(">q", payload[:8])[0] != token:
+            # Some proxies close instead of answering the ping, the status itself is still valid
+            latency_ms = None
+        return parse_status(status, latency_ms)
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+
+async def ping(host: str, port: int, timeout: float = PING_TIMEOUT) -> ServerPing:
+    """Run a Server List Ping (handshake, status, ping) against host:port within `timeout` seconds."""
+    start = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(_exchange(host, port), timeout)
+    except asyncio.TimeoutError:
+        ping_seconds.observe(time.perf_counter() - start, outcome="timeout")
+        raise PingError(f"Timed out after {timeout}s")
+    except (OSError, asyncio.IncompleteReadError) as e:
+        ping_seconds.observe(time.perf_counter() - start, outcome="error")
+        raise PingError(str(e) or type(e).__name__)
+    except PingError:
+        ping_seconds.observe(time.perf_counter() - start, outcome="error")
+        raise
+    ping_seconds.observe(time.perf_counter() - start, outcome="ok")
+    return result
+
+
+class ServerPinger:
+    """
+    Pings many servers at once with bounded concurrency.
+
+    Results, including failures, are reused for PING_CACHE_TTL seconds so listing servers does not
+    open a connection to every running server on each request.
+    """
+
+    def __init__(self, host: str = PING_HOST, concurrency: int = PING_CONCURRENCY, ttl: float = PING_CACHE_TTL):
+        self._host = host
+        self._ttl = ttl
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._concurrency = concurrency
+        self._results = ExpiringLRUCache(4096)
+        self._inflight: Dict[Tuple[str, int], asyncio.Future] = {}
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+        return self._semaphore
+
+    async def ping(self, port: int, timeout: float = PING_TIMEOUT, fresh: bool = False,
+                   host: Optional[str] = None) -> Optional[ServerPing]:
+        """Ping the server published on `port` of `host` (PING_HOST by default), None if it does not answer."""
+        key = (host or self._host, port)
+        if not fresh:
+            hit = self._results.get(key)
+            if hit is not None:
+                return hit[0]
+
+        # The probe runs as its own task, a caller that is cancelled does not cancel it for the others
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._probe(key, timeout))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._probed(key, done))
+        return await asyncio.shield(task)
+
+    async def _probe(self, key: Tuple[str, int], timeout: float) -> Optional[ServerPing]:
+        async with self._get_semaphore():
+            try:
+                result: Optional[ServerPing] = await ping(key[0], key[1], timeout)
+            except PingError as e:
+                logger.debug(f"Ping {key[0]}:{key[1]} failed: {e}")
+                result = None
+        self._results.set(key, (result,), time.time() + self._ttl)
+        return result
+
+    def _probed(self, key: Tuple[str, int], task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Every caller may have gone away, avoid "exception never retrieved" noise
+        if not task.cancelled():
+            task.exception()
+
+    async def ping_many(self, addresses: Dict[str, Tuple[str, int]],
+                        timeout: float = PING_TIMEOUT) -> Dict[str, Optional[ServerPing]]:
+        """Ping every server of a {server_id: (host, port)} mapping concurrently."""
+        results = await asyncio.gather(*(self.ping(port, timeout, host=host) for host, port in addresses.values()))
+        return dict(zip(addresses.keys(), results))
+
+
+server_pinger = ServerPinger()
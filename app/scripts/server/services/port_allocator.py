@@ -0,0 +1,124 @@
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from scripts.server.config import (
+    HOST_PWD,
+    PORT_BLOCK_SECONDS,
+    PORT_RANGE_END,
+    PORT_RANGE_START,
+    PORT_STATE_TEMPLATE,
+)
+from scripts.server.services.container_cache import container_cache
+from scripts.server.services.sleep_state import sleep_state
+from scripts.utils.json_state import JSONStateFile
+
+logger = logging.getLogger(__name__)
+
+CONFLICT_MARKERS = ("port is already allocated", "address already in use")
+# A lease whose container is not running this long after it was taken is left over from a crash
+STALE_LEASE_SECONDS = 300
+
+
+class PortsExhausted(Exception):
+    """Raised when every port of the configured range is in use."""
+
+
+def is_port_conflict(error: Exception) -> bool:
+    """Whether Docker refused to start a container because its host port is taken."""
+    message = str(error).lower()
+    return any(marker in message for marker in CONFLICT_MARKERS)
+
+
+class PortAllocator:
+    """
+    Hands out host ports from PORT_RANGE_START..PORT_RANGE_END, one stable port per server.
+
+    A server gets the same port every time it starts, so player bookmarks keep working. Its lease
+    is released when it stops, the assignment stays. Only when the range is exhausted is the port
+    of the longest stopped server reassigned.
+
+    State lives in a JSON file under the data directory, guarded by flock, so every worker process
+    sees the same assignments and they survive restarts.
+    """
+
+    def __init__(self, path: str = PORT_STATE_TEMPLATE.format(base_dir=HOST_PWD),
+                 start: int = PORT_RANGE_START, end: int = PORT_RANGE_END):
+        self._file = JSONStateFile(path, keys=("assignments", "leases", "last_used", "blocked"))
+        self._start = start
+        self._end = end
+
+    def allocate(self, server_id: str) -> int:
+        """Lease the server's port, assigning one first if it has none or its old one is taken."""
+        now = time.time()
+        published = container_cache.published_ports()
+        # Hibernated servers have no container, their wake-up listener holds the port
+        sleeping = {entry["port"] for owner, entry in sleep_state.sleeping().items() if owner != server_id}
+        with self._file.locked() as state:
+            assignments, leases, blocked = state["assignments"], state["leases"], state["blocked"]
+            for port, until in list(blocked.items()):
+                if until <= now:
+                    del blocked[port]
+            if container_cache.stats()["live"]:
+                running = set(published.values())
+                for owner in list(leases):
+                    if owner not in running and now - state["last_used"].get(owner, 0) > STALE_LEASE_SECONDS:
+                        del leases[owner]
+
+            taken = {int(port) for port in blocked}
+            taken.update(leases[other] for other in leases if other != server_id)
+            taken.update(port for port, owner in published.items() if owner != server_id)
+            taken.update(sleeping)
+
+            port = assignments.get(server_id)
+            if port is None or port in taken or not self._start <= port <= self._end:
+                port = self._pick(server_id, state, taken)
+
+            assignments[server_id] = port
+            leases[server_id] = port
+            state["last_used"][server_id] = now
+            return port
+
+    def _pick(self, server_id: str, state: Dict[str, Any], taken: set) -> int:
+        assigned = {port: owner for owner, port in state["assignments"].items() if owner != server_id}
+        for port in range(self._start, self._end + 1):
+            if port not in taken and port not in assigned:
+                return port
+
+        # Range full: take over the port of the server that has been stopped the longest
+        candidates = [(state["last_used"].get(owner, 0), port, owner)
+                      for port, owner in assigned.items() if port not in taken]
+        if not candidates:
+            raise PortsExhausted(f"All ports {self._start}-{self._end} are in use")
+        _, port, owner = min(candidates)
+        logger.info(f"Reassigning port {port} from stopped server {owner} to {server_id}")
+        del state["assignments"][owner]
+        return port
+
+    def lookup(self, server_id: str) -> Optional[int]:
+        """The port assigned to a server, if any, without leasing it."""
+        return self._file.read()["assignments"].get(server_id)
+
+    def release(self, server_id: str) -> None:
+        """Give up the lease of a stopped server. It keeps its assignment."""
+        with self._file.locked() as state:
+            state["leases"].pop(server_id, None)
+            state["last_used"][server_id] = time.time()
+
+    def forget(self, server_id: str) -> None:
+        """Drop everything about a deleted server, its port goes back to the pool."""
+        with self._file.locked() as state:
+            for key in ("assignments", "leases", "last_used"):
+                state[key].pop(server_id, None)
+
+    def block(self, server_id: str, port: int) -> None:
+        """Mark a port as taken by something outside our control, and unassign it from the server."""
+        logger.warning(f"Host port {port} is taken outside the allocator, skipping it for {PORT_BLOCK_SECONDS}s")
+        with self._file.locked() as state:
+            state["blocked"][str(port)] = time.time() + PORT_BLOCK_SECONDS
+            if state["assignments"].get(server_id) == port:
+                del state["assignments"][server_id]
+            state["leases"].pop(server_id, None)
+
+
+port_allocator = PortAllocator()
@@ -0,0 +1,348 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import socket
+import struct
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from scripts.server.config import (
+    HOST_PWD,
+    RCON_BURST,
+    RCON_CONNECT_TIMEOUT,
+    RCON_ENABLED,
+    RCON_IDLE_SECONDS,
+    RCON_PORT,
+    RCON_RATE,
+    RCON_SECRET,
+    RCON_SECRET_TEMPLATE,
+    RCON_TIMEOUT,
+)
+from scripts.server.services.docker_api import AsyncDockerAPIClient, DockerNotFound
+from scripts.server.services.docker_hosts import docker_hosts
+from scripts.utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+TYPE_RESPONSE = 0
+TYPE_COMMAND = 2
+TYPE_LOGIN = 3
+AUTH_FAILED_ID = -1
+MAX_PACKET = 1 << 16
+MAX_COMMAND = 1446  # longest payload the server accepts
+RATE_LIMITED_USERS = 4096
+REAP_INTERVAL = 30
+
+command_seconds = registry.histogram(
+    "rcon_command_seconds", "Round trip of console commands sent over RCON", ["outcome"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0))
+
+_secret: Optional[bytes] = None
+
+
+class RconError(Exception):
+    """Raised when a command cannot be sent or gets no answer."""
+
+
+def _load_secret() -> bytes:
+    if RCON_SECRET:
+        return RCON_SECRET.encode()
+    path = RCON_SECRET_TEMPLATE.format(base_dir=HOST_PWD)
+    if not os.path.exists(path):
+        # Linked into place so concurrent workers all end up with the first one written
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+            f.write(secrets.token_hex(32))
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    with open(path) as f:
+        return f.read().strip().encode()
+
+
+def rcon_password(server_id: str) -> str:
+    """RCON password of a server. Derived from the secret, so every worker knows it without storing it."""
+    global _secret
+    if _secret is None:
+        _secret = _load_secret()
+    return hmac.new(_secret, server_id.encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def _packet(request_id: int, packet_type: int, payload: str) -> bytes:
+    body = struct.pack("<ii", request_id, packet_type) + payload.encode("utf-8") + b"\x00\x00"
+    return struct.pack("<i", len(body)) + body
+
+
+async def _read_packet(reader: asyncio.StreamReader) -> Tuple[int, int, str]:
+    length = struct.unpack("<i", await reader.readexactly(4))[0]
+    if not 10 <= length <= MAX_PACKET:
+        raise RconError(f"Invalid packet length {length}")
+    data = await reader.readexactly(length)
+    request_id, packet_type = struct.unpack("<ii", data[:8])
+    return request_id, packet_type, data[8:-2].decode("utf-8", errors="replace")
+
+
+def container_address(container: Dict[str, Any], networks: Optional[Set[str]] = None) -> Optional[str]:
+    """
+    IP of a container on its Docker network, None for host networking. With `networks`, only an address
+    on one of them counts, None if the container is on none of them.
+    """
+    settings = container.get("NetworkSettings") or {}
+    if networks is None and settings.get("IPAddress"):
+        return settings["IPAddress"]
+    return next((network["IPAddress"] for name, network in (settings.get("Networks") or {}).items()
+                 if network.get("IPAddress") and (networks is None or name in networks)), None)
+
+
+class RconConnection:
+    """
+    One logged in RCON connection, commands pipelined on it by request ID.
+
+    The server answers in order and splits long output over several packets with the same ID, so
+    every command is followed by an empty packet of an unknown type: its answer marks the end of
+    the command's output.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+        self._next_id = 0
+        self._pending: Dict[int, Tuple[asyncio.Future, List[str]]] = {}
+        self._terminators: Dict[int, int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.closed = False
+        self.last_used = time.monotonic()
+
+    @classmethod
+    async def open(cls, host: str, port: int, password: str, timeout: float) -> "RconConnection":
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        connection = cls(reader, writer)
+        try:
+            login_id = connection._take_id()
+            writer.write(_packet(login_id, TYPE_LOGIN, password))
+            request_id, _, _ = await asyncio.wait_for(_read_packet(reader), timeout)
+            if request_id != login_id:
+                raise RconError("RCON login refused" if request_id == AUTH_FAILED_ID else "Unexpected RCON login answer")
+        except BaseException:
+            writer.close()
+            raise
+        connection._task = asyncio.create_task(connection._read())
+        return connection
+
+    def _take_id(self) -> int:
+        self._next_id = self._next_id % 0x7FFFFFFF + 1
+        return self._next_id
+
+    async def execute(self, command: str, timeout: float) -> str:
+        if self.closed:
+            raise RconError("RCON connection closed")
+        self.last_used = time.monotonic()
+        command_id, terminator_id = self._take_id(), self._take_id()
+        future = asyncio.get_running_loop().create_future()
+        self._pending[command_id] = (future, [])
+        self._terminators[terminator_id] = command_id
+        try:
+            self._writer.write(_packet(command_id, TYPE_COMMAND, command) + _packet(terminator_id, TYPE_RESPONSE, ""))
+            await self._writer.drain()
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            # The server may still be working on it, answers to later commands would be out of step
+            self.close()
+            raise RconError("Command timed out")
+        except OSError as e:
+            self.close()
+            raise RconError(f"RCON connection lost: {e}")
+        finally:
+            self._pending.pop(command_id, None)
+            self._terminators.pop(terminator_id, None)
+
+    async def _read(self) -> None:
+        error = "RCON connection closed by the server"
+        try:
+            while True:
+                request_id, _, body = await _read_packet(self._reader)
+                if request_id in self._terminators:
+                    future, chunks = self._pending.pop(self._terminators.pop(request_id), (None, []))
+                    if future is not None and not future.done():
+                        future.set_result("".join(chunks))
+                elif request_id in self._pending:
+                    self._pending[request_id][1].append(body)
+        except asyncio.CancelledError:
+            error = "RCON connection closed"
+        except (asyncio.IncompleteReadError, OSError, RconError) as e:
+            error = f"RCON connection lost: {e}"
+        finally:
+            self.closed = True
+            self._writer.close()
+            for future, _ in self._pending.values():
+                if not future.done():
+                    future.set_exception(RconError(error))
+
+    def close(self) -> None:
+        self.closed = True
+        if self._task is not None:
+            self._task.cancel()
+        else:
+            self._writer.close()
+
+
+class RconPool:
+    """
+    Persistent RCON connections to running servers, opened on first use and shared by every console.
+
+    A connection that drops is opened again by the next command, one idle for RCON_IDLE_SECONDS is
+    closed. Each user may send RCON_RATE commands a second, with bursts of RCON_BURST.
+
+    The RCON port is not published, it is reached on the container's network address. That only works
+    for servers on the local daemon, and when this backend runs in a container itself, for servers on
+    a network it is attached to.
+    """
+
+    def __init__(self):
+        self._connections: Dict[str, RconConnection] = {}
+        self._connecting: Dict[str, asyncio.Future] = {}
+        self._clients: Dict[str, AsyncDockerAPIClient] = {}
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+        self._networks: Optional[Set[str]] = None
+        self._networks_checked = False
+
+        self.commands = 0
+        self.connects = 0
+        self.rate_limited = 0
+
+    async def start(self) -> None:
+        if not RCON_ENABLED or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._reap())
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        for connection in self._connections.values():
+            connection.close()
+        self._connections.clear()
+        for client in self._clients.values():
+            await client.close()
+        self._clients.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "connections": len(self._connections),
+            "commands": self.commands,
+            "connects": self.connects,
+            "rate_limited": self.rate_limited,
+        }
+
+    def allow(self, user_id: str) -> bool:
+        """Take one command from the user's token bucket."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(user_id, (float(RCON_BURST), now))
+        tokens = min(float(RCON_BURST), tokens + (now - updated) * RCON_RATE)
+        allowed = tokens >= 1
+        self._buckets[user_id] = (tokens - 1 if allowed else tokens, now)
+        if len(self._buckets) > RATE_LIMITED_USERS:
+            self._buckets.popitem(last=False)
+        if not allowed:
+            self.rate_limited += 1
+        return allowed
+
+    async def execute(self, server_id: str, command: str) -> str:
+        """Run a console command on a running server and return its output."""
+        if self._task is None:
+            raise RconError("Console commands are disabled")
+        if not command or len(command.encode("utf-8")) > MAX_COMMAND:
+            raise RconError(f"Commands must be 1 to {MAX_COMMAND} bytes")
+
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            connection = await self._connection(server_id)
+            output = await connection.execute(command, RCON_TIMEOUT)
+            outcome = "ok"
+            self.commands += 1
+            return output
+        finally:
+            command_seconds.observe(time.perf_counter() - started, outcome=outcome)
+
+    async def _connection(self, server_id: str) -> RconConnection:
+        connection = self._connections.get(server_id)
+        if connection is not None and not connection.closed:
+            return connection
+        # Consoles of the same server asking at once share one connection attempt
+        opening = self._connecting.get(server_id)
+        if opening is None:
+            opening = self._connecting[server_id] = asyncio.ensure_future(self._open(server_id))
+            opening.add_done_callback(lambda _: self._connecting.pop(server_id, None))
+        return await asyncio.shield(opening)
+
+    async def _own_networks(self, client: AsyncDockerAPIClient) -> Optional[Set[str]]:
+        """Networks of the container this backend runs in, None if it does not run in one of the local daemon."""
+        if not self._networks_checked:
+            if os.path.exists("/.dockerenv"):
+                try:
+                    own = await client.inspect_container(socket.gethostname())
+                    networks = set((own.get("NetworkSettings") or {}).get("Networks") or {})
+                    # Sharing the host's network stack reaches every bridge address
+                    self._networks = None if "host" in networks else networks
+                except DockerNotFound:
+                    pass
+            self._networks_checked = True
+        return self._networks
+
+    async def _open(self, server_id: str) -> RconConnection:
+        host = docker_hosts.host_for(server_id)
+        if not host.local:
+            raise RconError(f"The console is not available for servers on host {host.name}, "
+                            "their RCON port is only reachable from that host")
+        client = self._clients.get(host.name)
+        if client is None:
+            client = self._clients[host.name] = AsyncDockerAPIClient(host.endpoint)
+
+        # Looked up on every connect, a restarted container may have another address
+        try:
+            container = await client.inspect_container(server_id)
+        except DockerNotFound:
+            raise RconError("Server is not running")
+        if not container["State"].get("Running"):
+            raise RconError("Server is not running")
+
+        networks = await self._own_networks(client)
+        address = container_address(container, networks)
+        if address is None and networks is not None:
+            raise RconError("The console is not reachable, the server is on no Docker network of the backend "
+                            f"({', '.join(sorted(networks)) or 'none'})")
+        try:
+            connection = await RconConnection.open(address or host.ping_host, RCON_PORT,
+                                                   rcon_password(server_id), RCON_CONNECT_TIMEOUT)
+        except (asyncio.TimeoutError, OSError, asyncio.IncompleteReadError) as e:
+            raise RconError(f"Cannot reach the server console, it may still be starting: {e}")
+        self.connects += 1
+        self._connections[server_id] = connection
+        return connection
+
+    async def _reap(self) -> None:
+        while True:
+            await asyncio.sleep(REAP_INTERVAL)
+            now = time.monotonic()
+            for server_id, connection in list(self._connections.items()):
+                if connection.closed or now - connection.last_used > RCON_IDLE_SECONDS:
+                    connection.close()
+                    del self._connections[server_id]
+
+
+rcon_pool = RconPool()
@@ -0,0 +1,232 @@
+import asyncio
+import datetime
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+import httpx
+
+from config.supabase import url as SUPABASE_URL, key as SUPABASE_KEY
+from scripts.server.config import SUPABASE_MAX_CONNECTIONS, SUPABASE_TIMEOUT, SERVER_CACHE_SIZE, SERVER_CACHE_TTL
+from scripts.utils.lru_cache import ExpiringLRUCache
+from scripts.utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+supabase_query_seconds = registry.histogram(
+    "supabase_query_seconds", "Duration of PostgREST queries on the servers table", ["operation"])
+supabase_query_errors = registry.counter(
+    "supabase_query_errors_total", "PostgREST queries that failed or were rejected", ["operation"])
+
+
+# Postgres error when no unique constraint matches the on_conflict columns of an upsert
+NO_MATCHING_CONSTRAINT = "42P10"
+
+
+class RepositoryError(Exception):
+    """Raised when PostgREST rejects a query."""
+
+    def __init__(self, status_code: int, message: str, code: Optional[str] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+
+
+class ServerExistsError(RepositoryError):
+    """Raised when a user already has a server with the requested name."""
+
+
+class ServerRepository:
+    """
+    Data access for the `servers` table over PostgREST, on a pooled async HTTP client.
+
+    Identical concurrent reads are coalesced into one round trip. `create` relies on a unique
+    constraint on (user_id, name) so the duplicate check and the insert are a single upsert
+    (supabase/migrations adds it). Without it, it falls back to a check followed by an insert.
+
+    Rows and per-user listings are cached for SERVER_CACHE_TTL seconds and invalidated by this
+    process's own writes; other workers may serve a stale row for at most the TTL.
+    """
+
+    def __init__(self, url: str = SUPABASE_URL, key: str = SUPABASE_KEY, table: str = "servers"):
+        self._url = url.rstrip("/")
+        self._key = key
+        self._table = table
+        self._client: Optional[httpx.AsyncClient] = None
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._timings: Dict[str, List[float]] = {}
+        self.coalesced = 0
+        self._upsert = True
+
+        self._rows = ExpiringLRUCache(SERVER_CACHE_SIZE)
+        self._user_rows = ExpiringLRUCache(SERVER_CACHE_SIZE)
+        # Bumped on every write, a read that raced a write does not populate the cache
+        self._writes = 0
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=f"{self._url}/rest/v1",
+                headers={"apikey": self._key, "Authorization": f"Bearer {self._key}"},
+                limits=httpx.Limits(max_connections=SUPABASE_MAX_CONNECTIONS,
+                                    max_keepalive_connections=SUPABASE_MAX_CONNECTIONS),
+                timeout=SUPABASE_TIMEOUT,
+            )
+        return self._client
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _request(self, op: str, method: str, params: Dict[str, str],
+                       json: Any = None, headers: Optional[Dict[str, str]] = None) -> List[Dict[str, Any]]:
+        start = time.perf_counter()
+        try:
+            response = await self._get_client().request(method, f"/{self._table}", params=params,
+                                                        json=json, headers=headers)
+        except Exception:
+            supabase_query_errors.inc(operation=op)
+            raise
+        finally:
+            self._record(op, time.perf_counter() - start)
+
+        if response.status_code >= 400:
+            supabase_query_errors.inc(operation=op)
+            try:
+                error = response.json()
+                message, code = error.get("message", response.text), error.get("code")
+            except (ValueError, AttributeError):
+                message, code = response.text, None
+            raise RepositoryError(response.status_code, message, code)
+        return response.json() if response.content else []
+
+    async def _coalesce(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Share one in-flight fetch between all concurrent callers asking for the same key.
+
+        The fetch runs as its own task, so a caller that is cancelled (a client disconnecting) does
+        not cancel it for the others that joined.
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(fetch())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._fetched(key, done))
+        return await asyncio.shield(task)
+
+    def _fetched(self, key: Hashable, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Every caller may have gone away, avoid "exception never retrieved" noise
+        if not task.cancelled():
+            task.exception()
+
+    def _record(self, op: str, seconds: float) -> None:
+        timings = self._timings.setdefault(op, [0, 0.0, 0.0])
+        timings[0] += 1
+        timings[1] += seconds
+        timings[2] = max(timings[2], seconds)
+        supabase_query_seconds.observe(seconds, operation=op)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "coalesced": self.coalesced,
+            "row_cache": self._rows.stats(),
+            "user_cache": self._user_rows.stats(),
+            "queries": {
+                op: {"count": count, "avg_ms": total * 1000 / count, "max_ms": worst * 1000}
+                for op, (count, total, worst) in self._timings.items()
+            },
+        }
+
+    def _invalidate(self, server_id: Optional[str] = None, user_id: Optional[str] = None) -> None:
+        self._writes += 1
+        if server_id is not None:
+            self._rows.pop(server_id)
+        if user_id is not None:
+            self._user_rows.pop(user_id)
+
+    async def ping(self) -> None:
+        """Cheapest query that proves PostgREST and the table are reachable, raises otherwise."""
+        await self._request("ping", "GET", {"select": "id", "limit": "1"})
+
+    async def get(self, server_id: str) -> Optional[Dict[str, Any]]:
+        """Fetch one server row by ID, or None if it does not exist."""
+        row = self._rows.get(server_id)
+        if row is not None:
+            return dict(row)
+
+        writes = self._writes
+        rows = await self._coalesce(("get", server_id), lambda: self._request(
+            "get", "GET", {"select": "*", "id": f"eq.{server_id}"}))
+        if not rows:
+            return None
+        if writes == self._writes:
+            self._rows.set(server_id, rows[0], time.time() + SERVER_CACHE_TTL)
+        return dict(rows[0])
+
+    async def list_for_user(self, user_id: str) -> List[Dict[str, Any]]:
+        """Fetch all servers of a user that have not been deleted."""
+        rows = self._user_rows.get(user_id)
+        if rows is None:
+            writes = self._writes
+            rows = await self._coalesce(("list", user_id), lambda: self._request(
+                "list", "GET", {"select": "*", "user_id": f"eq.{user_id}", "deleted_at": "is.null"}))
+            if writes == self._writes:
+                expires_at = time.time() + SERVER_CACHE_TTL
+                self._user_rows.set(user_id, rows, expires_at)
+                for row in rows:
+                    self._rows.set(row["id"], row, expires_at)
+        return [dict(row) for row in rows]
+
+    async def create(self, user_id: str, name: str, version: str, type: str) -> Dict[str, Any]:
+        """Insert a server row, raising ServerExistsError if the user already has one with that name."""
+        # Invalidate on both sides of the write so no read overlapping it can refill the cache
+        self._invalidate(user_id=user_id)
+        values = {"user_id": user_id, "name": name, "version": version, "type": type}
+        try:
+            if self._upsert:
+                try:
+                    rows = await self._request(
+                        "create", "POST", {"on_conflict": "user_id,name"}, json=values,
+                        headers={"Prefer": "resolution=ignore-duplicates,return=representation"},
+                    )
+                except RepositoryError as e:
+                    if e.code != NO_MATCHING_CONSTRAINT:
+                        raise
+                    logger.warning("The servers table has no unique (user_id, name) constraint, apply the migration "
+                                   "in supabase/migrations. Creating servers with a check and an insert until then.")
+                    self._upsert = False
+            if not self._upsert:
+                rows = await self._insert_unless_named(values)
+        finally:
+            self._invalidate(user_id=user_id)
+        if not rows:
+            raise ServerExistsError(409, "Server with the same name already exists")
+        return rows[0]
+
+    async def _insert_unless_named(self, values: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Insert a server row if the user has none (deleted or not) with its name. Two racing creates may both insert."""
+        existing = await self._request("create_check", "GET", {
+            "select": "id", "user_id": f"eq.{values['user_id']}", "name": f"eq.{values['name']}", "limit": "1"})
+        if existing:
+            return []
+        return await self._request("create", "POST", {}, json=values, headers={"Prefer": "return=representation"})
+
+    async def soft_delete(self, server_id: str, user_id: str) -> None:
+        """Mark a server of the given user as deleted."""
+        self._invalidate(server_id=server_id, user_id=user_id)
+        try:
+            await self._request(
+                "delete", "PATCH", {"id": f"eq.{server_id}", "user_id": f"eq.{user_id}"},
+                json={"deleted_at": datetime.datetime.now(datetime.timezone.utc).isoformat()},
+                headers={"Prefer": "return=minimal"},
+            )
+        finally:
+            self._invalidate(server_id=server_id, user_id=user_id)
+
+
+server_repository = ServerRepository()
@@ -1,32 +1,88 @@
+from scripts.server.services.disk_usage import disk_usage
+from scripts.server.services.docker_hosts import DockerHost, docker_hosts
 from scripts.server.services.docker_service import DockerService
-from scripts.server.models.server import ServerInfo, ServerConfig
-from scripts.server.config import SERVER_HOST_IP, DATA_DIR_TEMPLATE, HOST_PWD
-from typing import Tuple, Optional
+from scripts.server.services.minecraft_ping import server_pinger
+from scripts.server.services.rcon import rcon_password
+from scripts.server.services.sleep_state import sleep_state
+from scripts.server.models.server import ServerInfo, ServerConfig, ServerStatus, ContainerState, ServerPing, ServerDisk
+from scripts.server.config import DATA_DIR_TEMPLATE, HOST_PWD, PING_ENABLED, RCON_PORT
+from typing import Tuple, Optional, Dict, Iterable, Any
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 class ServerService:
     """Service for managing the Minecraft server."""
 
     @staticmethod
-    def get_server_info(server_id: str) -> ServerInfo:
-        """Get comprehensive information about a server."""
-        status, error = DockerService.get_container_status(server_id)
-        port = DockerService.get_container_port(server_id)
+    def info_from_state(state: Optional[ContainerState], ping: Optional[ServerPing] = None,
+                        sleeping: Optional[Dict[str, Any]] = None, host: Optional[DockerHost] = None,
+                        disk: Optional[ServerDisk] = None) -> ServerInfo:
+        """Build the server info shown to users from a container state snapshot and an optional status ping."""
+        host = host or docker_hosts.default
+        # Hibernated servers have no container but keep their address, joining wakes them up
+        if sleeping is not None and (state is None or state.status != "running"):
+            port = str(sleeping["port"])
+            return ServerInfo(status=ServerStatus.SLEEPING, port=port, url=host.address(port), error="", disk=disk)
+
+        status, error = DockerService.status_from_state(state)
+        port = state.port if state and state.status == "running" else None
+
+        # A server answering the ping is up, whatever the (slower) Docker healthcheck says so far
+        if port and ping is not None:
+            status, error = ServerStatus.RUNNING, ""
 
         return ServerInfo(
             status=status,
             port=port,
-            url=f"{SERVER_HOST_IP}:{port}" if port else None,
-            error=error
+            url=host.address(port) if port else None,
+            error=error,
+            ping=ping if port else None,
+            disk=disk
         )
 
     @staticmethod
-    def start_server(config: ServerConfig) -> Tuple[bool, Optional[str]]:
-        """Start a server with the given configuration."""
+    async def get_servers_info_async(server_ids: Iterable[str]) -> Dict[str, ServerInfo]:
+        """Get information about many servers from one container snapshot, with a status ping of the running ones."""
+        server_ids = list(server_ids)
+        try:
+            states = await DockerService.get_container_states_async(server_ids)
+        except Exception as e:
+            logger.error(f"Error listing containers: {e}")
+            return {server_id: ServerInfo(status=ServerStatus.UNKNOWN, error=str(e)) for server_id in server_ids}
 
-        # Create data directory
-        data_dir = DATA_DIR_TEMPLATE.format(base_dir=HOST_PWD, server_id=config.id)
-        os.makedirs(data_dir, exist_ok=True)
+        hosts = {server_id: docker_hosts.host_for(server_id) for server_id in server_ids}
+        pings = {}
+        if PING_ENABLED:
+            pings = await server_pinger.ping_many({
+                server_id: (hosts[server_id].ping_host, int(state.port)) for server_id, state in states.items()
+                if state.status == "running" and state.port
+            })
+        sleeping = await sleep_state.sleeping_async()
+        return {server_id: ServerService.info_from_state(states.get(server_id), pings.get(server_id),
+                                                         sleeping.get(server_id), hosts[server_id],
+                                                         disk_usage.info(server_id))
+                for server_id in server_ids}
+
+    @staticmethod
+    async def get_server_info_async(server_id: str) -> ServerInfo:
+        """Get comprehensive information about a server."""
+        return (await ServerService.get_servers_info_async([server_id]))[server_id]
+
+    @staticmethod
+    def data_dir(server_id: str) -> str:
+        """Host path of a server's data directory."""
+        return DATA_DIR_TEMPLATE.format(base_dir=HOST_PWD, server_id=server_id)
+
+    @staticmethod
+    def prepare_server(config: ServerConfig) -> Tuple[str, Dict[str, str]]:
+        """Create the data directory and build the container environment for a server."""
+
+        # Create data directory, Docker creates it when binding it on remote hosts
+        data_dir = ServerService.data_dir(config.id)
+        if docker_hosts.host_for(config.id).local:
+            os.makedirs(data_dir, exist_ok=True)
 
         # Prepare environment variables
         env_vars = {
@@ -35,16 +91,15 @@ class ServerService:
             "MOTD": config.motd or config.name,
             "VERSION": config.version,
             "TYPE": config.type,
-            "ONLINE_MODE": str(config.online_mode).lower()
+            "ONLINE_MODE": str(config.online_mode).lower(),
+            "ENABLE_RCON": "true",
+            "RCON_PORT": str(RCON_PORT),
+            "RCON_PASSWORD": rcon_password(config.id)
         }
-
-        # Start container
-        port = DockerService.run_container(config.id, env_vars, data_dir)
-        if port:
-            return True, port
-        return False, "Failed to start server"
+        return data_dir, env_vars
 
     @staticmethod
     def stop_server(server_id: str) -> bool:
-        """Stop a server."""
+        """Stop a server, or take it out of hibernation."""
+        sleep_state.release(server_id)
         return DockerService.stop_container(server_id)
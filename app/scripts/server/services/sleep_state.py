@@ -0,0 +1,72 @@
+import socket
+import time
+from typing import Any, Dict, Optional
+
+from scripts.server.config import (
+    HIBERNATE_LISTEN_HOST,
+    HIBERNATE_RELEASE_TIMEOUT,
+    HOST_PWD,
+    SLEEP_STATE_CACHE_TTL,
+    SLEEP_STATE_TEMPLATE,
+)
+from scripts.server.services.executors import run_io
+from scripts.utils.json_state import JSONStateFile
+
+
+def port_is_free(port: int, host: str = HIBERNATE_LISTEN_HOST) -> bool:
+    """Whether nothing is listening on the port, so Docker can publish it."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind((host, port))
+        except OSError:
+            return False
+    return True
+
+
+class SleepState:
+    """
+    Servers stopped for being idle, shared by every worker through a JSON file under the data directory.
+
+    An entry keeps the port its wake-up listener holds, the config to start it with and what the
+    server last answered to pings. Whichever worker holds the hibernation leader lock runs the
+    listeners and opens or closes them to match this file.
+    """
+
+    def __init__(self, path: str = SLEEP_STATE_TEMPLATE.format(base_dir=HOST_PWD)):
+        self._file = JSONStateFile(path, keys=("servers",))
+
+    def sleeping(self) -> Dict[str, Dict[str, Any]]:
+        """{server_id: entry} of every hibernated server."""
+        return self._file.read()["servers"]
+
+    async def sleeping_async(self) -> Dict[str, Dict[str, Any]]:
+        """sleeping() for the event loop. The last read is reused for SLEEP_STATE_CACHE_TTL, then redone on the I/O pool."""
+        state = self._file.recent(SLEEP_STATE_CACHE_TTL)
+        if state is None:
+            state = await run_io(self._file.read)
+        return state["servers"]
+
+    def is_sleeping(self, server_id: str) -> bool:
+        return server_id in self.sleeping()
+
+    def add(self, server_id: str, entry: Dict[str, Any]) -> None:
+        with self._file.locked() as state:
+            state["servers"][server_id] = entry
+
+    def remove(self, server_id: str) -> Optional[Dict[str, Any]]:
+        with self._file.locked() as state:
+            return state["servers"].pop(server_id, None)
+
+    def release(self, server_id: str, timeout: float = HIBERNATE_RELEASE_TIMEOUT) -> bool:
+        """Take a server out of hibernation, waiting until its listener let go of the port. Returns whether it slept."""
+        entry = self.remove(server_id)
+        if entry is None:
+            return False
+        deadline = time.monotonic() + timeout
+        while not port_is_free(entry["port"]) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return True
+
+
+sleep_state = SleepState()
@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Optional, Set, Tuple
+
+from scripts.server.config import (
+    HOST_PWD,
+    MINECRAFT_IMAGE,
+    PING_ENABLED,
+    PING_READY_INTERVAL,
+    START_HEALTH_TIMEOUT,
+    START_JOB_HISTORY,
+    START_JOB_POLL_INTERVAL,
+    START_JOB_STATE_TEMPLATE,
+    START_POLL_INTERVAL,
+)
+from scripts.server.models.server import ContainerState, ServerConfig, StartJob, StartStage
+from scripts.server.services.admission import admission
+from scripts.server.services.container_cache import container_cache
+from scripts.server.services.disk_usage import disk_usage
+from scripts.server.services.docker_backend import get_backend
+from scripts.server.services.docker_hosts import docker_hosts
+from scripts.server.services.docker_service import DockerService
+from scripts.server.services.executors import run_docker, run_io
+from scripts.server.services.minecraft_ping import server_pinger
+from scripts.server.services.server_service import ServerService
+from scripts.server.services.sleep_state import sleep_state
+from scripts.server.services.warm_pool import warm_pool
+from scripts.utils.json_state import JSONStateFile
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STAGES = (StartStage.HEALTHY, StartStage.FAILED)
+
+
+class StartJobManager:
+    """
+    Runs server starts as jobs and publishes their progress.
+
+    A job goes through prepare -> pull -> create -> boot -> healthy (or failed). The healthy
+    stage is reached from the container's health transition as seen by the state cache,
+    not from clients polling the server status.
+
+    The worker running a job also writes its progress to a shared file, so requests for the job
+    that reach another worker are answered from there.
+    """
+
+    def __init__(self, state_path: str = START_JOB_STATE_TEMPLATE.format(base_dir=HOST_PWD)):
+        self._jobs: "OrderedDict[str, StartJob]" = OrderedDict()
+        self._owners: Dict[str, Optional[str]] = {}
+        self._listeners: Dict[str, Set[asyncio.Queue]] = {}
+        self._file = JSONStateFile(state_path, keys=("jobs",))
+        self._dirty: Dict[str, StartJob] = {}
+        self._writer: Optional[asyncio.Task] = None
+
+    def create(self, server_id: str, user_id: Optional[str] = None) -> StartJob:
+        """Register a queued start, the server lifecycle runs it in order with the server's other operations."""
+        now = time.time()
+        job = StartJob(id=uuid.uuid4().hex, server_id=server_id, created_at=now, updated_at=now)
+        self._jobs[job.id] = job
+        self._owners[job.id] = user_id
+        self._publish(job.copy())
+        return job
+
+    def get(self, job_id: str, user_id: Optional[str] = None) -> Optional[StartJob]:
+        """A job of this worker."""
+        job = self._jobs.get(job_id)
+        if job is None or (user_id is not None and self._owners.get(job_id) != user_id):
+            return None
+        return job.copy()
+
+    async def find(self, job_id: str, user_id: Optional[str] = None) -> Optional[StartJob]:
+        """A job of any worker."""
+        if job_id in self._jobs:
+            return self.get(job_id, user_id)
+        shared = await run_io(self._shared, job_id)
+        if shared is None or (user_id is not None and shared[1] != user_id):
+            return None
+        return shared[0]
+
+    async def events(self, job_id: str, heartbeat: Optional[float] = None) -> AsyncIterator[Optional[StartJob]]:
+        """Yield the job now and after every change until it finishes. Yields None every `heartbeat` idle seconds."""
+        job = self._jobs.get(job_id)
+        if job is None:
+            async for snapshot in self._shared_events(job_id, heartbeat):
+                yield snapshot
+            return
+
+        queue: asyncio.Queue = asyncio.Queue()
+        self._listeners.setdefault(job_id, set()).add(queue)
+        try:
+            snapshot = job.copy()
+            yield snapshot
+            while snapshot.stage not in TERMINAL_STAGES:
+                try:
+                    snapshot = await asyncio.wait_for(queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield snapshot
+        finally:
+            listeners = self._listeners.get(job_id)
+            if listeners is not None:
+                listeners.discard(queue)
+                if not listeners:
+                    del self._listeners[job_id]
+
+    async def _shared_events(self, job_id: str, heartbeat: Optional[float]) -> AsyncIterator[Optional[StartJob]]:
+        """events() of a job running on another worker, polled from the shared file."""
+        loop = asyncio.get_running_loop()
+        shared = await run_io(self._shared, job_id)
+        if shared is None:
+            return
+        snapshot = shared[0]
+        yield snapshot
+        idle_since = loop.time()
+        while snapshot.stage not in TERMINAL_STAGES:
+            await asyncio.sleep(START_JOB_POLL_INTERVAL)
+            shared = await run_io(self._shared, job_id)
+            if shared is None:
+                return
+            if shared[0].updated_at != snapshot.updated_at:
+                snapshot = shared[0]
+                idle_since = loop.time()
+                yield snapshot
+            elif heartbeat is not None and loop.time() - idle_since >= heartbeat:
+                idle_since = loop.time()
+                yield None
+
+    async def close(self) -> None:
+        """Write out the last progress of jobs."""
+        if self._writer is not None:
+            await asyncio.gather(self._writer, return_exceptions=True)
+        if self._dirty:
+            await self._write()
+
+    def _update(self, job: StartJob, **changes) -> None:
+        for field, value in changes.items():
+            setattr(job, field, value)
+        job.updated_at = time.time()
+        snapshot = job.copy()
+        for queue in self._listeners.get(job.id, ()):
+            queue.put_nowait(snapshot)
+        self._publish(snapshot)
+
+    def _publish(self, snapshot: StartJob) -> None:
+        # Changes that arrive while a write is running go out together in the next one
+        self._dirty[snapshot.id] = snapshot
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.ensure_future(self._write())
+
+    async def _write(self) -> None:
+        while self._dirty:
+            batch, self._dirty = self._dirty, {}
+            try:
+                await run_io(self._store, batch)
+            except Exception as e:
+                logger.error(f"Error sharing start job progress: {e}")
+
+    def _store(self, batch: Dict[str, StartJob]) -> None:
+        with self._file.locked() as state:
+            jobs = state["jobs"]
+            for job_id, job in batch.items():
+                jobs[job_id] = dict(job.dict(), owner=self._owners.get(job_id))
+            for job_id in sorted(jobs, key=lambda job_id: jobs[job_id]["updated_at"])[:-START_JOB_HISTORY]:
+                del jobs[job_id]
+
+    def _shared(self, job_id: str) -> Optional[Tuple[StartJob, Optional[str]]]:
+        entry = self._file.read()["jobs"].get(job_id)
+        if entry is None:
+            return None
+        return StartJob(**entry), entry.get("owner")
+
+    async def run(self, job: StartJob, config: ServerConfig, user_id: Optional[str] = None) -> bool:
+        """Go through the stages of a created job. Returns whether the server became healthy."""
+        loop = asyncio.get_running_loop()
+        admitted = started = False
+        try:
+            # Started by another worker while this start waited its turn, it only has to become healthy
+            state = await DockerService.get_container_state_async(config.id)
+            if state is not None and state.status == "running":
+                self._update(job, stage=StartStage.BOOT, port=state.port,
+                             url=docker_hosts.host_for(config.id).address(state.port) if state.port else None)
+                await self._wait_healthy(config.id)
+                started = True
+                self._update(job, stage=StartStage.HEALTHY)
+                return started
+
+            disk_usage.check_quota(config.id)
+            # Stays queued until a host has memory for the server, which also places new servers
+            await admission.admit(config, user_id, lambda position, wait: self._update(
+                job, queue_position=position, estimated_wait=wait))
+            admitted = True
+            # Time to healthy is counted from here, without the wait for memory or for the lifecycle queue
+            admitted_at = time.monotonic()
+            host = docker_hosts.host_for(config.id)
+            backend = get_backend(host)
+
+            self._update(job, stage=StartStage.PREPARE, queue_position=None, estimated_wait=None)
+            await run_io(sleep_state.release, config.id)
+            # Templates are on this machine's disk
+            warm = host.local and await run_io(warm_pool.claim, config, ServerService.data_dir(config.id))
+            self._update(job, warm=warm)
+            data_dir, env_vars = await run_io(ServerService.prepare_server, config)
+            if await run_docker(backend.exists, config.id):
+                await run_docker(backend.remove, config.id)
+
+            self._update(job, stage=StartStage.PULL)
+            if not await run_docker(backend.image_exists, MINECRAFT_IMAGE):
+                def on_progress(percent: float) -> None:
+                    loop.call_soon_threadsafe(lambda: self._update(job, progress=percent))
+                await run_docker(backend.pull, MINECRAFT_IMAGE, on_progress)
+
+            self._update(job, stage=StartStage.CREATE, progress=None)
+
+            # The host port is allocated up front, so it is reported as soon as the container exists
+            def on_created(port: int) -> None:
+                loop.call_soon_threadsafe(lambda: self._update(
+                    job, stage=StartStage.BOOT, port=str(port), url=host.address(str(port))))
+            await run_docker(DockerService.launch_container, config.id, env_vars, data_dir, on_created)
+
+            await self._wait_healthy(config.id)
+            warm_pool.record_ready(warm, time.monotonic() - admitted_at)
+            started = True
+            self._update(job, stage=StartStage.HEALTHY)
+        except asyncio.CancelledError:
+            self._update(job, stage=StartStage.FAILED, error="Start cancelled")
+            raise
+        except Exception as e:
+            logger.error(f"Error starting server {config.id}: {e}")
+            self._update(job, stage=StartStage.FAILED, error=str(e))
+        finally:
+            if admitted:
+                await admission.finished(config.id, user_id, started)
+            self._prune()
+        return started
+
+    async def _wait_healthy(self, server_id: str) -> ContainerState:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + START_HEALTH_TIMEOUT
+        while True:
+            state = await DockerService.get_container_state_async(server_id)
+            if state is None or state.status in ("exited", "dead"):
+                raise Exception("Server container exited while starting")
+            # Containers without a healthcheck are ready as soon as they run
+            if state.status == "running" and state.health in (None, "healthy"):
+                return state
+
+            # The healthcheck only runs every few seconds, answering the status ping is ready too
+            probing = PING_ENABLED and state.status == "running" and state.port
+            if probing and await server_pinger.ping(int(state.port), fresh=True,
+                                                    host=docker_hosts.host_for(server_id).ping_host) is not None:
+                return state
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise Exception("Timed out waiting for the server to become healthy")
+            interval = min(START_POLL_INTERVAL, PING_READY_INTERVAL) if probing else START_POLL_INTERVAL
+            await container_cache.wait_for_change(server_id, min(interval, remaining))
+
+    def _prune(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.stage in TERMINAL_STAGES]
+        for job_id in finished[:max(0, len(finished) - START_JOB_HISTORY)]:
+            del self._jobs[job_id]
+            self._owners.pop(job_id, None)
+
+
+start_jobs = StartJobManager()
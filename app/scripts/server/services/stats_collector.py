@@ -0,0 +1,412 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from array import array
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Set, Tuple
+
+from scripts.server.config import (
+    HOST_PWD,
+    PORT_RANGE_END,
+    PORT_RANGE_START,
+    STATS_COARSE_INTERVAL,
+    STATS_COARSE_POINTS,
+    STATS_ENABLED,
+    STATS_FINE_INTERVAL,
+    STATS_FINE_POINTS,
+    STATS_MAX_SERVERS,
+    STATS_RELAY_QUEUE,
+    STATS_RELAY_TEMPLATE,
+    STATS_SUBSCRIBER_QUEUE,
+    STATS_SYNC_INTERVAL,
+)
+from scripts.server.services.container_cache import container_cache
+from scripts.server.services.docker_api import AsyncDockerAPIClient
+from scripts.server.services.docker_hosts import DockerHost, docker_hosts
+from scripts.server.services.executors import run_io
+from scripts.utils.leader_lock import LeaderLock
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("cpu_percent", "memory_bytes", "net_rx_bytes_per_second", "net_tx_bytes_per_second")
+RESOLUTIONS = ("fine", "coarse")
+
+
+def cpu_percent(stats: Dict[str, Any]) -> Optional[float]:
+    """CPU use in percent of one core, as `docker stats` reports it. None without a previous reading."""
+    cpu, precpu = stats.get("cpu_stats") or {}, stats.get("precpu_stats") or {}
+    if not precpu.get("system_cpu_usage"):
+        return None
+    cpu_delta = cpu.get("cpu_usage", {}).get("total_usage", 0) - precpu.get("cpu_usage", {}).get("total_usage", 0)
+    system_delta = cpu.get("system_cpu_usage", 0) - precpu["system_cpu_usage"]
+    if system_delta <= 0:
+        return None
+    cpus = cpu.get("online_cpus") or len(cpu.get("cpu_usage", {}).get("percpu_usage") or ()) or 1
+    return max(0.0, cpu_delta / system_delta * cpus * 100)
+
+
+def memory_usage(stats: Dict[str, Any]) -> Tuple[int, int]:
+    """(used, limit) bytes. Page cache the kernel can drop is not counted, like `docker stats`."""
+    memory = stats.get("memory_stats") or {}
+    details = memory.get("stats") or {}
+    cache = details.get("inactive_file", details.get("total_inactive_file", details.get("cache", 0)))
+    return max(0, memory.get("usage", 0) - cache), memory.get("limit", 0)
+
+
+def network_bytes(stats: Dict[str, Any]) -> Tuple[int, int]:
+    """(received, sent) bytes over all of the container's networks since it started."""
+    networks = list((stats.get("networks") or {}).values())
+    return sum(n.get("rx_bytes", 0) for n in networks), sum(n.get("tx_bytes", 0) for n in networks)
+
+
+def _point(timestamp: int, values: Sequence[float]) -> List[float]:
+    return [timestamp, round(values[0], 2), *(int(value) for value in values[1:])]
+
+
+class _Ring:
+    """Fixed-size ring of points averaged over `interval` seconds, kept in typed arrays (4 bytes a value)."""
+
+    __slots__ = ("interval", "size", "_times", "_values", "_next", "_count", "_bucket", "_sums", "_samples")
+
+    def __init__(self, interval: int, size: int):
+        self.interval = interval
+        self.size = size
+        self._times = array("I", bytes(4 * size))
+        self._values = [array("f", bytes(4 * size)) for _ in FIELDS]
+        self._next = 0
+        self._count = 0
+        # The interval in progress, written to the ring once a sample of the next one arrives
+        self._bucket: Optional[int] = None
+        self._sums = [0.0] * len(FIELDS)
+        self._samples = 0
+
+    def add(self, timestamp: float, values: Sequence[float]) -> None:
+        bucket = int(timestamp) // self.interval * self.interval
+        if self._bucket is not None and bucket != self._bucket:
+            self._flush()
+        self._bucket = bucket
+        for i, value in enumerate(values):
+            self._sums[i] += value
+        self._samples += 1
+
+    def _flush(self) -> None:
+        self._times[self._next] = self._bucket
+        for i, total in enumerate(self._sums):
+            self._values[i][self._next] = total / self._samples
+        self._next = (self._next + 1) % self.size
+        self._count = min(self._count + 1, self.size)
+        self._sums = [0.0] * len(FIELDS)
+        self._samples = 0
+
+    def load(self, points: List[List[float]]) -> None:
+        """Take over points of another ring of the same interval, the last one as the interval in progress."""
+        for point in points:
+            if self._samples:
+                self._flush()
+            self._bucket = int(point[0])
+            self._sums = [float(value) for value in point[1:]]
+            self._samples = 1
+
+    def points(self, since: float = 0) -> List[List[float]]:
+        """Points from oldest to newest as [time, *FIELDS], the interval in progress last."""
+        points = []
+        for offset in range(self._count):
+            index = (self._next - self._count + offset) % self.size
+            if self._times[index] >= since:
+                points.append(_point(self._times[index], [values[index] for values in self._values]))
+        if self._samples and self._bucket >= since:
+            points.append(_point(self._bucket, [total / self._samples for total in self._sums]))
+        return points
+
+
+class _Series:
+    __slots__ = ("fine", "coarse", "memory_limit")
+
+    def __init__(self):
+        self.fine = _Ring(STATS_FINE_INTERVAL, STATS_FINE_POINTS)
+        self.coarse = _Ring(STATS_COARSE_INTERVAL, STATS_COARSE_POINTS)
+        self.memory_limit = 0
+
+
+class StatsSubscription:
+    """One live stats viewer. Only the latest samples are queued, the oldest is dropped when it falls behind."""
+
+    def __init__(self, server_id: str):
+        self.server_id = server_id
+        self.dropped = 0
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=STATS_SUBSCRIBER_QUEUE)
+
+    def _push(self, message: Optional[str]) -> None:
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(message)
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        while True:
+            message = await self._queue.get()
+            if message is None:
+                return
+            yield message
+
+
+class StatsCollector:
+    """
+    CPU, memory and network use of running servers, from one Docker stats stream per container.
+
+    Samples (about one a second) are averaged into two fixed-size rings per server, a fine one of
+    STATS_FINE_POINTS x STATS_FINE_INTERVAL seconds and a coarse one of STATS_COARSE_POINTS x
+    STATS_COARSE_INTERVAL seconds. At most STATS_MAX_SERVERS series are kept and live viewers get
+    the same encoded sample through small drop-oldest queues, so memory is bounded by configuration.
+
+    Only the worker holding the leader lock follows the containers. It relays every sample to the
+    other workers over a Unix socket, after the series it has so far, and each worker keeps the
+    same rings from them.
+    """
+
+    def __init__(self, relay_path: str = STATS_RELAY_TEMPLATE.format(base_dir=HOST_PWD)):
+        self._series: "OrderedDict[str, _Series]" = OrderedDict()
+        self._streams: Dict[str, asyncio.Task] = {}
+        self._subscribers: Dict[str, Set[StatsSubscription]] = {}
+        self._clients: Dict[str, AsyncDockerAPIClient] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._relay_path = relay_path
+        self._leader = LeaderLock(relay_path + ".leader")
+        self._relay_server: Optional[asyncio.AbstractServer] = None
+        self._relays: Set[asyncio.Queue] = set()
+        self._relay_tasks: Set[asyncio.Task] = set()
+        self._follower: Optional[asyncio.Task] = None
+
+        self.samples = 0
+
+    async def start(self) -> None:
+        if not STATS_ENABLED or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        if self._relay_server is not None:
+            self._relay_server.close()
+            self._relay_server = None
+        # Relays end on None, cancelling them is reported by asyncio as an error of the connection
+        for queue in list(self._relays):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(None)
+        self._relays.clear()
+        if self._relay_tasks:
+            await asyncio.wait(self._relay_tasks, timeout=1)
+        tasks = [self._task, *self._streams.values(), *self._relay_tasks]
+        if self._follower is not None:
+            tasks.append(self._follower)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = self._follower = None
+        self._streams.clear()
+        self._leader.release()
+        for subscribers in self._subscribers.values():
+            for subscription in subscribers:
+                subscription._push(None)
+        self._subscribers.clear()
+        for client in self._clients.values():
+            await client.close()
+        self._clients.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "leader": self._leader.held,
+            "relays": len(self._relays),
+            "streams": len(self._streams),
+            "series": len(self._series),
+            "subscribers": sum(len(subscribers) for subscribers in self._subscribers.values()),
+            "samples": self.samples,
+        }
+
+    def history(self, server_id: str, resolution: str = "fine", since: float = 0) -> Dict[str, Any]:
+        """Recorded points of a server at one of RESOLUTIONS, empty if it has not run lately."""
+        series = self._series.get(server_id)
+        ring = getattr(series, resolution) if series is not None else None
+        return {
+            "interval": STATS_FINE_INTERVAL if resolution == "fine" else STATS_COARSE_INTERVAL,
+            "fields": ["time", *FIELDS],
+            "memory_limit_bytes": series.memory_limit if series is not None else None,
+            "points": ring.points(since) if ring is not None else [],
+        }
+
+    def subscribe(self, server_id: str) -> StatsSubscription:
+        """Live samples of a server, from whenever it runs until unsubscribe()."""
+        subscription = StatsSubscription(server_id)
+        self._subscribers.setdefault(server_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: StatsSubscription) -> None:
+        subscribers = self._subscribers.get(subscription.server_id)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._subscribers[subscription.server_id]
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if self._leader.held or await run_io(self._leader.try_acquire):
+                    await self._lead()
+                    self._sync()
+                elif self._follower is None or self._follower.done():
+                    self._follower = asyncio.create_task(self._follow_leader())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error syncing stats streams: {e}")
+            await asyncio.sleep(STATS_SYNC_INTERVAL)
+
+    async def _lead(self) -> None:
+        if self._relay_server is not None:
+            return
+        logger.info("This worker now follows container stats")
+        if self._follower is not None:
+            self._follower.cancel()
+            self._follower = None
+        # A socket left by the previous leader is replaced
+        if os.path.exists(self._relay_path):
+            os.remove(self._relay_path)
+        self._relay_server = await asyncio.start_unix_server(self._relay, path=self._relay_path)
+
+    async def _relay(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Send another worker the series so far, then every sample."""
+        task = asyncio.current_task()
+        self._relay_tasks.add(task)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=STATS_RELAY_QUEUE)
+        self._relays.add(queue)
+        try:
+            for server_id, series in list(self._series.items()):
+                writer.write(json.dumps({
+                    "id": server_id,
+                    "fine": series.fine.points(),
+                    "coarse": series.coarse.points(),
+                    "memory_limit": series.memory_limit,
+                }).encode() + b"\n")
+                await writer.drain()
+            while True:
+                message = await queue.get()
+                if message is None:
+                    # Fell behind, it reconnects and starts over from the series
+                    return
+                writer.write(message)
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self._relays.discard(queue)
+            self._relay_tasks.discard(task)
+            writer.close()
+
+    async def _follow_leader(self) -> None:
+        try:
+            reader, writer = await asyncio.open_unix_connection(self._relay_path, limit=1 << 24)
+        except OSError:
+            # No leader yet, tried again at the next sync
+            return
+        try:
+            self._series.clear()
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                message = json.loads(line)
+                if "fine" in message:
+                    self._load(message)
+                else:
+                    self._record(message["id"], message["time"], tuple(message["values"]), message["memory_limit"])
+        except (ConnectionError, OSError, ValueError) as e:
+            logger.warning(f"Lost the stats relay: {e}")
+        finally:
+            writer.close()
+
+    def _load(self, message: Dict[str, Any]) -> None:
+        series = self._series[message["id"]] = _Series()
+        series.fine.load(message["fine"])
+        series.coarse.load(message["coarse"])
+        series.memory_limit = message["memory_limit"]
+        if len(self._series) > STATS_MAX_SERVERS:
+            self._series.popitem(last=False)
+
+    def _sync(self) -> None:
+        """Follow every running server, stop following stopped ones. Failed streams are retried here."""
+        if not container_cache.live:
+            return
+        running = {state.id: docker_hosts.get(state.host) if state.host else docker_hosts.default
+                   for state in container_cache.running() if PORT_RANGE_START <= int(state.port) <= PORT_RANGE_END}
+        for server_id in list(self._streams):
+            if server_id not in running:
+                self._streams.pop(server_id).cancel()
+        for server_id, host in running.items():
+            task = self._streams.get(server_id)
+            if task is None or task.done():
+                self._streams[server_id] = asyncio.create_task(self._follow(server_id, host))
+
+    async def _follow(self, server_id: str, host: DockerHost) -> None:
+        client = self._clients.get(host.name)
+        if client is None:
+            client = self._clients[host.name] = AsyncDockerAPIClient(host.endpoint)
+
+        previous: Optional[Tuple[float, int, int]] = None
+        try:
+            async for stats in client.stream_json(f"/containers/{server_id}/stats", params={"stream": "1"}):
+                now = time.time()
+                cpu = cpu_percent(stats)
+                received, sent = network_bytes(stats)
+                if cpu is not None and previous is not None and now > previous[0]:
+                    elapsed = now - previous[0]
+                    used, limit = memory_usage(stats)
+                    # Counters restart with the container, a drop is not negative traffic
+                    rates = (max(0, received - previous[1]) / elapsed, max(0, sent - previous[2]) / elapsed)
+                    self._record(server_id, now, (cpu, used, *rates), limit)
+                previous = (now, received, sent)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Stats stream of {server_id} failed: {e}")
+
+    def _record(self, server_id: str, timestamp: float, values: Tuple[float, ...], memory_limit: int) -> None:
+        series = self._series.get(server_id)
+        if series is None:
+            series = self._series[server_id] = _Series()
+            if len(self._series) > STATS_MAX_SERVERS:
+                self._series.popitem(last=False)
+        else:
+            self._series.move_to_end(server_id)
+        series.fine.add(timestamp, values)
+        series.coarse.add(timestamp, values)
+        series.memory_limit = memory_limit
+        self.samples += 1
+
+        if self._relays:
+            relayed = json.dumps({"id": server_id, "time": timestamp, "values": values,
+                                  "memory_limit": memory_limit}).encode() + b"\n"
+            for queue in list(self._relays):
+                if queue.full():
+                    # Dropped, None ends its connection
+                    self._relays.discard(queue)
+                    queue.get_nowait()
+                    queue.put_nowait(None)
+                else:
+                    queue.put_nowait(relayed)
+
+        subscribers = self._subscribers.get(server_id)
+        if subscribers:
+            # Encoded once, every viewer queues the same string
+            sample = dict(zip(FIELDS, _point(int(timestamp), values)[1:]), time=round(timestamp, 3),
+                          memory_limit_bytes=memory_limit)
+            message = json.dumps(sample)
+            for subscription in list(subscribers):
+                subscription._push(message)
+
+
+stats_collector = StatsCollector()
@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import os
+import re
+import shutil
+import statistics
+import time
+import uuid
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from scripts.server.config import (
+    HOST_PWD,
+    MINECRAFT_IMAGE,
+    TEMPLATE_DIR_TEMPLATE,
+    WARM_POOL_CLAIM_INTERVAL,
+    WARM_POOL_ENABLED,
+    WARM_POOL_HISTORY,
+    WARM_POOL_INTERVAL,
+    WARM_POOL_PAIRS,
+    WARM_POOL_SETUP_TIMEOUT,
+    WARM_POOL_SLOTS,
+)
+from scripts.server.models.server import ServerConfig
+from scripts.server.services.docker_backend import get_backend
+from scripts.server.services.docker_hosts import docker_hosts
+from scripts.server.services.executors import run_docker, run_io
+from scripts.utils.json_state import JSONStateFile
+from scripts.utils.leader_lock import LeaderLock
+from scripts.utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+Pair = Tuple[str, str]
+READY_PREFIX = "ready-"
+BUILDING_PREFIX = "building-"
+
+start_healthy_seconds = registry.histogram(
+    "server_start_healthy_seconds", "Time from admission to a healthy container, by warm or cold data directory",
+    ["kind"], buckets=(1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 45.0, 60.0, 90.0, 120.0, 180.0, 300.0))
+
+
+def _slug(pair: Pair) -> str:
+    return re.sub(r"[^a-z0-9_.-]", "_", f"{pair[0]}-{pair[1]}".lower())
+
+
+class WarmPool:
+    """
+    Keeps the server image pulled and pre-initialized data templates for the most started TYPE/VERSION pairs.
+
+    A template is a data directory the image has already set up (server jar, libraries) by running
+    with SETUP_ONLY. Starting a new server with an empty data directory claims a matching template by
+    renaming it into place, skipping the download on first boot.
+
+    Every worker claims templates and records its starts in a shared file, only the worker holding
+    the leader lock builds and drops them.
+    """
+
+    def __init__(self, base_dir: str = TEMPLATE_DIR_TEMPLATE.format(base_dir=HOST_PWD)):
+        self._base_dir = base_dir
+        self._history = JSONStateFile(os.path.join(base_dir, "starts.json"))
+        self._leader = LeaderLock(os.path.join(base_dir, ".leader"))
+        self._ready: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._durations: Dict[str, Deque[float]] = {"warm": deque(maxlen=500), "cold": deque(maxlen=500)}
+
+        self.claims = 0
+        self.misses = 0
+
+    async def start(self) -> None:
+        if not WARM_POOL_ENABLED or self._task is not None:
+            return
+        if not docker_hosts.default.local:
+            # Templates are built into and claimed from this machine's disk
+            logger.info("Warm pool disabled, the first Docker host is not local")
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._leader.release()
+
+    def claim(self, config: ServerConfig, data_dir: str) -> bool:
+        """Move a ready template into an empty data directory. Returns whether one was claimed."""
+        pair = (config.type, config.version)
+        with self._history.locked() as state:
+            starts = state.setdefault("starts", [])
+            starts.append(list(pair))
+            del starts[:-WARM_POOL_HISTORY]
+        if os.path.isdir(data_dir) and os.listdir(data_dir):
+            return False
+
+        claimed = False
+        os.makedirs(os.path.dirname(data_dir), exist_ok=True)
+        if os.path.isdir(data_dir):
+            os.rmdir(data_dir)
+        for slot in self._ready_slots(pair):
+            try:
+                os.rename(slot, data_dir)
+            except FileNotFoundError:
+                # Claimed by another start first
+                continue
+            claimed = True
+            break
+        if not claimed:
+            self.misses += 1
+            return False
+        self.claims += 1
+        with self._history.locked() as state:
+            state["claims"] = state.get("claims", 0) + 1
+
+        if self._loop is not None:
+            # Refill soon rather than at the next interval, claim runs on an executor thread
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        return True
+
+    def record_ready(self, warm: bool, seconds: float) -> None:
+        """Record how long an admitted start took to a healthy container, the queue wait is not part of it."""
+        kind = "warm" if warm else "cold"
+        self._durations[kind].append(seconds)
+        start_healthy_seconds.observe(seconds, kind=kind)
+
+    def popular_pairs(self) -> List[Pair]:
+        """Most started pairs of every worker. Reads the shared history, run it off the loop."""
+        starts = self._history.read().get("starts", [])
+        return [pair for pair, _ in Counter(tuple(pair) for pair in starts).most_common(WARM_POOL_PAIRS)]
+
+    def stats(self) -> Dict[str, Any]:
+        def summary(samples: Deque[float]) -> Dict[str, Any]:
+            ordered = sorted(samples)
+            return {
+                "count": len(ordered),
+                "p50_s": statistics.median(ordered) if ordered else None,
+                "p95_s": ordered[int(len(ordered) * 0.95) - 1] if len(ordered) >= 20 else None,
+            }
+
+        return {
+            "claims": self.claims,
+            "misses": self.misses,
+            "leader": self._leader.held,
+            "ready": dict(self._ready),
+            "time_to_healthy": {kind: summary(samples) for kind, samples in self._durations.items()},
+        }
+
+    def _pair_dir(self, pair: Pair) -> str:
+        return os.path.join(self._base_dir, _slug(pair))
+
+    def _ready_slots(self, pair: Pair) -> List[str]:
+        pair_dir = self._pair_dir(pair)
+        if not os.path.isdir(pair_dir):
+            return []
+        return sorted(os.path.join(pair_dir, name) for name in os.listdir(pair_dir) if name.startswith(READY_PREFIX))
+
+    def _claims(self) -> int:
+        return self._history.read().get("claims", 0)
+
+    async def _run(self) -> None:
+        claims = None
+        refilled_at = 0.0
+        while True:
+            try:
+                # Claims in any worker count, the leader notices them through the shared file
+                if await run_io(self._leader.try_acquire):
+                    seen = await run_io(self._claims)
+                    if seen != claims or time.monotonic() - refilled_at >= WARM_POOL_INTERVAL:
+                        claims, refilled_at = seen, time.monotonic()
+                        await self._refill()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error refilling warm pool: {e}")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), WARM_POOL_CLAIM_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _refill(self) -> None:
+        backend = get_backend()
+        if not await run_docker(backend.image_exists, MINECRAFT_IMAGE):
+            logger.info(f"Pre-pulling {MINECRAFT_IMAGE}")
+            await run_docker(backend.pull, MINECRAFT_IMAGE)
+
+        pairs = await run_io(self.popular_pairs)
+        await run_io(self._drop_unpopular, pairs)
+        for pair in pairs:
+            try:
+                while len(await run_io(self._ready_slots, pair)) < WARM_POOL_SLOTS:
+                    await self._build_slot(pair)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # A bad pair (unknown version, say) must not keep the others cold
+                logger.error(f"Error building warm template for {pair[0]} {pair[1]}: {e}")
+        self._ready = {_slug(pair): len(await run_io(self._ready_slots, pair)) for pair in pairs}
+
+    def _drop_unpopular(self, pairs: List[Pair]) -> None:
+        if not os.path.isdir(self._base_dir):
+            return
+        keep = {_slug(pair) for pair in pairs}
+        for name in os.listdir(self._base_dir):
+            path = os.path.join(self._base_dir, name)
+            if os.path.isdir(path) and name not in keep:
+                shutil.rmtree(path, ignore_errors=True)
+
+    async def _build_slot(self, pair: Pair) -> None:
+        slot_id = uuid.uuid4().hex[:12]
+        building = os.path.join(self._pair_dir(pair), BUILDING_PREFIX + slot_id)
+        container_id = f"warm-{_slug(pair)}-{slot_id}"
+        await run_io(os.makedirs, building, exist_ok=True)
+
+        backend = get_backend()
+        env_vars = {"EULA": "TRUE", "TYPE": pair[0], "VERSION": pair[1], "SETUP_ONLY": "true"}
+        logger.info(f"Building warm template for {pair[0]} {pair[1]}")
+        try:
+            await run_docker(backend.create, container_id, MINECRAFT_IMAGE, env_vars, building, [])
+            await run_docker(backend.start, container_id)
+
+            deadline = time.monotonic() + WARM_POOL_SETUP_TIMEOUT
+            while True:
+                state = await run_docker(backend.inspect, container_id)
+                if state is None or state.status in ("exited", "dead"):
+                    break
+                if time.monotonic() > deadline:
+                    raise Exception("Timed out initializing template")
+                await asyncio.sleep(2)
+
+            if not any(name.endswith(".jar") for name in await run_io(os.listdir, building)):
+                raise Exception("Template setup produced no server jar")
+            await run_io(os.rename, building, os.path.join(self._pair_dir(pair), READY_PREFIX + slot_id))
+        except BaseException:
+            await run_io(shutil.rmtree, building, True)
+            raise
+        finally:
+            if await run_docker(backend.exists, container_id):
+                await run_docker(backend.remove, container_id)
+
+
+warm_pool = WarmPool()
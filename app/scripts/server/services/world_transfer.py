@@ -0,0 +1,514 @@
+import asyncio
+import bisect
+import ctypes
+import ctypes.util
+import hashlib
+import os
+import secrets
+import shutil
+import struct
+import tarfile
+import time
+import zipfile
+import zlib
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from scripts.server.config import (
+    DATA_DIR_TEMPLATE,
+    HOST_PWD,
+    WORLD_CHUNK_BYTES,
+    WORLD_UPLOAD_MAX_BYTES,
+    WORLD_UPLOAD_MAX_EXTRACTED_BYTES,
+    WORLD_UPLOAD_MAX_FILES,
+    WORLD_ZIP_LEVEL,
+)
+from scripts.server.services.backups import backup_store, scan
+from scripts.server.services.disk_usage import disk_usage
+from scripts.server.services.docker_hosts import docker_hosts
+from scripts.server.services.executors import run_transfer, transfer_executor
+from scripts.server.services.lifecycle import LifecycleError, lifecycle
+from scripts.utils.leader_lock import LeaderLock
+
+BLOCK = tarfile.BLOCKSIZE
+UPLOAD_QUEUE = 8  # body chunks buffered between the request and the extracting thread
+ZIP_LOCAL_HEADER = b"PK\x03\x04"
+ZIP_DIRECTORY = (b"PK\x01\x02", b"PK\x05\x06", b"PK\x06\x06")
+ZIP_DESCRIPTOR = b"PK\x07\x08"
+ZIP_EPOCH = 315532800  # 1980-01-01, the earliest time a zip entry can have
+AT_FDCWD = -100
+RENAME_EXCHANGE = 2
+
+
+class TransferError(Exception):
+    """Raised when a world cannot be downloaded or an upload is refused."""
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    First and last byte of a single `bytes=` range, None to send everything (no header, several
+    ranges or another unit). Raises ValueError when the range lies past the end.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[6:].strip().partition("-")
+    try:
+        if not first:
+            start, end = max(0, size - int(last)), size - 1
+        else:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise ValueError(f"Range not satisfiable, the archive is {size} bytes")
+    return start, end
+
+
+class TarArchive:
+    """
+    Uncompressed tar of a data directory, laid out from the file listing before anything is read.
+
+    Its size is known up front and any byte range can be produced without the bytes before it,
+    which makes downloads resumable. Files that change size while they are sent are cut or padded
+    with zeros to the listed size, the ETag changes with the listing so stale ranges are refused.
+    """
+
+    def __init__(self, data_dir: str, files: Dict[str, Tuple[int, int, int]]):
+        self.data_dir = data_dir
+        self._entries: List[Tuple[int, bytes, str, int]] = []
+        offset = 0
+        for path in sorted(files):
+            size, mtime_ns, mode = files[path]
+            info = tarfile.TarInfo(path)
+            info.size = size
+            info.mtime = mtime_ns // 1_000_000_000
+            info.mode = mode & 0o7777
+            header = info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+            self._entries.append((offset, header, path, size))
+            offset += len(header) + size + (-size % BLOCK)
+        self._offsets = [entry[0] for entry in self._entries]
+        # Two zero blocks end the archive
+        self.size = offset + 2 * BLOCK
+        listing = repr(sorted(files.items())).encode()
+        self.etag = '"' + hashlib.sha1(listing).hexdigest() + '"'
+
+    async def read(self, start: int, end: int) -> AsyncIterator[bytes]:
+        """Bytes `start` to `end` (inclusive) of the archive, at most WORLD_CHUNK_BYTES at a time."""
+        position, stop = start, end + 1
+        index = max(0, bisect.bisect_right(self._offsets, start) - 1)
+        for offset, header, path, size in self._entries[index:]:
+            if position >= stop:
+                return
+            data_start = offset + len(header)
+            data_end = data_start + size
+            entry_end = data_end + (-size % BLOCK)
+            if position < data_start:
+                piece_end = min(data_start, stop)
+                yield header[position - offset:piece_end - offset]
+                position = piece_end
+            if position < min(data_end, stop):
+                async for chunk in self._file(path, position - data_start, min(data_end, stop) - position):
+                    yield chunk
+                position = min(data_end, stop)
+            if position < min(entry_end, stop):
+                yield bytes(min(entry_end, stop) - position)
+                position = min(entry_end, stop)
+        if position < stop:
+            yield bytes(stop - position)
+
+    async def _file(self, path: str, skip: int, length: int) -> AsyncIterator[bytes]:
+        try:
+            f = await run_transfer(open, os.path.join(self.data_dir, path), "rb")
+        except FileNotFoundError:
+            f = None
+        try:
+            if f is not None and skip:
+                await run_transfer(f.seek, skip)
+            while length > 0:
+                chunk = await run_transfer(f.read, min(length, WORLD_CHUNK_BYTES)) if f is not None else b""
+                if not chunk:
+                    # Shrunk or deleted since the listing, the header promised `length` more bytes
+                    chunk = bytes(min(length, WORLD_CHUNK_BYTES))
+                length -= len(chunk)
+                yield chunk
+        finally:
+            if f is not None:
+                f.close()
+
+
+class _Sink:
+    """Write-only stream ZipFile writes into, emptied after every step. ZipFile sees it cannot seek."""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._position = 0
+
+    def write(self, data: bytes) -> int:
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def _zip_copy(source, entry) -> bool:
+    """Compress the next piece of a file into its zip entry. False once the file is done."""
+    chunk = source.read(WORLD_CHUNK_BYTES)
+    if chunk:
+        entry.write(chunk)
+    return bool(chunk)
+
+
+async def zip_stream(data_dir: str, files: Dict[str, Tuple[int, int, int]]) -> AsyncIterator[bytes]:
+    """Deflated zip of a data directory, compressed on the transfer pool one piece at a time."""
+    sink = _Sink()
+    archive = zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED, compresslevel=WORLD_ZIP_LEVEL)
+    for path in sorted(files):
+        size, mtime_ns, mode = files[path]
+        info = zipfile.ZipInfo(path, time.localtime(max(mtime_ns // 1_000_000_000, ZIP_EPOCH))[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        # ZipFile.open() only applies the archive's level to entries it creates itself
+        info._compresslevel = WORLD_ZIP_LEVEL
+        info.file_size = size
+        info.external_attr = (mode & 0xFFFF) << 16
+        try:
+            source = await run_transfer(open, os.path.join(data_dir, path), "rb")
+        except FileNotFoundError:
+            continue
+        try:
+            entry = await run_transfer(archive.open, info, "w")
+            while await run_transfer(_zip_copy, source, entry):
+                yield sink.take()
+            await run_transfer(entry.close)
+        finally:
+            source.close()
+        yield sink.take()
+    await run_transfer(archive.close)
+    yield sink.take()
+
+
+class _BodyReader:
+    """
+    Blocking file-like view of a request body for the extracting thread. Chunks arrive through a
+    small queue, so the client is only read as fast as the archive is extracted.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=UPLOAD_QUEUE)
+        self._buffer = b""
+        self._eof = False
+        self.complete = False
+        self.received = 0
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._buffer and not self._eof:
+            chunk = asyncio.run_coroutine_threadsafe(self.queue.get(), self._loop).result()
+            if chunk is None:
+                self._eof = True
+            else:
+                self._buffer = chunk
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def read_exact(self, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            chunk = self.read(size - len(data))
+            if not chunk:
+                raise TransferError("The archive ends early")
+            data += chunk
+        return data
+
+    def unread(self, data: bytes) -> None:
+        self._buffer = data + self._buffer
+
+
+class _Extractor:
+    """Writes archive members into a staging directory, enforcing the upload limits."""
+
+    def __init__(self, staging: str, max_bytes: int):
+        self.staging = staging
+        self.max_bytes = max_bytes
+        self.files = 0
+        self.bytes = 0
+
+    def target(self, name: str) -> str:
+        parts = [part for part in name.replace("\\", "/").split("/") if part not in ("", ".")]
+        if name.startswith("/") or ".." in parts or (parts and ":" in parts[0]):
+            raise TransferError(f"Unsafe path in the archive: {name}")
+        self.files += 1
+        if self.files > WORLD_UPLOAD_MAX_FILES:
+            raise TransferError(f"The archive has more than {WORLD_UPLOAD_MAX_FILES} files")
+        return os.path.join(self.staging, *parts)
+
+    def directory(self, name: str) -> None:
+        os.makedirs(self.target(name), exist_ok=True)
+
+    def open(self, name: str):
+        path = self.target(name)
+        if path == self.staging:
+            raise TransferError(f"Unsafe path in the archive: {name}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return open(path, "wb")
+
+    def written(self, size: int) -> None:
+        self.bytes += size
+        if self.bytes > self.max_bytes:
+            raise TransferError(f"The archive unpacks to more than {self.max_bytes} bytes")
+
+
+def _extract_tar(reader: _BodyReader, extractor: _Extractor) -> None:
+    # Stream mode reads the body once front to back, compression is detected
+    with tarfile.open(fileobj=reader, mode="r|*") as archive:
+        for member in archive:
+            if member.isdir():
+                extractor.directory(member.name)
+            elif member.isreg():
+                source = archive.extractfile(member)
+                with extractor.open(member.name) as f:
+                    while True:
+                        chunk = source.read(WORLD_CHUNK_BYTES)
+                        if not chunk:
+                            break
+                        extractor.written(len(chunk))
+                        f.write(chunk)
+            # Links and devices are left out, they could point outside the directory
+
+
+def _zip64_sizes(extra: bytes, size: int, compressed: int) -> Tuple[int, int, bool]:
+    """Sizes from a zip64 extra field where the header has 0xFFFFFFFF placeholders."""
+    offset = 0
+    while offset + 4 <= len(extra):
+        tag, length = struct.unpack_from("<HH", extra, offset)
+        if tag == 1:
+            values = list(struct.unpack_from(f"<{length // 8}Q", extra, offset + 4))
+            if size == 0xFFFFFFFF and values:
+                size = values.pop(0)
+            if compressed == 0xFFFFFFFF and values:
+                compressed = values.pop(0)
+            return size, compressed, True
+        offset += 4 + length
+    return size, compressed, False
+
+
+def _extract_zip(reader: _BodyReader, extractor: _Extractor) -> None:
+    """
+    Extract a zip from its local headers as it streams in, the central directory at the end is
+    not needed. Entries written with a data descriptor must be deflated, their end is found by
+    the deflate stream ending.
+    """
+    while True:
+        signature = reader.read_exact(4)
+        if signature in ZIP_DIRECTORY:
+            return
+        if signature != ZIP_LOCAL_HEADER:
+            raise TransferError("Not a zip archive or a damaged one")
+        _, flags, method, _, _, crc, compressed, size, name_length, extra_length = \
+            struct.unpack("<HHHHHIIIHH", reader.read_exact(26))
+        name = reader.read_exact(name_length).decode("utf-8" if flags & 0x800 else "cp437")
+        size, compressed, zip64 = _zip64_sizes(reader.read_exact(extra_length), size, compressed)
+        descriptor = bool(flags & 0x08)
+        if flags & 0x01:
+            raise TransferError("Encrypted zip archives are not supported")
+        if method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED) or (descriptor and method == zipfile.ZIP_STORED):
+            raise TransferError(f"Unsupported compression of {name} in the zip archive")
+
+        if name.endswith("/"):
+            extractor.directory(name)
+            f = None
+        else:
+            f = extractor.open(name)
+        try:
+            checksum = 0
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS) if method == zipfile.ZIP_DEFLATED else None
+            remaining = compressed
+            while descriptor or remaining > 0:
+                chunk = reader.read(WORLD_CHUNK_BYTES if descriptor else min(remaining, WORLD_CHUNK_BYTES))
+                if not chunk:
+                    raise TransferError("The archive ends early")
+                remaining -= len(chunk)
+                if decompressor is not None:
+                    # Bounded output, a few compressed bytes can unpack to a lot
+                    data = decompressor.decompress(chunk, WORLD_CHUNK_BYTES)
+                    while data:
+                        extractor.written(len(data))
+                        checksum = zlib.crc32(data, checksum)
+                        if f is not None:
+                            f.write(data)
+                        data = decompressor.decompress(decompressor.unconsumed_tail, WORLD_CHUNK_BYTES)
+                    if decompressor.eof:
+                        reader.unread(decompressor.unused_data)
+                        break
+                else:
+                    extractor.written(len(chunk))
+                    checksum = zlib.crc32(chunk, checksum)
+                    if f is not None:
+                        f.write(chunk)
+        finally:
+            if f is not None:
+                f.close()
+
+        if descriptor:
+            # CRC and sizes after the data, the signature in front of them is optional
+            field = reader.read_exact(4)
+            if field == ZIP_DESCRIPTOR:
+                field = reader.read_exact(4)
+            crc = struct.unpack("<I", field)[0]
+            reader.read_exact(16 if zip64 else 8)
+        if checksum != crc:
+            raise TransferError(f"{name} is damaged in the zip archive")
+
+
+def _extract(reader: _BodyReader, staging: str, max_bytes: int) -> Dict[str, int]:
+    extractor = _Extractor(staging, max_bytes)
+    os.makedirs(staging)
+    head = reader.read_exact(4)
+    reader.unread(head)
+    if head == ZIP_LOCAL_HEADER:
+        _extract_zip(reader, extractor)
+    else:
+        try:
+            _extract_tar(reader, extractor)
+        except tarfile.TarError as e:
+            raise TransferError(f"Not a tar or zip archive or a damaged one: {e}")
+    # Whatever follows the members (zip directory, tar padding) is read so the body ends cleanly
+    while reader.read(WORLD_CHUNK_BYTES):
+        pass
+    return {"files": extractor.files, "bytes": extractor.bytes}
+
+
+_libc = None
+
+
+def _exchange(first: str, second: str) -> None:
+    """Swap two directories in one step where the kernel can, with three renames where it cannot."""
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    renameat2 = getattr(_libc, "renameat2", None)
+    if renameat2 is not None and renameat2(AT_FDCWD, first.encode(), AT_FDCWD, second.encode(), RENAME_EXCHANGE) == 0:
+        return
+    parked = f"{first}.parked"
+    os.rename(second, parked)
+    os.rename(first, second)
+    os.rename(parked, first)
+
+
+class WorldTransfers:
+    """Download and upload of server data directories on local Docker hosts."""
+
+    def __init__(self):
+        self.downloads = 0
+        self.uploads = 0
+        self.active = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {"active": self.active, "downloads": self.downloads, "uploads": self.uploads}
+
+    @staticmethod
+    def _data_dir(server_id: str) -> str:
+        if not docker_hosts.host_for(server_id).local:
+            raise TransferError("The server's world is on another host")
+        data_dir = DATA_DIR_TEMPLATE.format(base_dir=HOST_PWD, server_id=server_id)
+        if not os.path.isdir(data_dir):
+            raise TransferError("The server has no world yet")
+        return data_dir
+
+    async def listing(self, server_id: str) -> Tuple[str, Dict[str, Tuple[int, int, int]]]:
+        data_dir = self._data_dir(server_id)
+        return data_dir, await run_transfer(scan, data_dir, ())
+
+    async def counted(self, body: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """Wrap a download body so it shows up in the stats while it is sent."""
+        self.active += 1
+        self.downloads += 1
+        try:
+            async for chunk in body:
+                if chunk:
+                    yield chunk
+        finally:
+            self.active -= 1
+
+    @staticmethod
+    async def _feed(reader: _BodyReader, chunk: Optional[bytes], extraction: asyncio.Future) -> bool:
+        """Queue a body chunk (None ends the body) for the extracting thread. False if it has stopped."""
+        put = asyncio.ensure_future(reader.queue.put(chunk))
+        await asyncio.wait({put, extraction}, return_when=asyncio.FIRST_COMPLETED)
+        if not put.done():
+            put.cancel()
+            return False
+        return True
+
+    async def upload(self, server_id: str, body: AsyncIterator[bytes], length: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Replace a stopped server's data directory with the contents of a tar (optionally gzipped)
+        or zip archive streamed in `body`. It is extracted into a staging directory next to the data
+        directory and swapped in once complete, so a failed upload leaves the world as it was.
+        """
+        if length is not None and length > WORLD_UPLOAD_MAX_BYTES:
+            raise TransferError(f"Archives may be at most {WORLD_UPLOAD_MAX_BYTES} bytes")
+        try:
+            # Starts, wake-ups included, wait until the new world is in place
+            async with lifecycle.hold(server_id, "upload"):
+                return await self._upload(server_id, body)
+        except LifecycleError as e:
+            raise TransferError(str(e))
+
+    async def _upload(self, server_id: str, body: AsyncIterator[bytes]) -> Dict[str, Any]:
+        data_dir = self._data_dir(server_id)
+        # Shared with backups and restores of the server
+        lock = LeaderLock(backup_store.server_lock_path(server_id))
+        if not await run_transfer(lock.try_acquire):
+            raise TransferError("A backup, restore or upload of this server is already running")
+        loop = asyncio.get_running_loop()
+        reader = _BodyReader(loop)
+        staging = f"{data_dir}.upload-{secrets.token_hex(4)}"
+        self.active += 1
+        try:
+            # The new world replaces the old one, it may take up to the whole quota
+            quota = disk_usage.quota(server_id)
+            max_bytes = min(WORLD_UPLOAD_MAX_EXTRACTED_BYTES, quota) if quota else WORLD_UPLOAD_MAX_EXTRACTED_BYTES
+            extraction = loop.run_in_executor(transfer_executor, _extract, reader, staging, max_bytes)
+            try:
+                async for chunk in body:
+                    reader.received += len(chunk)
+                    if reader.received > WORLD_UPLOAD_MAX_BYTES:
+                        raise TransferError(f"Archives may be at most {WORLD_UPLOAD_MAX_BYTES} bytes")
+                    if not await self._feed(reader, chunk, extraction):
+                        break
+                else:
+                    reader.complete = await self._feed(reader, None, extraction)
+            finally:
+                if not reader.complete:
+                    # Stopped early, the extracting thread may be waiting for more: end the body for it
+                    while not reader.queue.empty():
+                        reader.queue.get_nowait()
+                    reader.queue.put_nowait(None)
+                result = await asyncio.gather(extraction, return_exceptions=True)
+            if isinstance(result[0], BaseException):
+                raise result[0]
+            if not reader.complete:
+                raise TransferError("The upload was interrupted")
+
+            await run_transfer(_exchange, staging, data_dir)
+            self.uploads += 1
+            return {**result[0], "archive_bytes": reader.received}
+        finally:
+            self.active -= 1
+            lock.release()
+            # The old world after a swap, the partial upload otherwise
+            await run_transfer(shutil.rmtree, staging, True)
+
+
+world_transfers = WorldTransfers()
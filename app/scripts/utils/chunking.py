@@ -0,0 +1,125 @@
+"""
+Content-defined chunking and a compressed, content-addressed chunk store.
+
+Files are cut where a Gear rolling hash of the last 64 bytes hits a mask (FastCDC's normalized
+chunking), so an edit only changes the chunks around it and the rest deduplicate against earlier
+copies. Chunks are stored once, zlib-compressed, under the SHA-256 of their content.
+
+Only the standard library is used here: these functions run in worker processes.
+"""
+import hashlib
+import os
+import random
+import zlib
+from typing import List, Tuple
+
+MIN_SIZE = 16 * 1024
+AVG_SIZE = 64 * 1024
+MAX_SIZE = 256 * 1024
+READ_SIZE = 4 * 1024 * 1024
+
+_MASK_64 = (1 << 64) - 1
+# Harder to match before the average size and easier after it, which narrows the size spread.
+# The top bits of a Gear hash depend on the last 64 bytes, the low ones on just a few.
+_MASK_SMALL = ((1 << 18) - 1) << 46
+_MASK_LARGE = ((1 << 14) - 1) << 50
+# Fixed table, chunk boundaries (and with them deduplication) depend on it
+_rng = random.Random(0x6D696E65)
+_GEAR = tuple(_rng.getrandbits(64) for _ in range(256))
+del _rng
+
+
+def _cut(data: bytes, start: int, end: int) -> int:
+    """End offset of the chunk that starts at `start` in data[:end]."""
+    size = end - start
+    if size <= MIN_SIZE:
+        return end
+    limit = start + min(size, MAX_SIZE)
+    normal = start + min(size, AVG_SIZE)
+    gear = _GEAR
+    h = 0
+    i = start + MIN_SIZE
+    # Iterating a slice is quicker than indexing byte by byte
+    for byte in data[i:normal]:
+        h = ((h << 1) + gear[byte]) & _MASK_64
+        i += 1
+        if not h & _MASK_SMALL:
+            return i
+    for byte in data[i:limit]:
+        h = ((h << 1) + gear[byte]) & _MASK_64
+        i += 1
+        if not h & _MASK_LARGE:
+            return i
+    return limit
+
+
+def chunk_path(root: str, digest: str) -> str:
+    return os.path.join(root, digest[:2], digest)
+
+
+def _store_chunk(root: str, chunk: bytes, level: int) -> Tuple[str, int]:
+    """Store a chunk unless it already is. Returns its digest and the bytes it added to the store."""
+    digest = hashlib.sha256(chunk).hexdigest()
+    path = chunk_path(root, digest)
+    if os.path.exists(path):
+        return digest, 0
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    compressed = zlib.compress(chunk, level)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(compressed)
+    os.replace(tmp_path, path)
+    return digest, len(compressed)
+
+
+def store_file(path: str, root: str, level: int = 6) -> Tuple[List[str], int, int]:
+    """
+    Chunk a file into the store at `root`, reading it in bounded pieces.
+    Returns its chunk digests, how many chunks were new and how many bytes they take.
+    """
+    digests: List[str] = []
+    new_chunks = new_bytes = 0
+    with open(path, "rb") as f:
+        pending = b""
+        while True:
+            block = f.read(READ_SIZE)
+            eof = not block
+            data = pending + block if pending else block
+            offset = 0
+            # Without the end of the file in view, only cut where a whole MAX_SIZE is available
+            while offset < len(data) and (eof or len(data) - offset >= MAX_SIZE):
+                end = _cut(data, offset, len(data))
+                digest, stored = _store_chunk(root, data[offset:end], level)
+                digests.append(digest)
+                if stored:
+                    new_chunks += 1
+                    new_bytes += stored
+                offset = end
+            pending = data[offset:]
+            if eof:
+                return digests, new_chunks, new_bytes
+
+
+def read_chunk(root: str, digest: str) -> bytes:
+    with open(chunk_path(root, digest), "rb") as f:
+        chunk = zlib.decompress(f.read())
+    if hashlib.sha256(chunk).hexdigest() != digest:
+        raise ValueError(f"Chunk {digest} is corrupted")
+    return chunk
+
+
+def restore_file(root: str, digests: List[str], path: str, mode: int, mtime_ns: int) -> None:
+    """Write a file back from its chunks, replacing it in one step and keeping its mode and mtime."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.restore-{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            for digest in digests:
+                f.write(read_chunk(root, digest))
+        os.chmod(tmp_path, mode & 0o7777)
+        os.utime(tmp_path, ns=(mtime_ns, mtime_ns))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
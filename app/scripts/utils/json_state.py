@@ -0,0 +1,73 @@
+import contextlib
+import fcntl
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple
+
+
+class JSONStateFile:
+    """
+    A JSON object on disk shared by every worker process.
+
+    Writers hold an exclusive flock (and a thread lock) for the whole read-modify-write. Readers
+    that only look get the last parsed copy back until the file's mtime changes, and callers on an
+    event loop can take that copy without touching the file at all while it is recent.
+    """
+
+    def __init__(self, path: str, keys: Sequence[str] = ()):
+        self.path = path
+        self._keys = tuple(keys)
+        self._lock = threading.Lock()
+        self._cached: Optional[Tuple[Tuple[int, int], Dict[str, Any]]] = None
+        self._checked_at = 0.0
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        for key in self._keys:
+            state.setdefault(key, {})
+        return state
+
+    @contextlib.contextmanager
+    def locked(self) -> Iterator[Dict[str, Any]]:
+        """Load the state under an exclusive lock (thread and process wide) and save it on exit."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._lock, open(self.path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                state = self._load()
+
+                yield state
+
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(state, f)
+                os.replace(tmp_path, self.path)
+                self._cached = None
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def read(self) -> Dict[str, Any]:
+        """The current state, without locking. Do not modify the returned object."""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return self._load()
+        version = (stat.st_mtime_ns, stat.st_size)
+        cached = self._cached
+        if cached is None or cached[0] != version:
+            cached = self._cached = (version, self._load())
+        self._checked_at = time.monotonic()
+        return cached[1]
+
+    def recent(self, max_age: float) -> Optional[Dict[str, Any]]:
+        """The copy of the last read() if it checked the file at most `max_age` seconds ago, else None."""
+        cached = self._cached
+        if cached is None or time.monotonic() - self._checked_at > max_age:
+            return None
+        return cached[1]
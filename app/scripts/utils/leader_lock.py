@@ -0,0 +1,38 @@
+import fcntl
+import os
+from typing import IO, Optional
+
+
+class LeaderLock:
+    """
+    Elects one worker process for a job the others skip, through a non-blocking flock on a file.
+
+    The lock is held until release() or until the process exits, then the next worker to try takes over.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file: Optional[IO] = None
+
+    @property
+    def held(self) -> bool:
+        return self._file is not None
+
+    def try_acquire(self) -> bool:
+        """Whether this process is the leader, becoming it if nobody else is. Blocking, run it off the loop."""
+        if self._file is not None:
+            return True
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        lock_file = open(self.path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        return True
+
+    def release(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,62 @@
+"""
+Shared setup of the tests, run from the app directory with `python -m pytest tests`.
+
+The services read their configuration when imported, so the environment is prepared here first:
+state files go to a scratch directory and servers live on two fake Docker hosts from
+benchmarks.fake_docker, next to a fake PostgREST. The stand-ins only start for tests that use them.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.suite import StandIns  # noqa: E402
+
+WORKDIR = tempfile.mkdtemp(prefix="mc-tests-")
+HOST_MEMORY = "2G"  # room for three 512M servers with the default overhead
+
+STAND_INS = StandIns(argparse.Namespace(hosts=2, docker_latency_ms=0.0, containers=0, running_ratio=0.0,
+                                        boot_ms=0.0, log_interval_ms=1000.0, db_latency_ms=50.0), WORKDIR)
+os.environ.update(
+    HOST_PWD=WORKDIR,
+    DOCKER_HOSTS=json.dumps([dict(host, memory=HOST_MEMORY) for host in STAND_INS.hosts()]),
+    DOCKER_FIX_PERMISSIONS="false",
+    ADMISSION_ENABLED="true",
+    ADMISSION_USER_CONCURRENCY="2",
+    ADMISSION_POLL_INTERVAL="0.1",
+    ADMISSION_MEMORY_OVERHEAD="1.25",
+    PORT_BLOCK_SECONDS="600",
+    DISK_QUOTA_BYTES="0",
+)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def stand_ins():
+    STAND_INS.start()
+    yield STAND_INS
+    STAND_INS.stop()
+
+
+@pytest.fixture
+def dockers(stand_ins):
+    """The fake Docker daemons of host-0 and host-1, emptied after the test."""
+    yield stand_ins.dockers
+    for docker in stand_ins.dockers:
+        docker.containers.clear()
+
+
+@pytest.fixture
+def postgrest(stand_ins):
+    """Base URL of the fake PostgREST, its servers table is emptied after the test."""
+    yield f"http://127.0.0.1:{stand_ins.db_port}"
+    stand_ins.db_app.state.tables.clear()
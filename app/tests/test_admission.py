@@ -0,0 +1,164 @@
+import asyncio
+from typing import Callable, List, Optional
+
+import pytest
+
+from scripts.server.models.server import ServerConfig
+from scripts.server.services import admission as admission_module
+from scripts.server.services.admission import AdmissionController
+from scripts.server.services.container_cache import container_cache
+from scripts.server.services.docker_hosts import HostRegistry, docker_hosts
+
+
+@pytest.fixture
+def placements(tmp_path, monkeypatch) -> HostRegistry:
+    registry = HostRegistry(list(docker_hosts.hosts.values()), str(tmp_path / "placements.json"))
+    monkeypatch.setattr(admission_module, "docker_hosts", registry)
+    return registry
+
+
+@pytest.fixture
+def controller(tmp_path, placements) -> AdmissionController:
+    return AdmissionController(str(tmp_path / "admission.json"))
+
+
+def _config(server_id: str) -> ServerConfig:
+    return ServerConfig(id=server_id, name=server_id, type="PAPER", version="1.21.1")
+
+
+async def _wait_until(condition: Callable[[], bool], timeout: float = 5) -> None:
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def _admit_all(controller: AdmissionController, starts, admitted: List[str]) -> List[asyncio.Task]:
+    async def admit(server_id: str, user_id: Optional[str]):
+        await controller.admit(_config(server_id), user_id)
+        admitted.append(server_id)
+
+    return [asyncio.ensure_future(admit(server_id, user_id)) for server_id, user_id in starts]
+
+
+def test_users_take_turns_up_to_their_limit(controller):
+    async def run():
+        await controller.start()
+        admitted = []
+        tasks = _admit_all(controller, [("a0", "a"), ("a1", "a"), ("a2", "a"), ("a3", "a"),
+                                        ("b0", "b"), ("b1", "b")], admitted)
+        try:
+            await _wait_until(lambda: len(admitted) == 4)
+            # There is memory for two more, but user a already has two starts in progress
+            await asyncio.sleep(0.3)
+            before_finish = list(admitted)
+            await controller.finished("a0", "a")
+            await _wait_until(lambda: len(admitted) == 5)
+            return before_finish, admitted
+        finally:
+            for task in tasks:
+                task.cancel()
+            await controller.close()
+
+    before_finish, admitted = asyncio.run(run())
+    assert before_finish == ["a0", "b0", "a1", "b1"]
+    assert admitted[4] == "a2"
+
+
+def test_starts_wait_for_memory_and_spread_over_hosts(controller, placements):
+    async def run():
+        await controller.start()
+        admitted = []
+        tasks = _admit_all(controller, [(f"s{i}", f"u{i}") for i in range(7)], admitted)
+        try:
+            await _wait_until(lambda: len(admitted) == 6)
+            await asyncio.sleep(0.3)
+            full = list(admitted)
+            await asyncio.get_running_loop().run_in_executor(None, controller.release, "s0")
+            await _wait_until(lambda: len(admitted) == 7)
+            return full, admitted
+        finally:
+            for task in tasks:
+                task.cancel()
+            await controller.close()
+
+    full, admitted = asyncio.run(run())
+    assert full == [f"s{i}" for i in range(6)]
+    assert admitted[6] == "s6"
+    hosts = [placements.locate(f"s{i}").name for i in range(7)]
+    # The host with the most free memory first, the freed room of s0 for the waiting start
+    assert hosts == ["host-0", "host-1"] * 3 + ["host-0"]
+
+
+def test_placed_server_waits_for_its_own_host(controller, placements):
+    host = placements.get("host-0")
+    for server_id in ("x0", "x1", "x2", "p"):
+        placements.place(server_id, host)
+
+    async def run():
+        await controller.start()
+        admitted = []
+        tasks = _admit_all(controller, [("x0", None), ("x1", None), ("x2", None), ("p", None)], admitted)
+        try:
+            await _wait_until(lambda: len(admitted) == 3)
+            # host-1 is empty, but the world of p is on host-0
+            await asyncio.sleep(0.3)
+            waiting = "p" not in admitted
+            await asyncio.get_running_loop().run_in_executor(None, controller.release, "x0")
+            await _wait_until(lambda: "p" in admitted)
+            return waiting
+        finally:
+            for task in tasks:
+                task.cancel()
+            await controller.close()
+
+    assert asyncio.run(run())
+    assert placements.locate("p").name == "host-0"
+
+
+def test_server_waiting_for_its_host_does_not_hold_back_the_others(controller, placements):
+    host = placements.get("host-0")
+    for server_id in ("x0", "x1", "x2", "p"):
+        placements.place(server_id, host)
+
+    async def run():
+        await controller.start()
+        admitted = []
+        tasks = _admit_all(controller, [(server_id, None) for server_id in ("x0", "x1", "x2", "p", "q0", "q1")],
+                           admitted)
+        try:
+            # p waits for room on host-0, the starts queued behind it go to host-1
+            await _wait_until(lambda: len(admitted) == 5)
+            await asyncio.sleep(0.3)
+            return list(admitted)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await controller.close()
+
+    assert asyncio.run(run()) == ["x0", "x1", "x2", "q0", "q1"]
+    assert [placements.locate(server_id).name for server_id in ("q0", "q1")] == ["host-1", "host-1"]
+
+
+def test_running_servers_count_against_their_host(controller, placements, dockers):
+    for i in range(3):
+        dockers[0].add(f"running-{i}", "itzg/minecraft-server:latest", ["EULA=TRUE"], running=True)
+
+    async def run():
+        await container_cache.start()
+        try:
+            await _wait_until(lambda: container_cache.live)
+            # Admission off: the host with the fewest running servers
+            await controller.admit(_config("off"))
+            # Admission on: the untracked servers fill host-0 with the default memory
+            await controller.start()
+            try:
+                await asyncio.wait_for(controller.admit(_config("on")), 5)
+            finally:
+                await controller.close()
+        finally:
+            await container_cache.stop()
+
+    asyncio.run(run())
+    assert placements.locate("off").name == "host-1"
+    assert placements.locate("on").name == "host-1"
@@ -0,0 +1,97 @@
+import asyncio
+from typing import Callable
+
+from scripts.server.models.server import ContainerState
+from scripts.server.services.container_cache import ContainerStateCache
+
+IMAGE = "itzg/minecraft-server:latest"
+
+
+async def _wait_until(condition: Callable[[], bool], timeout: float = 5) -> None:
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+async def _wait_live(cache: ContainerStateCache, dockers) -> None:
+    # The fake daemons do not replay events from `since`, wait until they stream to the cache
+    await _wait_until(lambda: cache.live and all(docker._listeners for docker in dockers))
+
+
+def test_lookups_are_answered_from_the_event_stream(dockers):
+    dockers[0].add("listed", IMAGE, ["EULA=TRUE"], running=True)
+
+    async def run():
+        cache = ContainerStateCache()
+        # Nothing is known before the streams run
+        before = cache.lookup("listed")
+        await cache.start()
+        try:
+            await _wait_live(cache, dockers)
+            listed = cache.lookup("listed")
+            missing = cache.lookup("missing")
+            dockers[1].add("created", IMAGE, ["EULA=TRUE"], running=True)
+            await _wait_until(lambda: cache.lookup("created")[1] is not None)
+            return before, listed, missing, cache.lookup("created")[1], cache.stats()
+        finally:
+            await cache.stop()
+
+    before, (listed_hit, listed), missing, created, stats = asyncio.run(run())
+    assert before == (False, None)
+    assert listed_hit and listed.status == "running" and listed.host == "host-0"
+    assert missing == (True, None)
+    assert created.status == "running" and created.host == "host-1"
+    # While every stream is live nothing is asked of Docker
+    assert stats["misses"] == 0
+    assert stats["events"] >= 1
+
+
+def test_entries_go_stale_while_a_stream_is_down(dockers):
+    dockers[0].add("server", IMAGE, ["EULA=TRUE"], running=True)
+
+    async def run():
+        cache = ContainerStateCache(ttl=0.2)
+        await cache.start()
+        try:
+            await _wait_live(cache, dockers)
+            dockers[0].drop_streams()
+            await _wait_until(lambda: not cache.live)
+            await asyncio.sleep(0.3)
+            stale = cache.lookup("server")
+            # What a caller fetched from Docker on the miss is trusted for the TTL again
+            cache.store("server", ContainerState(id="server", status="running", port="30001"))
+            refreshed = cache.lookup("server")
+            # The stream reconnects after CONTAINER_CACHE_RETRY and resyncs
+            await _wait_until(lambda: cache.live)
+            await asyncio.sleep(0.3)
+            return stale, refreshed, cache.lookup("server"), cache.stats()
+        finally:
+            await cache.stop()
+
+    stale, refreshed, live, stats = asyncio.run(run())
+    assert stale == (False, None)
+    assert refreshed[0] and refreshed[1].host == "host-0"
+    assert live[0] and live[1].status == "running"
+    assert stats["stale"] == 1
+    assert stats["stream_drops"] == 1
+
+
+def test_stores_from_threads_are_applied_on_the_loop(dockers):
+    async def run():
+        cache = ContainerStateCache()
+        await cache.start()
+        try:
+            await _wait_until(lambda: cache.live)
+            changed = asyncio.ensure_future(cache.wait_for_change("threaded", 5))
+            await asyncio.sleep(0)
+            state = ContainerState(id="threaded", status="running", port="30002")
+            await asyncio.get_running_loop().run_in_executor(None, cache.store, "threaded", state)
+            # Visible as soon as the executor call returned
+            return cache.lookup("threaded"), await changed
+        finally:
+            await cache.stop()
+
+    (hit, state), changed = asyncio.run(run())
+    assert hit and state.port == "30002" and state.host == "host-0"
+    assert changed
@@ -0,0 +1,127 @@
+import asyncio
+from typing import List, Optional
+
+import pytest
+
+from scripts.server.models.server import ContainerState, LifecycleState, ServerConfig
+from scripts.server.services import lifecycle as lifecycle_module
+from scripts.server.services.docker_service import DockerService
+from scripts.server.services.lifecycle import LifecycleError, ServerLifecycle
+from scripts.server.services.server_service import ServerService
+from scripts.server.services.start_jobs import StartJobManager
+
+CONFIG = ServerConfig(id="lifecycle-test", name="lifecycle-test", type="PAPER", version="1.21.1")
+
+
+class FakeServer:
+    """Container state of CONFIG's server, and the starts and stops that ran, in order."""
+
+    def __init__(self, running: bool):
+        self.state: Optional[ContainerState] = self._running() if running else None
+        self.ran: List[str] = []
+        self.release_start: Optional[asyncio.Event] = None
+
+    @staticmethod
+    def _running() -> ContainerState:
+        return ContainerState(id=CONFIG.id, status="running", port="30001")
+
+    async def get_state(self, server_id: str) -> Optional[ContainerState]:
+        return self.state
+
+    async def run_start(self, job, config: ServerConfig, user_id: Optional[str] = None) -> bool:
+        await self.release_start.wait()
+        self.ran.append("start")
+        self.state = self._running()
+        return True
+
+    def stop(self, server_id: str) -> bool:
+        self.ran.append("stop")
+        self.state = None
+        return True
+
+
+@pytest.fixture
+def jobs(tmp_path, monkeypatch) -> StartJobManager:
+    jobs = StartJobManager(str(tmp_path / "start_jobs.json"))
+    monkeypatch.setattr(lifecycle_module, "start_jobs", jobs)
+    return jobs
+
+
+@pytest.fixture
+def server(jobs, monkeypatch):
+    def make(running: bool) -> FakeServer:
+        fake = FakeServer(running)
+        monkeypatch.setattr(DockerService, "get_container_state_async", fake.get_state)
+        monkeypatch.setattr(ServerService, "stop_server", fake.stop)
+        monkeypatch.setattr(jobs, "run", fake.run_start)
+        return fake
+    return make
+
+
+def _run(jobs: StartJobManager, body):
+    async def run():
+        try:
+            return await body()
+        finally:
+            await jobs.close()
+    return asyncio.run(run())
+
+
+def test_concurrent_starts_share_one_operation(server, jobs):
+    fake = server(running=False)
+    lifecycle = ServerLifecycle()
+
+    async def body():
+        fake.release_start = asyncio.Event()
+        first, second = await asyncio.gather(lifecycle.start(CONFIG, "u1"), lifecycle.start(CONFIG, "u1"))
+        state = lifecycle.state(CONFIG.id)
+        fake.release_start.set()
+        started = await first.task
+        with pytest.raises(LifecycleError, match="already running"):
+            await lifecycle.start(CONFIG, "u1")
+        return first is second, state, started
+
+    shared, state, started = _run(jobs, body)
+    assert shared and started
+    assert state == LifecycleState.STARTING
+    assert fake.ran == ["start"]
+    assert lifecycle.stats() == {"servers": 0, "starts": 1, "stops": 0, "joined": 1, "rejected": 1}
+
+
+def test_concurrent_stops_share_one_operation(server, jobs):
+    fake = server(running=True)
+    lifecycle = ServerLifecycle()
+
+    async def body():
+        first, second = await asyncio.gather(lifecycle.stop(CONFIG.id), lifecycle.stop(CONFIG.id))
+        stopped = await first.task
+        with pytest.raises(LifecycleError, match="not running"):
+            await lifecycle.stop(CONFIG.id)
+        return first is second, stopped
+
+    shared, stopped = _run(jobs, body)
+    assert shared and stopped
+    assert fake.ran == ["stop"]
+    assert lifecycle.stats() == {"servers": 0, "starts": 0, "stops": 1, "joined": 1, "rejected": 1}
+
+
+def test_start_waits_for_a_queued_stop(server, jobs):
+    fake = server(running=True)
+    lifecycle = ServerLifecycle()
+
+    async def body():
+        fake.release_start = asyncio.Event()
+        fake.release_start.set()
+        stop = await lifecycle.stop(CONFIG.id)
+        # Not refused although the server still runs, it is queued behind the stop
+        start = await lifecycle.start(CONFIG, "u1")
+        joined = await lifecycle.start(CONFIG, "u1")
+        # A stop asked for now comes after the start, it does not join the first stop
+        last_stop = await lifecycle.stop(CONFIG.id)
+        await asyncio.gather(stop.task, start.task, last_stop.task)
+        return start is joined, last_stop is stop
+
+    start_joined, stop_joined = _run(jobs, body)
+    assert start_joined and not stop_joined
+    assert fake.ran == ["stop", "start", "stop"]
+    assert lifecycle.stats() == {"servers": 0, "starts": 1, "stops": 2, "joined": 1, "rejected": 0}
@@ -0,0 +1,97 @@
+import asyncio
+import json
+
+import pytest
+
+from scripts.server.services.minecraft_ping import (
+    PingError, ServerPinger, decode_varint, encode_packet, encode_string, encode_varint, read_packet
+)
+
+STATUS = {"version": {"name": "1.21.1", "protocol": 767}, "players": {"online": 3, "max": 20},
+          "description": {"text": "§aHello", "extra": [{"text": " world"}]}}
+
+
+def _reader(data: bytes) -> asyncio.StreamReader:
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return reader
+
+
+@pytest.mark.parametrize("value", [0, 1, 127, 128, 255, 25565, 2097151, 2 ** 31 - 1])
+def test_varint_round_trip(value):
+    data = encode_varint(value) + b"rest"
+    assert decode_varint(data, 0) == (value, len(data) - 4)
+
+
+def test_negative_varint_takes_five_bytes():
+    assert encode_varint(-1) == b"\xff\xff\xff\xff\x0f"
+    assert decode_varint(encode_varint(-1), 0) == (0xFFFFFFFF, 5)
+
+
+def test_truncated_varint_is_refused():
+    with pytest.raises(PingError, match="Truncated"):
+        decode_varint(encode_varint(300)[:1], 0)
+
+
+def test_packet_round_trip():
+    async def run():
+        payload = encode_string("héllo") + encode_varint(25565)
+        reader = _reader(encode_packet(0x00, payload) + encode_packet(0x01))
+        return await read_packet(reader), await read_packet(reader)
+
+    (first_id, first), (second_id, second) = asyncio.run(run())
+    assert first_id == 0x00
+    length, offset = decode_varint(first, 0)
+    assert first[offset:offset + length].decode("utf-8") == "héllo"
+    assert decode_varint(first, offset + length) == (25565, len(first))
+    assert (second_id, second) == (0x01, b"")
+
+
+def test_oversized_packet_is_refused():
+    async def run():
+        await read_packet(_reader(encode_varint(1 << 22) + b"\0"))
+
+    with pytest.raises(PingError, match="Invalid packet length"):
+        asyncio.run(run())
+
+
+def test_cancelled_first_caller_does_not_fail_the_others():
+    async def run():
+        answer = asyncio.Event()
+        connections = []
+
+        async def serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            connections.append(writer)
+            await read_packet(reader)  # handshake
+            await read_packet(reader)  # status request
+            await answer.wait()
+            status = json.dumps(STATUS).encode("utf-8")
+            writer.write(encode_packet(0x00, encode_varint(len(status)) + status))
+            _, token = await read_packet(reader)
+            writer.write(encode_packet(0x01, token))
+            await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(serve, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            pinger = ServerPinger(host="127.0.0.1")
+            first = asyncio.ensure_future(pinger.ping(port, timeout=5))
+            await asyncio.sleep(0.05)
+            joined = [asyncio.ensure_future(pinger.ping(port, timeout=5)) for _ in range(3)]
+            await asyncio.sleep(0)
+            first.cancel()
+            answer.set()
+            results = await asyncio.gather(*joined)
+            return first.cancelled(), results, len(connections), pinger._inflight
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    cancelled, results, connections, inflight = asyncio.run(run())
+    assert cancelled
+    assert [result.online_players for result in results] == [3] * 3
+    assert results[0].motd == "Hello world"
+    assert connections == 1
+    assert inflight == {}
@@ -0,0 +1,68 @@
+import asyncio
+import time
+
+import pytest
+
+from scripts.server.services.container_cache import container_cache
+from scripts.server.services.port_allocator import PortAllocator, PortsExhausted
+
+
+def _allocator(tmp_path, start: int = 31000, end: int = 31002) -> PortAllocator:
+    return PortAllocator(str(tmp_path / "ports.json"), start, end)
+
+
+def test_server_keeps_its_port(tmp_path):
+    allocator = _allocator(tmp_path)
+    first, second = allocator.allocate("a"), allocator.allocate("b")
+    assert first != second
+    allocator.release("a")
+    allocator.release("b")
+    assert allocator.allocate("b") == second
+    assert allocator.allocate("a") == first
+    assert allocator.lookup("a") == first
+
+
+def test_leased_ports_are_not_handed_out_twice(tmp_path):
+    allocator = _allocator(tmp_path)
+    ports = {allocator.allocate(server_id) for server_id in ("a", "b", "c")}
+    assert ports == {31000, 31001, 31002}
+    with pytest.raises(PortsExhausted):
+        allocator.allocate("d")
+
+
+def test_full_range_reassigns_the_longest_stopped_server(tmp_path):
+    allocator = _allocator(tmp_path)
+    ports = {server_id: allocator.allocate(server_id) for server_id in ("a", "b", "c")}
+    allocator.release("b")
+    time.sleep(0.01)
+    allocator.release("a")
+    assert allocator.allocate("d") == ports["b"]
+    assert allocator.lookup("b") is None
+    assert allocator.lookup("a") == ports["a"]
+
+
+def test_blocked_port_is_skipped(tmp_path):
+    allocator = _allocator(tmp_path)
+    port = allocator.allocate("a")
+    allocator.block("a", port)
+    assert allocator.lookup("a") is None
+    assert allocator.allocate("a") != port
+    assert allocator.allocate("b") not in (port, allocator.lookup("a"))
+
+
+def test_ports_published_by_other_containers_are_skipped(tmp_path, dockers):
+    # A container started outside the pool, on a port of its range
+    dockers[0].add("outsider", "nginx", [], running=True,
+                   host_config={"PortBindings": {"25565/tcp": [{"HostPort": "31001"}]}})
+
+    async def run():
+        await container_cache.start()
+        try:
+            while not container_cache.live:
+                await asyncio.sleep(0.01)
+            allocator = _allocator(tmp_path)
+            return [allocator.allocate(server_id) for server_id in ("a", "b")]
+        finally:
+            await container_cache.stop()
+
+    assert asyncio.run(run()) == [31000, 31002]
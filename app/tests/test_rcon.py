@@ -0,0 +1,90 @@
+import asyncio
+import struct
+
+import pytest
+
+from benchmarks import fake_rcon
+from scripts.server.services import rcon
+from scripts.server.services.docker_hosts import DockerHost, HostRegistry
+from scripts.server.services.rcon import (
+    TYPE_COMMAND, TYPE_LOGIN, RconConnection, RconError, RconPool, _packet, _read_packet, container_address
+)
+
+
+def _reader(data: bytes) -> asyncio.StreamReader:
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return reader
+
+
+def test_packet_framing():
+    data = _packet(7, TYPE_COMMAND, "say héllo")
+    # Length of what follows it: ID, type, payload, two NUL bytes
+    assert struct.unpack("<i", data[:4])[0] == len(data) - 4 == 8 + len("say héllo".encode("utf-8")) + 2
+    assert data.endswith(b"\x00\x00")
+
+    async def run():
+        reader = _reader(data + _packet(8, TYPE_LOGIN, ""))
+        return await _read_packet(reader), await _read_packet(reader)
+
+    assert asyncio.run(run()) == ((7, TYPE_COMMAND, "say héllo"), (8, TYPE_LOGIN, ""))
+
+
+@pytest.mark.parametrize("length", [9, 1 << 17])
+def test_invalid_packet_length_is_refused(length):
+    async def run():
+        await _read_packet(_reader(struct.pack("<i", length) + b"\0" * 16))
+
+    with pytest.raises(RconError, match="Invalid packet length"):
+        asyncio.run(run())
+
+
+def test_pipelined_commands_get_their_own_output():
+    async def run():
+        server = await asyncio.start_server(fake_rcon._handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            connection = await RconConnection.open("127.0.0.1", port, "secret", 5)
+            try:
+                # The help output is split over several packets, the list answer comes after it
+                return await asyncio.gather(connection.execute("help", 5), connection.execute("list", 5))
+            finally:
+                connection.close()
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    help_output, list_output = asyncio.run(run())
+    assert help_output == fake_rcon.HELP_TEXT
+    assert len(help_output) > fake_rcon.MAX_CHUNK
+    assert list_output == "Ran list"
+
+
+def test_refused_login():
+    async def run():
+        server = await asyncio.start_server(fake_rcon._handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            await RconConnection.open("127.0.0.1", port, "", 5)
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    with pytest.raises(RconError, match="login refused"):
+        asyncio.run(run())
+
+
+def test_address_on_a_network_of_the_backend():
+    container = {"NetworkSettings": {"IPAddress": "172.17.0.5", "Networks": {
+        "bridge": {"IPAddress": "172.17.0.5"}, "traefik-public": {"IPAddress": "172.20.0.9"}}}}
+    assert container_address(container) == "172.17.0.5"
+    assert container_address(container, {"traefik-public"}) == "172.20.0.9"
+    assert container_address(container, {"other"}) is None
+
+
+def test_servers_on_remote_hosts_are_refused(tmp_path, monkeypatch):
+    remote = DockerHost("remote", "tcp://10.0.0.2:2375", "10.0.0.2")
+    monkeypatch.setattr(rcon, "docker_hosts", HostRegistry([remote], str(tmp_path / "placements.json")))
+    with pytest.raises(RconError, match="not available for servers on host remote"):
+        asyncio.run(RconPool()._open("s1"))
@@ -0,0 +1,71 @@
+import asyncio
+import time
+
+import jwt
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+
+from fastapi_server.core import security
+from scripts.utils.lru_cache import ExpiringLRUCache
+
+SECRET = "test-secret-of-at-least-32-bytes-long"
+ISSUER = "http://127.0.0.1/auth/v1"
+
+
+class Clock:
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(security, "JWT_SECRET", SECRET)
+    monkeypatch.setattr(security, "JWT_ISSUER", ISSUER)
+    monkeypatch.setattr(security, "token_cache", ExpiringLRUCache(16, clock=clock))
+    return clock
+
+
+def _token(**claims) -> str:
+    claims = dict({"sub": "u1", "aud": "authenticated", "iss": ISSUER}, **claims)
+    return jwt.encode(claims, SECRET, algorithm="HS256")
+
+
+def _verify(token: str):
+    return asyncio.run(security.verify_token(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)))
+
+
+def test_verified_token_is_cached_until_its_exp(clock, monkeypatch):
+    exp = int(clock.now) + 60
+    token = _token(exp=exp)
+    assert _verify(token)["sub"] == "u1"
+    # A different secret would refuse it, the cached payload is served instead
+    monkeypatch.setattr(security, "JWT_SECRET", "rotated-secret-of-at-least-32-bytes")
+    assert _verify(token)["sub"] == "u1"
+    assert security.token_cache.hits == 1
+
+    clock.now = exp
+    with pytest.raises(HTTPException) as error:
+        _verify(token)
+    assert error.value.status_code == 401
+    assert security.token_cache.expirations == 1
+
+
+def test_token_without_exp_is_not_cached(clock):
+    token = _token()
+    assert _verify(token)["sub"] == "u1"
+    assert _verify(token)["sub"] == "u1"
+    assert len(security.token_cache) == 0
+    assert security.token_cache.hits == 0
+
+
+def test_invalid_tokens_are_refused(clock):
+    for token in (_token(exp=int(clock.now) - 10), _token(exp=int(clock.now) + 60, aud="other"), "not-a-token"):
+        with pytest.raises(HTTPException) as error:
+            _verify(token)
+        assert error.value.status_code == 401
+    assert len(security.token_cache) == 0
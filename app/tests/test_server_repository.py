@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from benchmarks import fake_postgrest
+from scripts.server.services.server_repository import ServerExistsError, ServerRepository
+
+ROW = {"id": "s1", "user_id": "u1", "name": "survival", "type": "PAPER", "version": "1.21.1", "deleted_at": None}
+
+
+def _repository(postgrest, stand_ins) -> ServerRepository:
+    stand_ins.db_app.state.tables["servers"] = [dict(ROW)]
+    return ServerRepository(url=postgrest, key="test")
+
+
+def test_concurrent_reads_share_one_query(postgrest, stand_ins):
+    async def run():
+        repository = _repository(postgrest, stand_ins)
+        try:
+            queries = stand_ins.db_app.state.queries
+            rows = await asyncio.gather(*(repository.get("s1") for _ in range(10)))
+            listings = await asyncio.gather(*(repository.list_for_user("u1") for _ in range(10)))
+            return rows, listings, stand_ins.db_app.state.queries - queries, repository.coalesced
+        finally:
+            await repository.close()
+
+    rows, listings, queries, coalesced = asyncio.run(run())
+    assert all(row["name"] == "survival" for row in rows)
+    assert all([row["id"] for row in listing] == ["s1"] for listing in listings)
+    assert queries == 2
+    assert coalesced == 18
+
+
+def test_cancelled_first_caller_does_not_fail_the_others(postgrest, stand_ins):
+    async def run():
+        repository = _repository(postgrest, stand_ins)
+        try:
+            first = asyncio.ensure_future(repository.get("s1"))
+            await asyncio.sleep(0)
+            joined = [asyncio.ensure_future(repository.get("s1")) for _ in range(3)]
+            await asyncio.sleep(0.01)
+            first.cancel()
+            rows = await asyncio.gather(*joined)
+            return first.cancelled(), rows, repository._inflight
+        finally:
+            await repository.close()
+
+    cancelled, rows, inflight = asyncio.run(run())
+    assert cancelled
+    assert [row["id"] for row in rows] == ["s1"] * 3
+    assert inflight == {}
+
+
+def test_failed_query_reaches_every_caller():
+    async def run():
+        # Nothing listens there, every caller gets the connection error of the one query
+        repository = ServerRepository(url="http://127.0.0.1:9", key="test")
+        try:
+            return await asyncio.gather(*(repository.get("s1") for _ in range(3)), return_exceptions=True)
+        finally:
+            await repository.close()
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, Exception) for result in results)
+    assert len({id(result) for result in results}) == 1
+
+
+@pytest.mark.parametrize("constraint", [True, False])
+def test_names_are_unique_per_user(postgrest, stand_ins, monkeypatch, constraint):
+    if not constraint:
+        # A table the migration was not applied to, the upsert is refused
+        monkeypatch.setitem(fake_postgrest.UNIQUE, "servers", [])
+
+    async def run():
+        repository = _repository(postgrest, stand_ins)
+        try:
+            created = await repository.create("u1", "creative", "1.21.1", "PAPER")
+            other_user = await repository.create("u2", "survival", "1.21.1", "PAPER")
+            with pytest.raises(ServerExistsError):
+                await repository.create("u1", "survival", "1.21.1", "PAPER")
+            return created, other_user, repository._upsert
+        finally:
+            await repository.close()
+
+    created, other_user, upsert = asyncio.run(run())
+    assert (created["user_id"], created["name"]) == ("u1", "creative")
+    assert (other_user["user_id"], other_user["name"]) == ("u2", "survival")
+    assert upsert == constraint
+    names = sorted((row["user_id"], row["name"]) for row in stand_ins.db_app.state.tables["servers"])
+    assert names == [("u1", "creative"), ("u1", "survival"), ("u2", "survival")]
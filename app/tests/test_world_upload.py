@@ -0,0 +1,117 @@
+import asyncio
+import glob
+import io
+import os
+import shutil
+import tarfile
+import zipfile
+from typing import AsyncIterator, Dict
+
+import pytest
+
+from scripts.server.config import DATA_DIR_TEMPLATE, HOST_PWD
+from scripts.server.services import world_transfer
+from scripts.server.services.world_transfer import TransferError, world_transfers
+
+SERVER_ID = "world-test"
+DATA_DIR = DATA_DIR_TEMPLATE.format(base_dir=HOST_PWD, server_id=SERVER_ID)
+
+
+@pytest.fixture
+def world(dockers):
+    """A stopped server (no container on the fake host) with a one file world."""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    with open(os.path.join(DATA_DIR, "level.dat"), "w") as f:
+        f.write("old world")
+    yield DATA_DIR
+    for path in glob.glob(DATA_DIR + "*"):
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _tar(files: Dict[str, bytes], mode: str = "w:gz") -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=mode) as archive:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def _zip(files: Dict[str, bytes]) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in files.items():
+            archive.writestr(zipfile.ZipInfo(name), data, zipfile.ZIP_DEFLATED)
+    return buffer.getvalue()
+
+
+async def _body(data: bytes) -> AsyncIterator[bytes]:
+    for offset in range(0, len(data), 4096):
+        yield data[offset:offset + 4096]
+
+
+def _upload(data: bytes) -> Dict[str, int]:
+    return asyncio.run(world_transfers.upload(SERVER_ID, _body(data), len(data)))
+
+
+def _assert_world_unchanged() -> None:
+    assert os.listdir(DATA_DIR) == ["level.dat"]
+    with open(os.path.join(DATA_DIR, "level.dat")) as f:
+        assert f.read() == "old world"
+    assert glob.glob(DATA_DIR + ".upload-*") == []
+
+
+@pytest.mark.parametrize("archive", [_tar, _zip])
+def test_upload_replaces_the_world(world, archive):
+    result = _upload(archive({"level.dat": b"new world", "region/r.0.0.mca": b"\0" * 10000}))
+    assert result["files"] == 2
+    assert result["bytes"] == 10009
+    with open(os.path.join(DATA_DIR, "level.dat")) as f:
+        assert f.read() == "new world"
+    assert os.path.getsize(os.path.join(DATA_DIR, "region", "r.0.0.mca")) == 10000
+    assert glob.glob(DATA_DIR + ".upload-*") == []
+
+
+@pytest.mark.parametrize("archive", [_tar, _zip])
+@pytest.mark.parametrize("name", ["../escaped.txt", "region/../../escaped.txt", "/tmp/escaped.txt", "C:/escaped.txt"])
+def test_paths_outside_the_world_are_refused(world, archive, name):
+    with pytest.raises(TransferError, match="Unsafe path"):
+        _upload(archive({"level.dat": b"new world", name: b"payload"}))
+    _assert_world_unchanged()
+    assert not os.path.exists(os.path.join(os.path.dirname(DATA_DIR), "escaped.txt"))
+
+
+@pytest.mark.parametrize("archive", [_tar, _zip])
+def test_extracted_size_is_limited(world, archive, monkeypatch):
+    monkeypatch.setattr(world_transfer, "WORLD_UPLOAD_MAX_EXTRACTED_BYTES", 50000)
+    # Compresses to a few hundred bytes, the limit is on what it unpacks to
+    with pytest.raises(TransferError, match="unpacks to more than 50000 bytes"):
+        _upload(archive({"level.dat": b"new world", "bomb": b"\0" * 1000000}))
+    _assert_world_unchanged()
+
+
+@pytest.mark.parametrize("archive", [_tar, _zip])
+def test_file_count_is_limited(world, archive, monkeypatch):
+    monkeypatch.setattr(world_transfer, "WORLD_UPLOAD_MAX_FILES", 2)
+    with pytest.raises(TransferError, match="more than 2 files"):
+        _upload(archive({f"file-{i}": b"data" for i in range(3)}))
+    _assert_world_unchanged()
+
+
+def test_archive_size_is_limited(world, monkeypatch):
+    monkeypatch.setattr(world_transfer, "WORLD_UPLOAD_MAX_BYTES", 1000)
+    data = _tar({"level.dat": os.urandom(5000)}, mode="w")
+    with pytest.raises(TransferError, match="at most 1000 bytes"):
+        _upload(data)
+    # A body longer than it announced is cut off while it streams
+    with pytest.raises(TransferError, match="at most 1000 bytes"):
+        asyncio.run(world_transfers.upload(SERVER_ID, _body(data), 500))
+    _assert_world_unchanged()
+
+
+def test_running_server_is_refused(world, dockers):
+    dockers[0].add(SERVER_ID, "itzg/minecraft-server:latest", ["EULA=TRUE"], running=True)
+    with pytest.raises(TransferError, match="Stop the server"):
+        _upload(_tar({"level.dat": b"new world"}))
+    _assert_world_unchanged()
@@ -0,0 +1,7 @@
+-- Server names are unique per user, deleted servers included. The backend creates servers with one
+-- upsert on this constraint (on_conflict=user_id,name) instead of a check followed by an insert.
+--
+-- Fails if a user already has two servers with the same name, list them first with:
+--   select user_id, name, count(*) from public.servers group by user_id, name having count(*) > 1;
+alter table public.servers
+    add constraint servers_user_id_name_key unique (user_id, name);